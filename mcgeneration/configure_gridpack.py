@@ -1,17 +1,24 @@
 import os
+import copy
 import subprocess
 import shutil
 import itertools
 import random
 import time
 
-from helpers.helper_tools import linspace, parse_limit_file, find_process
+import numpy as np
+
+from helpers.helper_tools import linspace, find_process
 from helpers.ScanType import ScanType
 from helpers.BatchType import BatchType
 from helpers.DegreeOfFreedom import DegreeOfFreedom
 from helpers.JobTracker import JobTracker
-from helpers.Gridpack import Gridpack
+from helpers.WorkAreaIndex import WorkAreaIndex
+from helpers.Gridpack import Gridpack, SetupResult
 from helpers.MGProcess import MGProcess
+from helpers.PointIndex import PointIndex
+from helpers.LimitsRegistry import LimitsRegistry
+from helpers.CostEstimator import CostEstimator
 
 #voms-proxy-init -voms cms -valid 192:00
 #nohup python configure_gridpack.py >& output.log &
@@ -145,7 +152,10 @@ def cmsconnect_chain_submit(gridpack,dofs,proc_list,tag_postfix,rwgt_pts,runs,st
         print "ERROR: For Batch jobs, need to specify at least 1 run!"
         return
 
-    tracker = JobTracker(fdir=os.getcwd())
+    # The tracker refreshes the work area snapshot once per check, which the gridpacks then use for exists()
+    work_area = WorkAreaIndex(gridpack.HOME_DIR)
+    tracker = JobTracker(fdir=gridpack.HOME_DIR,work_area=work_area)
+    gridpack.setOptions(work_area=work_area)
     max_gen = 5         # Max number of CODEGEN jobs to have running
     max_int = 7         # Max number of INTEGRATE jobs to have running
     max_run = 25        # Max number of total jobs running
@@ -158,6 +168,7 @@ def cmsconnect_chain_submit(gridpack,dofs,proc_list,tag_postfix,rwgt_pts,runs,st
     proc_filter = ["^%s$" % (x.getName()) for x in proc_list]
     tags_filter = ["^%s$" % (tag_postfix)] + ["^%s%s$" % (x.getName(),tag_postfix) for x in dofs]
     tracker.setJobFilters(procs=proc_filter,tags=tags_filter)
+    point_indices = {}  # Keeps track of the rwgt points already used by each process, persists between checks
     done = False
     while not done:
         tracker.update()
@@ -187,7 +198,7 @@ def cmsconnect_chain_submit(gridpack,dofs,proc_list,tag_postfix,rwgt_pts,runs,st
             p,c,r = job.split('_')
             p_obj = find_process(p,proc_list)
             if p_obj is None: continue 
-            tmp_gp = Gridpack(tag=c,run=int(r[3:]))
+            tmp_gp = Gridpack(home_dir=gridpack.HOME_DIR,tag=c,run=int(r[3:]),work_area=work_area)
             tmp_gp.setProcess(p_obj)
             if not tmp_gp.exists():
                 continue
@@ -220,9 +231,12 @@ def cmsconnect_chain_submit(gridpack,dofs,proc_list,tag_postfix,rwgt_pts,runs,st
                         tag_postfix=tag_postfix,
                         max_submits=max_submits
                     )
-            elif stype == ScanType.FRANDOM:
+            elif stype in ScanType.getNDimTypes():
                 start_pts = []
                 for idx in range(runs):
+                    if gridpack.getOption('optimize_start'):
+                        # Let the gridpack choose the starting point based on its rwgt points
+                        break
                     # Note: This means all runs will have the same MadGraph starting point
                     pt = {}
                     for dof in dofs:
@@ -238,13 +252,15 @@ def cmsconnect_chain_submit(gridpack,dofs,proc_list,tag_postfix,rwgt_pts,runs,st
                     max_submits=max_submits
                 )
             elif stype == ScanType.FROMFILE:
+                if not point_indices.has_key(p.getName()):
+                    point_indices[p.getName()] = PointIndex()
                 submitted += submit_scanfile_jobs(
                     gp=gridpack,
                     dofs=dofs,
                     tag=tag_postfix,
                     scan_files=scan_files[p.getName()],
-                    max_submits=max_submits
-
+                    max_submits=max_submits,
+                    point_index=point_indices[p.getName()]
                 )
             elif stype == ScanType.NONE:
                 # No reweighting is done and SM starting point is used
@@ -270,27 +286,56 @@ def cmsconnect_chain_submit(gridpack,dofs,proc_list,tag_postfix,rwgt_pts,runs,st
             done = True
         else:
             time.sleep(delay)
+    gridpack.setOptions(work_area=None)
     print "Done submitting jobs!"
     print "IMPORTANT: Make sure to check the condor_q for any held jobs!"
     #print "IMPORTANT: There could still be (soon to be orphaned) running jobs, make sure to check that they complete properly!"
 
+# Sets up many gridpacks concurrently, then submits the ones which were newly set up in the listed order
+#   configs: List of (gridpack,configure kwargs) tuples, see Gridpack.setupMany()
+def setup_and_submit(configs,workers,max_submits=-1,delay=10.0):
+    submitted = 0
+    while len(configs):
+        # Only set up as many gridpacks as can still be submitted
+        n = len(configs) if max_submits <= 0 else max_submits - submitted
+        if n <= 0:
+            break
+        chunk,configs = configs[:n],configs[n:]
+        for res in Gridpack.setupMany(chunk,workers=workers):
+            gp = res.gridpack
+            if res.status == SetupResult.SKIPPED:
+                print "Skipping gridpack: %s" % (gp.getSetupString())
+                continue
+            elif not res.isSetup():
+                continue
+            print gp.baseSettings(),
+            submitted += gp.submit()
+            time.sleep(delay)
+            print ""
+    return submitted
+
 # Creates 1-D gridpacks at multiple linspaced starting points for each WC specified
-def submit_1dim_jobs(gp,dofs,npts,runs,tag_postfix='',max_submits=-1,run_wl={}):
+#   Note: If workers > 1, the gridpacks are set up concurrently before any of them get submitted
+def submit_1dim_jobs(gp,dofs,npts,runs,tag_postfix='',max_submits=-1,run_wl={},workers=1):
     submitted = 0
+    configs = []
     delay    =  10.0   # Time between successful submits (in seconds)
-    wc_limits = parse_limit_file(os.path.join("addons/limits","dim6top_LO_UFO_limits.txt"))
-    for dof in dofs:
+    low_arr,high_arr = LimitsRegistry.getShared().getLimitArrays(
+        gp.getOption('process'),
+        [dof.getName() for dof in dofs],
+        fpaths=gp.getLimitsFiles()
+    )
+    for dof_idx,dof in enumerate(dofs):
         dof_name = dof.getName()
-        lim_key = "{process}_{wc}".format(process=gp.getOption('process'),wc=dof_name)
         tag = dof_name + tag_postfix
         if dof.hasLimits():
             # The dof already has limits, re-use them
             low_lim = dof.getLow()
             high_lim = dof.getHigh()
-        elif wc_limits.has_key(lim_key):
+        elif not np.isnan(low_arr[dof_idx]):
             # Use limits from the limits file for this process
-            low_lim  = round(wc_limits[lim_key][0],6)
-            high_lim = round(wc_limits[lim_key][1],6)
+            low_lim  = float(low_arr[dof_idx])
+            high_lim = float(high_arr[dof_idx])
         else:
             low_lim,high_lim = gp.getOption('default_limits')
         for idx,start in enumerate(linspace(low_lim,high_lim,runs)):
@@ -299,6 +344,9 @@ def submit_1dim_jobs(gp,dofs,npts,runs,tag_postfix='',max_submits=-1,run_wl={}):
             pt = {}
             pt[dof.getName()] = start
             dof.setLimits(start,low_lim,high_lim)
+            if workers > 1:
+                configs.append((gp,dict(tag=tag,run=idx,dofs=[copy.deepcopy(dof)],num_pts=npts,start_pt=pt)))
+                continue
             gp.configure(
                 tag=tag,
                 run=idx,
@@ -316,13 +364,16 @@ def submit_1dim_jobs(gp,dofs,npts,runs,tag_postfix='',max_submits=-1,run_wl={}):
                 print "Skipping gridpack: %s" % (gp.getSetupString())
             if max_submits > 0 and submitted >= max_submits:
                 return submitted
+    if len(configs):
+        submitted += setup_and_submit(configs,workers,max_submits=max_submits,delay=delay)
     return submitted
 
 # Creates n-D gridpacks using as many starting points as possible
 #   Note: If more runs are requested then available starting points, the gridpack
 #         will automatically choose a random starting point
-def submit_ndim_jobs(gp,dofs,npts,runs,tag,start_pts=[],max_submits=-1):
+def submit_ndim_jobs(gp,dofs,npts,runs,tag,start_pts=[],max_submits=-1,workers=1):
     submitted = 0
+    configs = []
     delay = 10.0   # Time between successful submits (in seconds)
     for idx in range(runs):
         for dof in dofs:
@@ -331,6 +382,9 @@ def submit_ndim_jobs(gp,dofs,npts,runs,tag,start_pts=[],max_submits=-1):
         pt = {}
         if idx < len(start_pts):
             for k,v in start_pts[idx].iteritems(): pt[k] = v
+        if workers > 1:
+            configs.append((gp,dict(tag=tag,run=idx,dofs=dofs,num_pts=npts,start_pt=pt)))
+            continue
         gp.configure(
             tag=tag,
             run=idx,
@@ -348,15 +402,23 @@ def submit_ndim_jobs(gp,dofs,npts,runs,tag,start_pts=[],max_submits=-1):
             print "Skipping gridpack: %s" % (gp.getSetupString())
         if max_submits > 0 and submitted >= max_submits:
             return submitted
+    if len(configs):
+        submitted += setup_and_submit(configs,workers,max_submits=max_submits,delay=delay)
     return submitted
 
 # Creates gridpacks using starting points and rwgt points extracted from scanpoints files
-def submit_scanfile_jobs(gp,dofs,tag,scan_files,max_submits=-1):
+#   Note: If a point_index is given, rwgt points which already appear in an earlier scanfile are skipped
+def submit_scanfile_jobs(gp,dofs,tag,scan_files,max_submits=-1,point_index=None,workers=1):
     submitted = 0
+    configs = []
     delay = 10.0
+    gp.setOptions(point_index=point_index)
     for idx,file in enumerate(scan_files):
         if not os.path.exists(file):
             continue
+        if workers > 1:
+            configs.append((gp,dict(tag=tag,run=idx,dofs=dofs,num_pts=0,scan_file=file)))
+            continue
         gp.configure(
             tag=tag,
             run=idx,
@@ -373,7 +435,10 @@ def submit_scanfile_jobs(gp,dofs,tag,scan_files,max_submits=-1):
         else:
             print "Skipping gridpack: %s" % (gp.getSetupString())
         if max_submits > 0 and submitted >= max_submits:
-            return submitted
+            break
+    if len(configs):
+        submitted += setup_and_submit(configs,workers,max_submits=max_submits,delay=delay)
+    gp.setOptions(point_index=None)
     return submitted
 
 def main():
@@ -383,6 +448,11 @@ def main():
     tag   = 'ExampleTag'
     runs  = 1               # if set to 0, will only make a single gridpack
     npts  = 0
+    plan_events = 10000     # Events per gridpack run, used to estimate the cost of the campaign
+    print_plan  = False     # Print the estimated cost of the campaign (reads the '<setup>.log' files in the cwd)
+    plan_only   = False     # Only print the estimated cost of the campaign, without configuring any gridpacks
+    setup_workers = 1       # If > 1, the gridpacks of each process are set up concurrently before being submitted
+    scan_array  = True      # Also save the scan points to a binary '<setup>_scanpoints.npy' file (faster to load for large scans)
     #scan_files = [
     #    'scanfiles/ttll_16DOldLimitsAxisScan_run1_scanpoints.txt', # TOP-10-001 ttHJet start pt
     #    'scanfiles/ttHJet_22WCs_v0.txt',
@@ -470,6 +540,7 @@ def main():
 
     gridpack = Gridpack(stype=stype,btype=btype,default_limits=[-20.0,20.0])
     gridpack.setOptions(runcard_ops=rc_ops)
+    gridpack.setOptions(scan_array=scan_array)
     # For using a different model
     gridpack.setOptions(coupling_string="FCNC=0 DIM6=1",replace_model="dim6top_LO_UFO_19-05-20")
     # For creating feynman diagrams
@@ -478,8 +549,27 @@ def main():
 
     if stype == ScanType.SLINSPACE:
         tag = tag + "AxisScan"
-    elif stype == ScanType.FRANDOM:
+    elif stype in ScanType.getFullScanTypes():
         tag = tag + "FullScan"
+    elif stype == ScanType.PLINSPACE:
+        tag = tag + "PlaneScan"
+
+    if print_plan or plan_only:
+        # Estimate the cost of the campaign, calibrated from the logs of previously produced gridpacks
+        estimator = CostEstimator(fdir=os.getcwd())
+        estimator.calibrate()
+        plan = estimator.plan(
+            proc_list=proc_list,
+            dofs=dof_list,
+            stype=stype,
+            num_pts=npts,
+            runs=runs,
+            events=plan_events,
+            scan_files=scan_files
+        )
+        print estimator.formatPlan(plan,events=plan_events)
+        if plan_only:
+            return
 
     if btype == BatchType.CMSCONNECT:
         # For submitting on CMSCONNECT, uses a way to track running jobs
@@ -503,7 +593,7 @@ def main():
         gridpack.setProcess(p)
 
         # If runs == 0, we probably are trying to make specific types of gridpacks by hand
-        if stype == ScanType.FRANDOM and runs:
+        if stype in ScanType.getNDimTypes() and runs:
             submitted += submit_ndim_jobs(
                 gp=gridpack,
                 dofs=dof_list,
@@ -511,7 +601,8 @@ def main():
                 runs=runs,
                 tag=tag,
                 start_pts=[],
-                max_submits=-1
+                max_submits=-1,
+                workers=setup_workers
             )
         elif stype == ScanType.SLINSPACE and runs:
             submitted += submit_1dim_jobs(
@@ -521,15 +612,18 @@ def main():
                 runs=runs,
                 tag_postfix=tag,
                 max_submits=-1,
-                run_wl={}
+                run_wl={},
+                workers=setup_workers
             )
         elif stype == ScanType.FROMFILE and runs:
             submitted += submit_scanfile_jobs(
                 gp=gridpack,
                 dofs=dof_list,
                 tag=tag,
-                scan_files=scan_files,
-                max_submits=-1
+                scan_files=scan_files[p.getName()],
+                max_submits=-1,
+                point_index=PointIndex(),
+                workers=setup_workers
             )
         else:
             gridpack.configure(tag=tag,run=0,dofs=dof_list,num_pts=npts,start_pt=start_pt)
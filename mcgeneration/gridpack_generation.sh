@@ -594,6 +594,8 @@ make_gridpack () {
       rm $WORKDIR/pilotrun_gridpack.tar.gz
 
       # awightma start: Force the re-weight step to only use 1 core
+      #   Note: runcmsgrid.sh can reweight shards of the events (or points) in parallel instead, but only if
+      #         that is turned on with the rwgt_mode option of the Gridpack (the default is 'serial')
       echo "nb_core = 1" >> $WORKDIR/process/madevent/Cards/me5_configuration.txt
       # awightma end
 
@@ -1,6 +1,11 @@
+import copy
 import os
 import shutil
 import re
+import sys
+import tempfile
+import threading
+import time
 
 from helper_tools import run_process
 
@@ -18,6 +23,17 @@ class BaseCard(object):
 
         self.__ops = {}     # Dictionary of options related to the card
         self.__ord = []     # Order in which the options are added
+        self.__shared = False   # The options are shared with a clone, so need to be copied before modifying them
+
+    def clone(self):
+        """
+            Returns a copy of the card, which shares the parsed options with this card until either
+            one of them gets modified (copy-on-write)
+        """
+        obj = copy.copy(self)
+        obj.__shared = True
+        self.__shared = True
+        return obj
 
     def exists(self):
         fpath = self.getFilePath()
@@ -61,6 +77,27 @@ class BaseCard(object):
         """
         return os.path.join(self.cdir,self.name)
 
+    def write(self,dst,text,force=False):
+        """
+            Atomically write the full text of a card to a new location, the text is first written to a
+            temporary file in the same directory, which then gets renamed to the destination
+                dst: The full path, including the new file name
+                force: If true will overwrite an existing file (default: False)
+        """
+        if os.path.exists(dst) and not force:
+            s = "{file} already exists!".format(file=dst)
+            raise RuntimeError(s)
+        fd,tmp = tempfile.mkstemp(prefix=".%s." % (os.path.basename(dst)),dir=os.path.dirname(os.path.abspath(dst)))
+        try:
+            with os.fdopen(fd,'w') as f:
+                f.write(text)
+            # Keep the permissions of the original card, since mkstemp creates the file as private
+            shutil.copymode(self.getFilePath(),tmp)
+            os.rename(tmp,dst)
+        except:
+            os.remove(tmp)
+            raise
+
     def hasOption(self,k):
         """
             Checks if the option exists or not
@@ -74,6 +111,10 @@ class BaseCard(object):
                 k: The name of the option as it should appear in the card
                 v: The value for the option. NOTE: will be typecast to a string
         """
+        if self.__shared:
+            self.__ops = dict(self.__ops)
+            self.__ord = list(self.__ord)
+            self.__shared = False
         if not self.hasOption(k):
             self.key_width = max(self.key_width,len(k))
             self.__ord.append(k)
@@ -117,12 +158,20 @@ class BaseCard(object):
 class MGRunCard(BaseCard):
     LINE_COMMENT = "#"
     EOL_COMMENT  = "!"
+    OPTION_RGX = {}     # {option name: compiled regex matching the start of the option's line}
+
+    @classmethod
+    def getOptionRegex(cls,k):
+        if not cls.OPTION_RGX.has_key(k):
+            cls.OPTION_RGX[k] = re.compile(r".*=\s*%s\s*[!#]?" % (k))
+        return cls.OPTION_RGX[k]
 
     def __init__(self,*args,**kwargs):
         super(MGRunCard,self).__init__(*args,**kwargs)
 
         self.line_width = 0
         self.__line_map = {}    # A record of the original unmodified line
+        self.__text = ""        # The unmodified content of the card
 
         self.parse()
 
@@ -130,6 +179,8 @@ class MGRunCard(BaseCard):
         """ Parser for a MadGraph run card """
         fpath = self.getFilePath()
         with open(fpath,'r') as f:
+            self.__text = f.read()
+            f.seek(0)
             for l in f:
                 orig_line = l
                 idx = l.find(self.LINE_COMMENT)
@@ -161,29 +212,105 @@ class MGRunCard(BaseCard):
             l = self.__line_map[k]
             print "{0:>{w1}} = {1:<{w2}} -- {2}".format(k,v,l,w1=self.key_width,w2=self.val_width)
 
+    def getReplacement(self,k):
+        """ Returns the updated line of an option, with its current value """
+        v = self.getOption(k)
+        repl = " {0:>{w1}} = {1:<{w2}} {eol}".format(v,k,
+            w1=self.val_width,
+            w2=self.key_width,
+            eol=self.EOL_COMMENT
+        )
+        return self.getOptionRegex(k).sub(repl,self.__line_map[k])
+
+    def getSubstitution(self,k):
+        """
+            Returns the (pattern,replacement) of the sed substitution which updates the line of an
+            option, both escaped the way sed expects them (only used by saveWithSed)
+        """
+        old = self.__line_map[k]
+        new = self.getReplacement(k)
+
+        # Need to escape any special chars otherwise sed won't match the line
+        old = old.replace('\\','\\\\').replace('*','\\*')
+        new = new.replace('\\','\\\\').replace('*','\\*')
+        return old,new
+
+    def render(self):
+        """ Returns the full text of the card, with the line of each option updated to its current value """
+        new_lines = {}  # {original line: updated line}
+        for k in self.list():
+            new_lines[self.__line_map[k]] = self.getReplacement(k)
+        return '\n'.join(new_lines.get(l,l) for l in self.__text.split('\n'))
+
     def save(self,dst,force=False):
+        """ Render the modified card in memory, then write it in a single atomic step """
+        print "Saving to {dst}...".format(dst=dst)
+        self.write(dst,self.render(),force=force)
+
+    def saveWithSed(self,dst,force=False):
+        """ The original implementation of save(), which runs one sed command per option """
         self.copy(dst,force=force)
 
         for k in self.list():
-            v = self.getOption(k)
-            old = self.__line_map[k]
-            repl = " {0:>{w1}} = {1:<{w2}} {eol}".format(v,k,
-                w1=self.val_width,
-                w2=self.key_width,
-                eol=self.EOL_COMMENT
-            )
-            pat = r".*=\s*%s\s*[!#]?" % (k)
-            new = re.sub(pat,repl,old)
-
-            # Need to escape any special chars otherwise sed won't match the line
-            old = old.replace('\\','\\\\').replace('*','\\*')
-            new = new.replace('\\','\\\\').replace('*','\\*')
-            
+            old,new = self.getSubstitution(k)
+
             #print "{old:<{w}} --> {new}".format(old=old,new=new,w=self.line_width)
 
             sed_cmd = "s|{old}|{new}|g".format(old=old,new=new)
             run_process(['sed','-i','-e',sed_cmd,dst])
 
+class MGProcessCard(BaseCard):
+    def __init__(self,*args,**kwargs):
+        super(MGProcessCard,self).__init__(*args,**kwargs)
+
+        self.__text = ""    # The unmodified content of the card
+
+        self.parse()
+
+    def parse(self):
+        """ Reads a MadGraph process card, the card is only modified through text substitutions """
+        fpath = self.getFilePath()
+        with open(fpath,'r') as f:
+            self.__text = f.read()
+
+    def setOption(self,old,new):
+        """
+            Add a substitution which replaces every occurrence of old with new. The substitutions are
+            applied in the order they were first added, so later ones see the result of earlier ones
+        """
+        super(MGProcessCard,self).setOption(old,new)
+
+    def dump(self):
+        for k in self.list():
+            v = self.getOption(k)
+            print "{0:>{w1}} --> {1:<{w2}}".format(k,v,w1=self.key_width,w2=self.val_width)
+
+    def getText(self):
+        """ Returns the content of the card with all substitutions applied """
+        text = self.__text
+        for k in self.list():
+            text = text.replace(k,self.getOption(k))
+        return text
+
+    def getModel(self):
+        """
+            Returns a tuple of (model,restriction) from the 'import model' line of the card (with all
+            substitutions applied), the restriction is None if the default one is used
+        """
+        for l in self.getText().split('\n'):
+            arr = l.split('#',1)[0].split()
+            if len(arr) < 3 or arr[0] != 'import' or arr[1] != 'model':
+                continue
+            model = arr[2]
+            if '-' in model:
+                model,restrict = model.split('-',1)
+                return (model,restrict)
+            return (model,None)
+        return (None,None)
+
+    def save(self,dst,force=False):
+        self.write(dst,self.getText(),force=force)
+
 class MGCustomizeCard(BaseCard):
     LINE_COMMENT = "#"
 
@@ -230,6 +357,96 @@ class MGCustomizeCard(BaseCard):
                 f.write(v+'\n')
 
 
+# Cache of parsed template cards, so that gridpacks which share a template only parse it once. Each
+#   lookup returns a copy-on-write clone of the parsed card, which can be modified without affecting
+#   the cached card. Cards get re-parsed whenever the modification time of the template changes
+class CardCache(object):
+    __shared = None
+
+    @classmethod
+    def getShared(cls):
+        """ Returns the process-wide card cache """
+        if cls.__shared is None:
+            cls.__shared = cls()
+        return cls.__shared
+
+    def __init__(self):
+        self.__lock  = threading.Lock()
+        self.__cards = {}   # {(card type,card dir,card name): (mtime,parsed card)}
+
+    def __len__(self):
+        return len(self.__cards)
+
+    def clear(self):
+        with self.__lock:
+            self.__cards = {}
+
+    def get(self,card_type,card_dir,card_name):
+        """
+            Returns a clone of the parsed card
+                card_type: The card class to parse the card with (e.g. MGRunCard)
+        """
+        mtime = os.path.getmtime(os.path.join(card_dir,card_name))
+        key = (card_type.__name__,os.path.abspath(card_dir),card_name)
+        with self.__lock:
+            entry = self.__cards.get(key)
+            if entry is None or entry[0] != mtime:
+                entry = (mtime,card_type(card_name=card_name,card_dir=card_dir))
+                self.__cards[key] = entry
+            return entry[1].clone()
+
+# Compares saving each of the template run cards with one sed command per option against rendering the
+#   card in memory, checking that both give identical files. The only lines allowed to differ are ones
+#   which contain a '[', since sed reads e.g. '[None, ptj_bias, -custom_folder-]' in the bias_module
+#   comment as a bracket expression, only matches part of the line and appends a second copy of the
+#   comment (which is why the templates already have it repeated)
+def benchmark_run_card(card_dir=os.path.join('addons','cards','template_cards'),fdir='.',runs=3):
+    ops = {'run_tag': 'benchmark', 'nevents': '12345', 'iseed': '42'}
+    dst_sed = os.path.join(fdir,'benchmark_run_card_sed.dat')
+    dst_mem = os.path.join(fdir,'benchmark_run_card_mem.dat')
+    tot_sed = 0.0
+    tot_mem = 0.0
+    n_cards = 0
+    print "Run card benchmark: {n:d} run(s) per card".format(n=runs)
+    print "\t%s%s%s%s%s" % ("Template".ljust(30),"Options".rjust(8),"sed [ms]".rjust(12),"mem [ms]".rjust(12),"Diff".rjust(6))
+    for tdir in sorted(os.listdir(card_dir)):
+        cdir = os.path.join(card_dir,tdir)
+        if not os.path.exists(os.path.join(cdir,'run_card.dat')):
+            continue
+        rc = MGRunCard(card_name='run_card.dat',card_dir=cdir)
+        for k,v in ops.iteritems():
+            if rc.hasOption(k):
+                rc.setOption(k,v)
+        t0 = time.time()
+        for i in range(runs):
+            rc.saveWithSed(dst_sed,force=True)
+        t1 = time.time()
+        for i in range(runs):
+            rc.save(dst_mem,force=True)
+        t2 = time.time()
+        with open(dst_sed,'r') as f1, open(dst_mem,'r') as f2:
+            sed_lines = f1.read().split('\n')
+            mem_lines = f2.read().split('\n')
+        if len(sed_lines) != len(mem_lines):
+            raise RuntimeError("Saved run cards differ for template: %s" % (tdir))
+        n_diff = 0
+        for l1,l2 in zip(sed_lines,mem_lines):
+            if l1 == l2:
+                continue
+            if not '[' in l2:
+                raise RuntimeError("Saved run cards differ for template: %s\n\t%s\n\t%s" % (tdir,l1,l2))
+            n_diff += 1
+        dt_sed = 1000.0*(t1 - t0)/runs
+        dt_mem = 1000.0*(t2 - t1)/runs
+        tot_sed += dt_sed
+        tot_mem += dt_mem
+        n_cards += 1
+        print "\t%s%s%s%s%s" % (tdir.ljust(30),str(rc.size()).rjust(8),("%.1f" % (dt_sed)).rjust(12),("%.1f" % (dt_mem)).rjust(12),str(n_diff).rjust(6))
+    print "\t%s%s%s%s" % ("Total ({n:d} cards)".format(n=n_cards).ljust(30),"".rjust(8),("%.1f" % (tot_sed)).rjust(12),("%.1f" % (tot_mem)).rjust(12))
+    for fpath in [dst_sed,dst_mem]:
+        if os.path.exists(fpath):
+            os.remove(fpath)
+
 def test_run_card():
     home_dir = "/home/issa/Documents/Research/lannon/CERN/EFT_Research/MG_Studies/TopEFT/mcgeneration"
     card_dir = "addons/cards/example_testing"
@@ -245,6 +462,18 @@ def test_run_card():
     #fpath = os.path.join(ex_dir,'mod_run_card.dat')
     #rc.save(fpath,force=True)
 
+def test_process_card():
+    home_dir = "/home/issa/Documents/Research/lannon/CERN/EFT_Research/MG_Studies/TopEFT/mcgeneration"
+    card_dir = "addons/cards/process_cards"
+    ex_dir = os.path.join(home_dir,card_dir)
+
+    pc = MGProcessCard(card_name='ttH.dat',card_dir=ex_dir)
+
+    pc.setOption('import model dim6top_LO_UFO','import model dim6top_LO_UFO_each_coupling_order')
+    pc.setOption('SUBSETUP','ttH_Test_run0')
+    pc.dump()
+    print pc.getText()
+
 def test_customize_card():
     home_dir = "/home/issa/Documents/Research/lannon/CERN/EFT_Research/MG_Studies/TopEFT/mcgeneration"
     card_dir = "addons/cards/example_testing"
@@ -260,5 +489,9 @@ def test_customize_card():
     
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        benchmark_run_card()
+        sys.exit(0)
     test_run_card()
+    test_process_card()
     test_customize_card()
\ No newline at end of file
@@ -0,0 +1,213 @@
+import os
+import re
+
+from ScanType import ScanType
+from helper_tools import reweight_card_header, reweight_card_launch, load_scan_array, SCAN_ARRAY_TYPE
+
+# Estimates the size and cost of the reweighting step of a gridpack campaign, without writing anything
+#   to disk. The cost of a gridpack is dominated by the reweighting, which scales roughly as:
+#       (#rwgt points + dummy point) x #events x (time to reweight one event to one point)
+#   The per-point reweight time can be calibrated from the pilot run reweighting which is part of the
+#   '<setup>.log' files of previously produced gridpacks.
+class CostEstimator(object):
+    DEFAULT_RWGT_TIME = 5e-4    # Rough per-event, per-point reweight time (in seconds) if no logs are available
+    LOG_TYPE = 'log'
+    SCANFILE_POSTFIX = 'scanpoints.txt'
+    EVENT_RGX = re.compile(r'Event nb (\d+) ((?:\d+[dhms]\s*)+)')
+    TIME_RGX  = re.compile(r'(\d+)([dhms])')
+
+    @classmethod
+    def parseTime(cls,s):
+        """ Converts a MadGraph formatted time string (e.g. '1h 2m 3s') into seconds """
+        units = {'d': 86400.0, 'h': 3600.0, 'm': 60.0, 's': 1.0}
+        return sum(float(v)*units[u] for v,u in cls.TIME_RGX.findall(s))
+
+    @classmethod
+    def parseReweightTiming(cls,fpath):
+        """
+            Parse the 'Event nb' progress lines of the MadGraph reweighting in a log file. Returns a tuple
+            of (events,seconds) with the total time spent reweighting, or None if there are no such lines.
+            Note: Each reweighting pass restarts the event count, so the last line of every pass is kept
+        """
+        blocks = []
+        last = None
+        with open(fpath,'r') as f:
+            for l in f:
+                m = cls.EVENT_RGX.search(l)
+                if not m:
+                    continue
+                nevts,t = int(m.group(1)),cls.parseTime(m.group(2))
+                if last is not None and nevts < last[0]:
+                    blocks.append(last)
+                last = (nevts,t)
+        if last is None:
+            return None
+        blocks.append(last)
+        events = max(x[0] for x in blocks)
+        seconds = sum(x[1] for x in blocks)
+        return (events,seconds)
+
+    @classmethod
+    def countScanfilePoints(cls,fpath):
+        """ Returns the number of rwgt points in a scanpoints file (i.e. excluding the header and MG start point) """
+        if fpath.endswith(SCAN_ARRAY_TYPE):
+            return max(len(load_scan_array(fpath)) - 1,0)
+        n = 0
+        with open(fpath,'r') as f:
+            for l in f:
+                if l.strip(): n += 1
+        return max(n - 2,0)
+
+    def __init__(self,fdir='.',default_time=None):
+        self.fdir = fdir
+        self.default_time = self.DEFAULT_RWGT_TIME if default_time is None else default_time
+        self.timings = {}   # {process: [per-event, per-point reweight times]}
+
+    def calibrate(self,fdir=None,verbose=True):
+        """
+            Calibrate the per-point reweight time from the '<setup>.log' files (and the matching
+            '<setup>_scanpoints.txt' files) found in fdir. Returns the number of logs which were used
+        """
+        if fdir is None:
+            fdir = self.fdir
+        self.timings = {}
+        n_logs = 0
+        for fn in sorted(os.listdir(fdir)):
+            if not fn.endswith('.' + self.LOG_TYPE):
+                continue
+            setup = fn[:-len(self.LOG_TYPE)-1]
+            if len(setup.split('_')) != 3:
+                # Not a gridpack log file
+                continue
+            scanfile = os.path.join(fdir,"%s_%s" % (setup,self.SCANFILE_POSTFIX))
+            if not os.path.exists(scanfile):
+                continue
+            timing = self.parseReweightTiming(os.path.join(fdir,fn))
+            if timing is None or timing[0] == 0:
+                continue
+            events,seconds = timing
+            n_pts = self.countScanfilePoints(scanfile) + 1   # The dummy point gets reweighted too
+            p = setup.split('_')[0]
+            if not self.timings.has_key(p):
+                self.timings[p] = []
+            self.timings[p].append(seconds / (events*n_pts))
+            n_logs += 1
+        if verbose:
+            print "Calibrated reweight timing from {n:d} log file(s) in {d}".format(n=n_logs,d=fdir)
+        return n_logs
+
+    def getReweightTime(self,process=None):
+        """
+            Returns the median per-event, per-point reweight time (in seconds) for the process. Falls back
+            to the median over all processes and then to the default time if there is no calibration
+        """
+        if process is not None and self.timings.get(process):
+            lst = sorted(self.timings[process])
+        else:
+            lst = sorted(t for v in self.timings.values() for t in v)
+        if len(lst) == 0:
+            return self.default_time
+        return lst[len(lst)/2]
+
+    def estimateCardSize(self,dofs,num_pts):
+        """
+            Returns the (lines,bytes) of the reweight card for num_pts points of the DoFs (a dict of
+            DegreeOfFreedom objects). Uses a representative point with every DoF set to a 7 digit value
+        """
+        if num_pts == 0:
+            return (0,0)
+        header = reweight_card_header(dofs)
+        pt = dict((c,-1.234567) for c in dofs.keys())
+        launch = reweight_card_launch(num_pts/2,dofs,pt)
+        n_lines = header.count('\n') + num_pts*launch.count('\n')
+        n_bytes = len(header) + num_pts*len(launch)
+        return (n_lines,n_bytes)
+
+    def estimate(self,process,dofs,num_pts,events,gridpacks=1):
+        """
+            Estimate the cost of producing (and running once) a set of gridpacks for the same process
+            and DoFs, each with num_pts reweight points.
+                dofs: Dictionary or list of DegreeOfFreedom objects
+                events: Number of events which get reweighted per gridpack run
+        """
+        if isinstance(dofs,list):
+            dofs = dict((dof.getName(),dof) for dof in dofs)
+        n_lines,n_bytes = self.estimateCardSize(dofs,num_pts)
+        launches = num_pts + 1 if num_pts else 0
+        t_pp = self.getReweightTime(process)
+        return {
+            'process': process,
+            'gridpacks': gridpacks,
+            'rwgt_pts': num_pts,
+            'card_lines': n_lines,
+            'card_bytes': n_bytes,
+            'launches': launches*gridpacks,
+            'rwgt_time': t_pp,
+            'cpu_hours': gridpacks*launches*events*t_pp / 3600.0,
+        }
+
+    def plan(self,proc_list,dofs,stype,num_pts,runs,events,scan_files={},pairs=None):
+        """
+            Estimate the cost of a full campaign, following the same gridpack layout that the
+            submit functions of configure_gridpack.py use for each scan type. Returns a list of
+            estimates, one for each process (and DoF for 1-D scans).
+                proc_list: List of MGProcess objects
+                scan_files: Dictionary of {process name: [scanfiles]}, only used for 'from_file' scans
+        """
+        plan = []
+        N = len(dofs)
+        n_pairs = None if pairs is None else len(pairs)
+        for p in proc_list:
+            name = p.getName()
+            if stype == ScanType.SLINSPACE:
+                # One set of 1-D gridpacks per DoF
+                n = ScanType.countPoints(stype,1,num_pts)
+                for dof in dofs:
+                    est = self.estimate(name,[dof],n,events,gridpacks=max(runs,1))
+                    est['label'] = "%s_%s" % (name,dof.getName())
+                    plan.append(est)
+                continue
+            elif stype == ScanType.FROMFILE:
+                for fpath in scan_files.get(name,[]):
+                    if not os.path.exists(fpath):
+                        continue
+                    est = self.estimate(name,dofs,self.countScanfilePoints(fpath),events)
+                    est['label'] = "%s_%s" % (name,os.path.basename(fpath))
+                    plan.append(est)
+                continue
+            elif stype == ScanType.NONE:
+                est = self.estimate(name,dofs,0,events)
+            else:
+                n = ScanType.countPoints(stype,N,num_pts,n_pairs)
+                est = self.estimate(name,dofs,n,events,gridpacks=max(runs,1))
+            est['label'] = name
+            plan.append(est)
+        return plan
+
+    def formatPlan(self,plan,events=None):
+        """ Returns a printable table of a campaign plan, including the totals """
+        cols = ['gridpacks','rwgt_pts','card_lines','card_bytes','launches','cpu_hours']
+        width = max([len(x['label']) for x in plan] + [len('Total')])
+        info  = ""
+        if events is not None:
+            info += "Campaign plan ({n:d} events per gridpack run):\n".format(n=events)
+        info += "\t%s" % ("Label".ljust(width)) + "".join(c.rjust(12) for c in cols) + "\n"
+        per_gridpack = ['rwgt_pts','card_lines','card_bytes']
+        totals = dict((c,0) for c in cols)
+        for est in plan:
+            info += "\t%s" % (est['label'].ljust(width))
+            for c in cols:
+                totals[c] += est[c]*est['gridpacks'] if c in per_gridpack else est[c]
+                if c == 'cpu_hours':
+                    info += ("%.1f" % (est[c])).rjust(12)
+                else:
+                    info += ("%d" % (est[c])).rjust(12)
+            info += "\n"
+        info += "\t%s" % ("Total".ljust(width))
+        for c in cols:
+            if c == 'cpu_hours':
+                info += ("%.1f" % (totals[c])).rjust(12)
+            else:
+                info += ("%d" % (totals[c])).rjust(12)
+        info += "\n"
+        return info
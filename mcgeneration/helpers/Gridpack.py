@@ -1,30 +1,138 @@
 import os
+import copy
 import subprocess
 import shutil
 import random
+import threading
+import time
+
+import numpy as np
 
 from BatchType import BatchType
 from ScanType import ScanType
+from ScanPoints import ScanPoints
+from PointIndex import PointIndex
+from LimitsRegistry import LimitsRegistry
+from CostEstimator import CostEstimator
+from ScanRefiner import ScanRefiner
+from StartPointOptimizer import StartPointOptimizer
+from QuadraticFit import QuadraticFit
 from DegreeOfFreedom import DegreeOfFreedom
 from helper_tools import *
 
-from CardEditor import MGRunCard, MGCustomizeCard
+from CardEditor import MGRunCard, MGCustomizeCard, MGProcessCard, CardCache
+from ParamCard import ParamCard
+from WorkAreaIndex import WorkAreaIndex
+from GridpackRunPool import GridpackRunPool
+
+from multiprocessing.pool import ThreadPool
+
+# The outcome of setting up a single gridpack with Gridpack.setupMany()
+class SetupResult(object):
+    SETUP   = 'setup'
+    SKIPPED = 'skipped'
+    FAILED  = 'failed'
+
+    def __init__(self,gridpack,status,duration=0.0,error=None):
+        self.gridpack = gridpack
+        self.status   = status
+        self.duration = duration    # Wall time (in seconds)
+        self.error    = error
+
+    def isSetup(self):
+        return self.status == self.SETUP
+
+    def __str__(self):
+        s = "{setup}: {status} ({t:.1f}s)".format(setup=self.gridpack.getSetupString(),status=self.status,t=self.duration)
+        if self.error is not None:
+            s += " -- {err}".format(err=self.error)
+        return s
 
 # Class for configuring and setting up the submission for a single gridpack, can also run a produced gridpack tarball
 class Gridpack(object):
+    __genprod_lock = threading.Lock()   # Guards the in-place edits of the gridpack generation script
+
+    @classmethod
+    def setupMany(cls,configs,workers=4,indent=0):
+        """
+            Sets up the cards for many gridpacks concurrently, returns a list of SetupResult in the
+            same order as configs
+                configs: List of (options,configure kwargs) tuples, a new Gridpack is made from each
+                    options dict (or a copy of the options of a Gridpack), then configured with a copy
+                    of the DoFs from the configure kwargs
+                workers: The max number of gridpacks being set up at the same time
+            Note: The gridpacks get configured one after the other in the calling thread. Gridpacks which
+                share a PointIndex also generate and claim their rwgt points there (see claimScanPoints),
+                so the points are claimed in the listed order and the index is only read by the workers
+        """
+        indent_str = " "*4*indent
+        t0 = time.time()
+        gridpacks = []
+        for ops,cfg in configs:
+            cfg = dict(cfg)
+            cfg['dofs'] = [copy.deepcopy(dof) for dof in cfg['dofs']]
+            home_dir = None
+            if isinstance(ops,Gridpack):
+                home_dir = ops.HOME_DIR
+                ops = dict(ops.ops)
+            gp = cls(home_dir=home_dir,**ops)
+            gp.configure(**cfg)
+            if gp.getOption('point_index') is not None and gp.getOption('stype') != ScanType.NONE:
+                if not gp.isStreamedScan() and not gp.exists():
+                    gp.claimScanPoints()
+            gridpacks.append(gp)
+
+        def setup_one(gp):
+            t = time.time()
+            try:
+                if gp.exists():
+                    return SetupResult(gp,SetupResult.SKIPPED,time.time() - t)
+                if not gp.setup(indent=indent+1):
+                    return SetupResult(gp,SetupResult.FAILED,time.time() - t)
+            except Exception as e:
+                return SetupResult(gp,SetupResult.FAILED,time.time() - t,error=repr(e))
+            return SetupResult(gp,SetupResult.SETUP,time.time() - t)
+
+        pool = ThreadPool(max(1,workers))
+        try:
+            results = pool.map(setup_one,gridpacks)
+        finally:
+            pool.close()
+            pool.join()
+
+        counts = {}
+        for r in results:
+            counts[r.status] = counts.get(r.status,0) + 1
+            if r.status == SetupResult.FAILED:
+                print "{ind}[ERROR] {res}".format(res=r,ind=indent_str)
+        print "{ind}Setup {n:d} gridpacks in {t:.1f}s: {ns:d} setup, {nk:d} skipped, {nf:d} failed".format(
+            n=len(results),
+            t=time.time() - t0,
+            ns=counts.get(SetupResult.SETUP,0),
+            nk=counts.get(SetupResult.SKIPPED,0),
+            nf=counts.get(SetupResult.FAILED,0),
+            ind=indent_str
+        )
+        return results
+
     #def __init__(self,process,limits_name,proc_card,template_dir,stype=ScanType.NONE,btype=BatchType.NONE):
-    def __init__(self,**kwargs):
-        self.HOME_DIR      = os.getcwd()
+    def __init__(self,home_dir=None,**kwargs):
+        # All files and directories of the gridpack are resolved relative to HOME_DIR, which defaults
+        #   to the working directory at the time the Gridpack is created
+        self.HOME_DIR      = os.path.abspath(home_dir) if home_dir else os.getcwd()
         self.CARD_DIR      = os.path.join("addons","cards")
         self.LIMITS_DIR    = os.path.join("addons","limits")
         self.PROC_CARD_DIR = os.path.join("addons","cards","process_cards")
+        self.MODEL_DIR     = os.path.join("addons","models")
         self.GRIDRUN_DIR   = 'gridruns'
+        self.GRIDRUN_LHE   = 'cmsgrid_final.lhe'    # The LHE file produced by running a gridpack
 
         # MadGraph specific card naming
         self.MG_PROC_CARD     = 'proc_card.dat'
         self.MG_CUSTOM_CARD   = 'customizecards.dat'
         self.MG_REWEIGHT_CARD = 'reweight_card.dat'
         self.MG_RUN_CARD      = 'run_card.dat'
+        self.MG_PARAM_CARD    = 'param_card.dat'
 
         # The custom limits file for determining range of WC values
         self.LIMITS_FILE = "dim6top_LO_UFO_limits.txt"
@@ -38,6 +146,7 @@ class Gridpack(object):
         #         the gridpack generation stage
         self.SCANFILE_POSTFIX = 'scanpoints'
         self.SCANFILE_TYPE    = 'txt'
+        self.SCANARRAY_TYPE   = SCAN_ARRAY_TYPE     # Binary version of the scanpoints file
 
         # Used when naming the final gridpack tarball
         self.CURR_ARCH        = 'slc7_amd64_gcc630'
@@ -63,6 +172,20 @@ class Gridpack(object):
             'use_coupling_model': False,    # Use the 'coupling_orders' version of the dim6 model
             'coupling_string': None,        # If not None replaces "DIM6=1" with the specified string in the process card
             'replace_model': None,          # If not None overwrites the import model line of the process card
+            'stream_scan': False,           # Stream full linear grid scans directly to disk, instead of building the full list of points
+            'scan_pairs': None,             # The DoF pairs [(c1,c2),...] to scan with the 'plane_linspace' scan type, if None will scan all pairs
+            'point_index': None,            # A PointIndex shared by all gridpacks of a campaign, used to drop rwgt points already used by another gridpack
+            'scan_seed': None,              # Seed for the low-discrepancy scan types (combined with the run number), if None a random realization is used
+            'rwgt_delta': False,            # Only write the WCs that changed for each launch of the reweight card
+            'optimize_start': False,        # Choose the MG starting point which maximizes the worst-case ESS over the rwgt points
+            'xsec_fit': None,               # Quadratic xsec fit (names,coeffs) from a previous run used by 'optimize_start', if None a per-process prior is used
+            'scan_array': False,            # Also save the scan points to a binary .npy file next to the scanpoints file
+            'rwgt_mode': None,              # How a gridrun splits up the reweighting: 'events', 'points' or 'serial', if None uses the runcmsgrid.sh default ('serial')
+            'rwgt_shards': None,            # Number of reweighting shards run in parallel by a gridrun, if None uses the number of cores
+            'limits_files': [],             # Extra limits files (relative to LIMITS_DIR), which take precedence over LIMITS_FILE in the listed order
+            'write_param_card': False,      # Write the starting point to a full param card, instead of 'set param_card' lines in the customize card
+            'param_card_python': None,      # Interpreter which runs the model's UFO param card writer, if None uses ParamCard.PYTHON
+            'work_area': None,              # A WorkAreaIndex of the HOME_DIR, if set exists() checks are answered from its snapshot instead of the filesystem
             'flavor_scheme': 5,
             'default_limits': [-10,10],
         }
@@ -71,8 +194,10 @@ class Gridpack(object):
 
         self.mg_runcard = None
         self.mg_customizecard = None
+        self.mg_processcard = None
 
         self.scan_pts = []
+        self.num_streamed_pts = None    # Number of rwgt points written to disk without being stored in self.scan_pts
         self.is_configured = False
         return
 
@@ -114,9 +239,10 @@ class Gridpack(object):
         """
             Parses a MadGraph run card, which can then be modified independent
             of the original template card
+            Note: Each template card is only parsed once, the gridpack gets a copy-on-write clone
         """
         cdir = os.path.join(self.HOME_DIR,self.CARD_DIR,self.ops['template_dir'])
-        self.mg_runcard = MGRunCard(card_name=self.MG_RUN_CARD,card_dir=cdir)
+        self.mg_runcard = CardCache.getShared().get(MGRunCard,cdir,self.MG_RUN_CARD)
 
     def modifyRunCard(self,**ops):
         for op,val in ops.items():
@@ -140,9 +266,10 @@ class Gridpack(object):
         """
             Parses a customize card, which can then be modified independent
             of the original template card
+            Note: Each template card is only parsed once, the gridpack gets a copy-on-write clone
         """
         cdir = os.path.join(self.HOME_DIR,self.CARD_DIR,self.ops['template_dir'])
-        self.mg_customizecard = MGCustomizeCard(card_name=self.MG_CUSTOM_CARD,card_dir=cdir)
+        self.mg_customizecard = CardCache.getShared().get(MGCustomizeCard,cdir,self.MG_CUSTOM_CARD)
 
     def modifyCustomizeCard(self,*ops):
         """
@@ -168,49 +295,137 @@ class Gridpack(object):
             Save the process card to the appropriate location, overwriting any pre-existing
             card in that location
 
-            NOTE: This function does a lot of stuff related to modifying the process card after
+            NOTE: This function does a lot of stuff related to modifying the process card while
                 it gets copied to the setup location
         """
         indent_str = " "*4*indent
 
         setup = self.getSetupString()
         target_dir = self.getTargetDirectory(create=False)
-        proc_src = os.path.join(self.HOME_DIR,self.PROC_CARD_DIR,self.ops['process_card'])
         fpath = os.path.join(target_dir,"{setup}_{base}".format(setup=setup,base=self.MG_PROC_CARD))
-        shutil.copy(proc_src,fpath)
+        proc_card = MGProcessCard(card_name=self.ops['process_card'],card_dir=os.path.join(self.HOME_DIR,self.PROC_CARD_DIR))
 
         if self.ops['save_diagrams']:
             # Remove the nojpeg option from the output line of the process card
             print "{ind}Saving diagrams!".format(ind=indent_str)
-            run_process(['sed','-i','-e',"s|SUBSETUP -nojpeg|SUBSETUP|g",fpath])
+            proc_card.setOption("SUBSETUP -nojpeg","SUBSETUP")
 
         if not self.ops['coupling_string'] is None:
             # Replace the amp order specification with a new custom one
             print "{ind}Custom Couplings: {couplings}".format(couplings=self.ops['coupling_string'],ind=indent_str)
-            sed_str = "s|DIM6=1|{new}|g".format(new=self.ops['coupling_string'])
-            subprocess.Popen(['sed','-i','-e',sed_str,fpath]).communicate()
+            proc_card.setOption("DIM6=1",self.ops['coupling_string'])
 
+        new_model = None
         if self.ops['use_coupling_model']:
             # Replace the default dim6 model with the 'each_coupling_order' version
             # NOTE: This will overwrite the 'replace_model' option
             print "{ind}Using each_coupling_order model!".format(ind=indent_str)
+            new_model = "dim6top_LO_UFO_each_coupling_order"
+            if self.ops['replace_model']:
+                print "{ind}[WARNING] Ignoring replace_model option: {model}".format(model=self.ops['replace_model'],ind=indent_str)
+        elif self.ops['replace_model']:
+            new_model = self.ops['replace_model']
+            print "{ind}Using {model} model".format(model=new_model,ind=indent_str)
+        if new_model:
             old = "dim6top_LO_UFO"
-            new = "dim6top_LO_UFO_each_coupling_order"
-            sed_str = "s|import model {old}|import model {new}|g".format(old=old,new=new)
-            subprocess.Popen(['sed','-i','-e',sed_str,fpath]).communicate()
-
-        if self.ops['replace_model']:
-            rep_model = self.ops['replace_model']
-            print "{ind}Using {model} model".format(model=rep_model,ind=indent_str)
-            old = "dim6top_LO_UFO"
-            sed_str = "s|import model {old}|import model {new}|g".format(old=old,new=rep_model)
-            subprocess.Popen(['sed','-i','-e',sed_str,fpath]).communicate()
+            proc_card.setOption("import model {old}".format(old=old),"import model {new}".format(new=new_model))
 
         # Replace SUBSETUP in the process card with the correct name
-        sed_str = "s|SUBSETUP|{setup}|g".format(setup=setup)
-        subprocess.Popen(['sed','-i','-e',sed_str,fpath]).communicate()
+        proc_card.setOption("SUBSETUP",setup)
+
+        # All substitutions are applied in memory, then the card is written once
+        proc_card.save(fpath,force=True)
+        self.mg_processcard = proc_card
         return fpath
 
+    def getStartParams(self):
+        """ Returns the list of (parameter,value) pairs which set the MG starting point of the gridpack """
+        params = []
+        if self.ops['flavor_scheme'] == 5:
+            params.append(('MB',0.0))
+            params.append(('ymb',0.0))
+        for c,dof in self.ops['coeffs'].items():
+            for k,v in dof.eval(dof.getStart()).items():
+                params.append((k,v))
+        return params
+
+    def getParamCardModelDir(self,indent=0):
+        """
+            Returns the dir of the model imported by the saved process card, or None if no full param
+            card can be written for it (i.e. the model isn't in MODEL_DIR or uses a restriction)
+        """
+        indent_str = " "*4*indent
+        model,restrict = self.mg_processcard.getModel()
+        if model is None:
+            print "{ind}[WARNING] No model found in the process card".format(ind=indent_str)
+            return None
+        model_dir = os.path.join(self.HOME_DIR,self.MODEL_DIR,model)
+        if restrict is not None or not ParamCard.canWrite(model_dir):
+            print "{ind}[WARNING] Can't write a param card for model: {model}".format(model=model,ind=indent_str)
+            return None
+        return model_dir
+
+    def saveParamCard(self,model_dir):
+        """
+            Save a full param card with the MG starting point to the appropriate location, overwriting
+            any pre-existing card in that location
+        """
+        setup = self.getSetupString()
+        target_dir = self.getTargetDirectory(create=False)
+        fpath = os.path.join(target_dir,"{setup}_{base}".format(setup=setup,base=self.MG_PARAM_CARD))
+        param_card = ParamCard(model_dir,python=self.ops['param_card_python'])
+        for k,v in self.getStartParams():
+            param_card.setValue(k,v)
+        param_card.save(fpath)
+        return fpath
+
+    def isStreamedScan(self):
+        """ Checks if the rwgt points get streamed directly to disk, instead of being generated up front """
+        return len(self.scan_pts) == 0 and self.ops['stream_scan'] and self.ops['stype'] == ScanType.FLINSPACE
+
+    def claimScanPoints(self):
+        """
+            Generates the rwgt points (if not already set) and drops the points which are already part of
+            a different gridpack in the same campaign, registering the remaining ones to the PointIndex
+        """
+        if len(self.scan_pts) == 0:
+            self.scan_pts = self.generateScanPoints()
+
+        if self.ops['point_index'] is not None and len(self.scan_pts):
+            self.dedupeScanPoints()
+        return self.scan_pts
+
+    def getFitRank(self):
+        """ Rank of the quadratic fit design matrix of the rwgt points plus the MG starting point """
+        names = self.scan_pts.getNames()
+        start,low,high = ScanType.getLimitArrays(self.ops['coeffs'],names)
+        arr = np.vstack([start.reshape(1,-1),self.scan_pts.getArray()])
+        X = QuadraticFit.getDesignMatrix(QuadraticFit.normalize(arr,low,high))
+        return np.linalg.matrix_rank(X)
+
+    def dedupeScanPoints(self):
+        """
+            Drops the rwgt points already used by a different gridpack in the shared PointIndex and registers
+            the remaining ones, returns the number of dropped points.
+            Note: Each gridpack fits its own quadratic, so this warns if dropping the points leaves the fit
+                  less constrained than the scan was designed to be (e.g. too few points left)
+        """
+        rank = self.getFitRank()
+        # Note: The SM point is always kept, since it is needed to fit each gridpack
+        n_removed = self.scan_pts.dedupe(index=self.ops['point_index'],owner=self.getSetupString(),keep=[PointIndex.SM_KEY])
+        if n_removed:
+            new_rank = self.getFitRank()
+            if new_rank < rank:
+                print "[WARNING] {setup}: Dropping {n:d} rwgt points used by other gridpacks leaves {k:d} points, which only constrain {r:d} of the {t:d} fit terms (was {r0:d})".format(
+                    setup=self.getSetupString(),
+                    n=n_removed,
+                    k=len(self.scan_pts),
+                    r=new_rank,
+                    t=QuadraticFit.getNumTerms(len(self.scan_pts.getNames())),
+                    r0=rank
+                )
+        return n_removed
+
     def saveReweightCard(self):
         """
             Save the reweight card to the appropriate location, overwriting any pre-existing
@@ -220,18 +435,132 @@ class Gridpack(object):
         setup = self.getSetupString()
         target_dir = self.getTargetDirectory(create=False)
 
-        scanfile = self.getScanfileString()
+        scanfile = self.getPath(self.getScanfileString())
+        scanarray = self.getPath(self.getScanArrayString())
         rwgt_tar = os.path.join(target_dir,"{setup}_{base}".format(setup=setup,base=self.MG_REWEIGHT_CARD))
-        
-        if len(self.scan_pts) == 0:
-            self.scan_pts = ScanType.getPoints(self.ops['coeffs'],self.ops['num_rwgt_pts'],self.ops['stype'])
+
+        if self.isStreamedScan():
+            # Write the points chunk by chunk, so that the full grid never needs to fit in memory
+            chunks = ScanType.iterFullScanLinear(self.ops['coeffs'],self.ops['num_rwgt_pts'])
+            self.num_streamed_pts = stream_scan_points(scanfile,rwgt_tar,self.ops['coeffs'],chunks,delta=self.ops['rwgt_delta'])
+            if self.ops['scan_array']:
+                scan_file_to_array(scanfile,scanarray)
+            return rwgt_tar
+
+        self.claimScanPoints()
 
         save_scan_points(scanfile,self.ops['coeffs'],self.scan_pts)
-        make_reweight_card(rwgt_tar,self.ops['coeffs'],self.scan_pts)
+        if self.ops['scan_array']:
+            save_scan_array(scanarray,self.ops['coeffs'],self.scan_pts)
+        make_reweight_card(rwgt_tar,self.ops['coeffs'],self.scan_pts,delta=self.ops['rwgt_delta'])
 
         return rwgt_tar
 
+    def getLimitsFiles(self):
+        """ Returns the paths to the limits files used by this gridpack, in order of precedence """
+        fnames = list(self.ops['limits_files']) + [self.LIMITS_FILE]
+        return [os.path.join(self.HOME_DIR,self.LIMITS_DIR,fn) for fn in fnames]
+
+    def getScanSeed(self):
+        """ Returns the seed used for generating the scan points, if the 'scan_seed' option is set """
+        if self.ops['scan_seed'] is None:
+            return None
+        # Different runs of the same configuration should still get different points
+        return [self.ops['scan_seed'],self.ops['run']]
+
+    def generateScanPoints(self):
+        """ Generate the rwgt points for the configured scan type """
+        return ScanType.getPoints(
+            self.ops['coeffs'],
+            self.ops['num_rwgt_pts'],
+            self.ops['stype'],
+            seed=self.getScanSeed(),
+            pairs=self.ops['scan_pairs']
+        )
+
+    def optimizeStartPoint(self,fixed_pt={}):
+        """
+            Generate the rwgt points, then replace the MG starting point with the one which maximizes
+            the worst-case effective sample size over those points. DoFs in fixed_pt keep their value
+        """
+        self.scan_pts = self.generateScanPoints()
+        if len(self.scan_pts) == 0:
+            return
+        coeffs = self.ops['coeffs']
+        names = self.scan_pts.getNames()
+        start,low,high = ScanType.getLimitArrays(coeffs,names)
+        fit_coeffs = None
+        if self.ops['xsec_fit'] is not None:
+            fit_names,fit_coeffs = self.ops['xsec_fit']
+            fit_coeffs = QuadraticFit.reorder(fit_coeffs,fit_names,names)
+        fixed = np.array([fixed_pt[c] if fixed_pt.has_key(c) else np.nan for c in names])
+        optimizer = StartPointOptimizer(low,high,coeffs=fit_coeffs)
+        targets = self.scan_pts.getArray()
+        old_ess = optimizer.getWorstESS(start.reshape(1,-1),targets)[0]
+        new_start,new_ess = optimizer.optimize(targets,fixed=fixed,seed=self.getScanSeed())
+        for c,v in zip(names,new_start):
+            coeffs[c].setLimits(v,coeffs[c].getLow(),coeffs[c].getHigh())
+        # The MG starting point is always part of the gridpack, so shouldn't also be a rwgt point
+        self.scan_pts.removePoint(new_start)
+        print "Optimized MG starting point: worst-case ESS/N = {new:.3g} (was {old:.3g})".format(new=new_ess,old=old_ess)
+
+    def getNumScanPoints(self):
+        """ Returns the number of reweight points, including any that were streamed directly to disk """
+        if self.num_streamed_pts is not None:
+            return self.num_streamed_pts
+        return len(self.scan_pts)
+
+    def estimateCost(self,events,estimator=None):
+        """
+            Estimate the reweight card size, number of MG launches and CPU-hours for this (configured)
+            gridpack, without writing anything to disk. If the scan points haven't been generated yet,
+            the expected number of points for the scan type is used instead
+        """
+        if estimator is None:
+            estimator = CostEstimator(fdir=self.HOME_DIR)
+        num_pts = self.getNumScanPoints()
+        if num_pts == 0:
+            n_pairs = None if self.ops['scan_pairs'] is None else len(self.ops['scan_pairs'])
+            num_pts = ScanType.countPoints(self.ops['stype'],len(self.ops['coeffs']),self.ops['num_rwgt_pts'],n_pairs)
+        est = estimator.estimate(self.ops['process'],self.ops['coeffs'],num_pts,events)
+        est['label'] = self.getSetupString()
+        return est
+
+    def refineScan(self,npts,fpath=None,seed=None):
+        """
+            Use the output of a (pilot) run of this gridpack to propose npts new rwgt points where the
+            quadratic parametrization is poorly constrained. The points are saved to a new scanfile,
+            which uses the same MG starting point and can be submitted with the 'from_file' scan type
+        """
+        if not self.is_configured:
+            print "[ERROR] Can't refine the scan of an unconfigured gridpack!"
+            return None
+        setup = self.getSetupString()
+        if fpath is None:
+            fpath = self.getPath("%s_refined.%s" % (setup,self.SCANFILE_TYPE))
+        lhe_file = os.path.join(self.getGridrunOutputDirectory(),self.GRIDRUN_LHE)
+        if not os.path.exists(lhe_file):
+            print "[ERROR] No gridrun output found for {setup}: {fn}".format(setup=setup,fn=lhe_file)
+            return None
+        start_pt = parse_scan_file(self.getPath(self.getScanfileString()))[0]
+        refiner = ScanRefiner(self.ops['coeffs'])
+        refiner.load(lhe_file,start_pt=start_pt)
+        refiner.fit()
+        pts = refiner.propose(npts,seed=seed)
+        return refiner.saveScanfile(fpath,pts,start_pt)
+
     ################################################################################################
+    def getPath(self,*args):
+        """ Returns the absolute path of a file or directory relative to the HOME_DIR """
+        return os.path.join(self.HOME_DIR,*args)
+
+    def getWorkArea(self):
+        """ Returns the WorkAreaIndex used by this gridpack, or None if there isn't one for its HOME_DIR """
+        work_area = self.ops['work_area']
+        if work_area is None or work_area.home_dir != self.HOME_DIR:
+            return None
+        return work_area
+
     def getSetupString(self):
         """ Construct the gridpack setup string (basically the name of the gridpack) """
         return "{proc}_{tag}_run{N:d}".format(proc=self.ops['process'],tag=self.ops['tag'],N=self.ops['run'])
@@ -252,25 +581,26 @@ class Gridpack(object):
         setup = self.getSetupString()
         return '%s_%s.%s' % (setup,self.SCANFILE_POSTFIX,self.SCANFILE_TYPE)
 
+    def getScanArrayString(self):
+        """ Construct the binary scanpoints file string """
+        setup = self.getSetupString()
+        return '%s_%s.%s' % (setup,self.SCANFILE_POSTFIX,self.SCANARRAY_TYPE)
+
     def getGridrunOutputDirectory(self,create=False):
         """
             Returns the full path to the directory were unpacking and running of a generated gridpack
             will take place
         """
-        if os.getcwd() != self.HOME_DIR:
-            err_str = "Call to getGridrunOutputDirectory() when not in self.HOME_DIR!"
-            err_str += "\n\tself.HOME_DIR: %s" % (self.HOME_DIR)
-            err_str += "\n\tos.getcwd():   %s" % (os.getcwd())
-            raise RuntimeError(err_str)
-        if create and not os.path.exists(self.GRIDRUN_DIR):
-            os.mkdir(self.GRIDRUN_DIR)
-        process_subdir = os.path.join(self.GRIDRUN_DIR,self.ops['process'])
-        if create and not os.path.exists(process_subdir):
-            os.mkdir(process_subdir)
+        gridrun_dir = self.getPath(self.GRIDRUN_DIR)
+        if create:
+            make_dir(gridrun_dir)
+        process_subdir = os.path.join(gridrun_dir,self.ops['process'])
+        if create:
+            make_dir(process_subdir)
         setup = self.getSetupString()
         output_dir = os.path.join(process_subdir,"%s" % (setup))
-        if create and not os.path.exists(output_dir):
-            os.mkdir(output_dir)
+        if create:
+            make_dir(output_dir)
         #return os.path.join(process_subdir,"%s" % (setup))
         return output_dir
 
@@ -279,18 +609,13 @@ class Gridpack(object):
             Returns the full path to the directory were the genproductions framework will in order
             to read the MadGraph cards
         """
-        if os.getcwd() != self.HOME_DIR:
-            err_str = "Call to getTargetDirectory() when not in self.HOME_DIR!"
-            err_str += "\n\tself.HOME_DIR: %s" % (self.HOME_DIR)
-            err_str += "\n\tos.getcwd():   %s" % (os.getcwd())
-            raise RuntimeError(err_str)
-        process_subdir = os.path.join(self.CARD_DIR,"%s_cards" % (self.ops['process']))
-        if create and not os.path.exists(process_subdir):
-            os.mkdir(process_subdir)
+        process_subdir = self.getPath(self.CARD_DIR,"%s_cards" % (self.ops['process']))
+        if create:
+            make_dir(process_subdir)
         setup = self.getSetupString()
         target_dir = os.path.join(process_subdir,setup)
-        if create and not os.path.exists(target_dir):
-            os.mkdir(target_dir)
+        if create:
+            make_dir(target_dir)
         return target_dir
 
     def limitSettings(self,header=True,depth=0):
@@ -339,7 +664,7 @@ class Gridpack(object):
         info += indent + "ScanType    : %s\n" % (self.ops['stype'])
         info += indent + "BatchType   : %s\n" % (self.ops['btype'])
         info += indent + "Rwgt Points : %d\n" % (self.ops['num_rwgt_pts'])
-        info += indent + "Scan Points : %d\n" % (len(self.scan_pts))
+        info += indent + "Scan Points : %d\n" % (self.getNumScanPoints())
         info += self.limitSettings(header=True,depth=depth)
         return info
 
@@ -374,7 +699,7 @@ class Gridpack(object):
         info += indent + "Tarball File: %s\n" % (self.getTarballString())
         info += indent + "Scan File   : %s\n" % (self.getScanfileString())
         info += indent + "Rwgt Points : %d\n" % (self.ops['num_rwgt_pts'])
-        info += indent + "Scan Points : %d\n" % (len(self.scan_pts))
+        info += indent + "Scan Points : %d\n" % (self.getNumScanPoints())
         info += self.directorySettings(header=False,depth=depth)
         info += self.limitSettings(header=True,depth=depth)
         return info
@@ -386,14 +711,16 @@ class Gridpack(object):
             Checks for the existence of certain files/directories in order to determine if this
             gridpack configuration has already been produced (or is in the process of being produced)
         """
-        if os.getcwd() != self.HOME_DIR:
-            err_str  = "Call to exists() when not in self.HOME_DIR!"
-            err_str += "\n\tself.HOME_DIR: %s" % (self.HOME_DIR)
-            err_str += "\n\tos.getcwd():   %s" % (os.getcwd())
-            raise RuntimeError(err_str)
-        has_setup_dir = os.path.exists(self.getSetupString())
-        has_tarball   = os.path.exists(self.getTarballString())
-        has_scanfile  = os.path.exists(self.getScanfileString())
+        work_area = self.getWorkArea()
+        if work_area is not None:
+            has_setup_dir = work_area.hasFile(self.getSetupString())
+            has_tarball   = work_area.hasFile(self.getTarballString())
+            has_scanfile  = work_area.hasFile(self.getScanfileString()) or work_area.hasFile(self.getScanArrayString())
+            has_gridrun   = work_area.hasGridrun(self.ops['process'],self.getSetupString())
+            return (has_setup_dir or has_tarball or has_gridrun or has_scanfile)
+        has_setup_dir = os.path.exists(self.getPath(self.getSetupString()))
+        has_tarball   = os.path.exists(self.getPath(self.getTarballString()))
+        has_scanfile  = os.path.exists(self.getPath(self.getScanfileString())) or os.path.exists(self.getPath(self.getScanArrayString()))
         has_gridrun   = os.path.exists(self.getGridrunOutputDirectory())
         return (has_setup_dir or has_tarball or has_gridrun or has_scanfile)
 
@@ -406,6 +733,7 @@ class Gridpack(object):
 
         self.ops['tag'] = tag
         self.ops['run'] = run
+        self.num_streamed_pts = None
         self.ops['coeffs'] = {}
         for dof in dofs:    # Convert list of WCs to a dictionary
             self.ops['coeffs'][dof.getName()] = dof
@@ -441,41 +769,50 @@ class Gridpack(object):
             if len(extra_wc):
                 print "[WARNING] Scanpoints file has WCs that were not specified in this gridpack configuration, their values will be set to SM."
                 print "\t%s" % (str(extra_wc)) 
+            self.scan_pts = ScanPoints.fromDicts(self.ops['coeffs'].keys(),self.scan_pts)
+            n_removed = self.scan_pts.dedupe()
+            if n_removed:
+                print "[WARNING] Scanpoints file has {n:d} repeated rwgt points, which will be skipped".format(n=n_removed)
+            if self.ops['point_index'] is not None:
+                # Register the points now, so that gridpacks which get skipped still claim their points
+                n_removed = self.dedupeScanPoints()
+                if n_removed:
+                    print "Skipping {n:d} rwgt points already used by other gridpacks".format(n=n_removed)
             self.ops['num_rwgt_pts'] = len(self.scan_pts)
         else:
             self.scan_pts = []  # Clear the scan_pts array incase it was used previously
 
         if len(self.scan_pts) == 0:
             # The scan points will need to be set automatically
-            if num_pts > 0:
-                # Make sure we have enough points to reconstruct the parametrization
-                if self.ops['stype'] == ScanType.FRANDOM:
-                    N = len(self.ops['coeffs'].keys())
-                    num_pts = max(num_pts,1.2*(1+2*N+N*(N-1)/2))
-                elif self.ops['stype'] == ScanType.SLINSPACE:
-                    num_pts = max(num_pts,3)
-                num_pts = int(num_pts)
+            # Make sure we have enough points to reconstruct the parametrization
+            N = len(self.ops['coeffs'].keys())
+            num_pts = ScanType.getMinNumPoints(self.ops['stype'],N,num_pts)
             self.ops['num_rwgt_pts'] = num_pts
 
-            wc_limits = parse_limit_file(os.path.join(self.LIMITS_DIR,self.LIMITS_FILE))
-            for idx,c in enumerate(self.ops['coeffs'].keys()):
+            names = self.ops['coeffs'].keys()
+            low_arr,high_arr = LimitsRegistry.getShared().getLimitArrays(self.ops['limits_name'],names,fpaths=self.getLimitsFiles())
+            fixed_pt = {}   # The DoFs whose starting point was explicitly set
+            for idx,c in enumerate(names):
                 # Set the limits based on limits file (if needed/possible)
                 if self.ops['coeffs'][c].hasLimits():
                     # The dof already has limits set
+                    fixed_pt[c] = self.ops['coeffs'][c].getStart()
                     continue
-                key = "%s_%s" % (self.ops['limits_name'],c)
-                if wc_limits.has_key(key):
+                if not np.isnan(low_arr[idx]):
                     # Use limits based on those found in the limits file
-                    low  = round(wc_limits[key][0],6)
-                    high = round(wc_limits[key][1],6)
+                    low  = float(low_arr[idx])
+                    high = float(high_arr[idx])
                 else:
                     # The WC doesn't exist in the limits file, so use defaults
                     low,high = self.ops['default_limits']
                 if c in start_pt:
                     strength = start_pt[c]
+                    fixed_pt[c] = strength
                 else:
                     strength = calculate_start_point(low,high,1.25)
                 self.ops['coeffs'][c].setLimits(strength,low,high)
+            if self.ops['optimize_start'] and num_pts > 0 and not self.isStreamedScan():
+                self.optimizeStartPoint(fixed_pt)
         self.is_configured = True
         return
 
@@ -487,8 +824,6 @@ class Gridpack(object):
         BatchType.isValid(self.ops['btype'])
         ScanType.isValid(self.ops['stype'])
 
-        os.chdir(self.HOME_DIR)
-
         setup = self.getSetupString()
         if self.exists():
             print "{0:>{w}}Skipping gridpack setup: {setup}".format("",setup=setup,w=4*indent)
@@ -509,7 +844,8 @@ class Gridpack(object):
         seed = int(random.uniform(1,1e6))
         print "{ind:>{w}}Seed: {seed:d}".format(seed=seed,ind="",w=4*(indent+1))
         sed_str = "s|RWSEED=[0-9]*|RWSEED={seed:d}|g".format(seed=seed)
-        run_process(['sed','-i','-e',sed_str,self.GENPROD_SCRIPT])
+        with self.__genprod_lock:
+            run_process(['sed','-i','-e',sed_str,self.getPath(self.GENPROD_SCRIPT)])
 
         target_dir = self.getTargetDirectory(create=False)
         if os.path.exists(target_dir):
@@ -533,20 +869,35 @@ class Gridpack(object):
         self.loadCustomizeCard()
         self.loadRunCard()
 
-        extra_customize_ops = []
-        if self.ops['flavor_scheme'] == 5:
-            extra_customize_ops.append('set param_card MB 0.0')
-            extra_customize_ops.append('set param_card ymb 0.0')
-        for c,dof in self.ops['coeffs'].items():
-            for k,v in dof.eval(dof.getStart()).items():
+        proc_tar = self.saveProcessCard(indent=indent+1)   # NOTE: This makes a lot of modifcations to the card after copying
+
+        # The MG starting point either goes into a full param card or gets set from the customize card
+        param_tar = None
+        if self.ops['write_param_card']:
+            model_dir = self.getParamCardModelDir(indent=indent+1)
+            if model_dir is not None:
+                try:
+                    param_tar = self.saveParamCard(model_dir)
+                except RuntimeError as e:
+                    # e.g. the UFO writer doesn't run with this interpreter, MadGraph can still set the values itself
+                    print "{ind}[WARNING] Falling back to 'set param_card' lines: {err}".format(err=e,ind=" "*4*(indent+1))
+        if param_tar is None:
+            extra_customize_ops = []
+            for k,v in self.getStartParams():
                 extra_customize_ops.append('set param_card {wc} {val:.6f}'.format(wc=k,val=v))
-        self.modifyCustomizeCard(*extra_customize_ops)
+            self.modifyCustomizeCard(*extra_customize_ops)
         self.modifyRunCard(**self.ops['runcard_ops'])
 
         customize_tar = self.saveCustomizeCard()
         run_tar       = self.saveRunCard()
         rwgt_tar      = self.saveReweightCard()                 # NOTE: Can potentially modify self.scan_pts
-        proc_tar      = self.saveProcessCard(indent=indent+1)   # NOTE: This makes a lot of modifcations to the card after copying
+
+        work_area = self.getWorkArea()
+        if work_area is not None:
+            # The scanpoints files are what marks this gridpack as existing until the next refresh
+            work_area.add(self.getScanfileString())
+            if self.ops['scan_array']:
+                work_area.add(self.getScanArrayString())
 
         # Sets the initial WC phase space point for MadGraph to start from (appends to customize card)
         #set_initial_point(customize_tar,self.ops['coeffs'],flavor_scheme=self.ops['flavor_scheme'])
@@ -582,8 +933,6 @@ class Gridpack(object):
             print "The gridpack has not been configured yet, so no cleaning can be done!"
             return
 
-        os.chdir(self.HOME_DIR)
-
         print "Cleaning files related to current gridpack configuration: %s" % (self.getSetupString())
         target_dir = self.getTargetDirectory(create=False)
         if os.path.exists(target_dir) and os.path.isdir(target_dir):
@@ -591,7 +940,7 @@ class Gridpack(object):
             print "\tRemoving existing directory: %s " % (target_dir)
             shutil.rmtree(target_dir)
 
-        setup_dir = self.getSetupString()
+        setup_dir = self.getPath(self.getSetupString())
         if os.path.exists(setup_dir) and os.path.isdir(setup_dir):
             # This is the directory that gets created by the setup_production.sh script (in LOCAL or CMSCONNECT mode)
             print "\tRemoving existing directory: %s " % (setup_dir)
@@ -603,36 +952,48 @@ class Gridpack(object):
             print "\tRemoving existing directory: %s " % (gridrun_dir)
             shutil.rmtree(gridrun_dir)
 
-        tarball_file = self.getTarballString()
+        tarball_file = self.getPath(self.getTarballString())
         if os.path.exists(tarball_file) and not os.path.isdir(tarball_file):
             # This is the tarball created by the setup_production.sh script
             print "\tRemoving existing file: %s" % (tarball_file)
             os.remove(tarball_file)
 
-        scanpoints_file = self.getScanfileString()
+        scanpoints_file = self.getPath(self.getScanfileString())
         if os.path.exists(scanpoints_file) and not os.path.isdir(scanpoints_file):
             # This is the txt file which contains the recorded starting point and list of madgraph rwgt points
             print "\tRemoving existing file: %s" % (scanpoints_file)
             os.remove(scanpoints_file)
 
-        log_file = "%s.log" % (self.getSetupString())
+        scanarray_file = self.getPath(self.getScanArrayString())
+        if os.path.exists(scanarray_file) and not os.path.isdir(scanarray_file):
+            # This is the binary version of the scanpoints file
+            print "\tRemoving existing file: %s" % (scanarray_file)
+            os.remove(scanarray_file)
+
+        log_file = self.getPath("%s.log" % (self.getSetupString()))
         if os.path.exists(log_file) and not os.path.isdir(log_file):
             # This is the log file created by the setup_production.sh script
             print "\tRemoving existing file: %s" % (log_file)
             os.remove(log_file)
 
-        debug_file = "%s.debug" % (self.getSetupString())
+        debug_file = self.getPath("%s.debug" % (self.getSetupString()))
         if os.path.exists(debug_file) and not os.path.isdir(debug_file):
             # This is the debug file created by the setup_production.sh script (only in CMSCONNECT mode)
             print "\tRemoving existing file: %s" % (debug_file)
             os.remove(debug_file)
 
-        codegen_file = "%s_codegen.log" % (self.getSetupString())
+        codegen_file = self.getPath("%s_codegen.log" % (self.getSetupString()))
         if os.path.exists(codegen_file) and not os.path.isdir(codegen_file):
             # This is the codegen log file created by the setup_production.sh script (only in CMSCONNECT mode)
             print "\tRemoving existing file: %s" % (codegen_file)
             os.remove(codegen_file)
 
+        work_area = self.getWorkArea()
+        if work_area is not None:
+            for fpath in [setup_dir,tarball_file,scanpoints_file,scanarray_file,log_file,debug_file,codegen_file]:
+                work_area.remove(fpath)
+            work_area.removeGridrun(self.ops['process'],self.getSetupString())
+
         self.is_configured = False
 
     def submit(self):
@@ -643,24 +1004,26 @@ class Gridpack(object):
         if not os.path.exists(target_dir):
             print "[ERROR] Can't find target directory, %s" % (target_dir)
             return False
+        # Note: The genproductions scripts expect the cards dir relative to the dir they are run from
+        target_dir = os.path.relpath(target_dir,self.HOME_DIR)
         print "Submit gridpack: %s..." % (setup)
         print "\tBatchType: %s" % (btype)
         if btype == BatchType.LOCAL:
             # For interactive/serial running
             if self.ops['save_diagrams']:
-                run_process(['./diagram_generation.sh',setup,target_dir])
+                run_process(['./diagram_generation.sh',setup,target_dir],cwd=self.HOME_DIR)
             else:
-                run_process(['./gridpack_generation.sh',setup,target_dir,"local","ALL",self.CURR_ARCH,self.CURR_RELEASE])
+                run_process(['./gridpack_generation.sh',setup,target_dir,"local","ALL",self.CURR_ARCH,self.CURR_RELEASE],cwd=self.HOME_DIR)
             return True
         elif btype == BatchType.LSF:
             # For batch running
-            run_process(['./submit_gridpack_generation.sh','15000','15000','1nd',setup,target_dir,'8nh'])
+            run_process(['./submit_gridpack_generation.sh','15000','15000','1nd',setup,target_dir,'8nh'],cwd=self.HOME_DIR)
             return True
         elif btype == BatchType.CMSCONNECT:
             # For cmsconnect running
-            debug_file = "%s.debug" % (setup)
+            debug_file = self.getPath("%s.debug" % (setup))
             cmsconnect_cores = 1
-            print '\tCurrent PATH: {0}'.format(os.getcwd())
+            print '\tCurrent PATH: {0}'.format(self.HOME_DIR)
             print '\tWill execute: ./submit_cmsconnect_gridpack_generation.sh {setup} {dir} {cores} "{mem}" {arch} {release}'.format(
                 setup=setup,
                 dir=target_dir,
@@ -672,8 +1035,11 @@ class Gridpack(object):
             subprocess.Popen(
                 ["./submit_cmsconnect_gridpack_generation.sh",setup,target_dir,str(cmsconnect_cores),"15 Gb",self.CURR_ARCH,self.CURR_RELEASE],
                 stdout=open(debug_file,'w'),
-                stderr=subprocess.STDOUT
+                stderr=subprocess.STDOUT,
+                cwd=self.HOME_DIR
             )
+            if self.getWorkArea() is not None:
+                self.getWorkArea().add(debug_file)
             return True
         elif btype == BatchType.CONDOR:
             # Not currently working
@@ -687,8 +1053,6 @@ class Gridpack(object):
 
     def run(self,events,seed,cores):
         """ Unapack and run an existing gridpack to produce events in an LHE file """
-        os.chdir(self.HOME_DIR)
-
         setup = self.getSetupString()
         print "Running Gridpack: %s" % (setup)
         print "\tSetting up directories..."
@@ -698,6 +1062,8 @@ class Gridpack(object):
             print "Removing existing output directory: %s" % (output_dir)
             shutil.rmtree(output_dir)
         output_dir = self.getGridrunOutputDirectory(create=True)
+        if self.getWorkArea() is not None:
+            self.getWorkArea().addGridrun(self.ops['process'],setup)
         #if os.path.exists(output_dir):
         #    # We already ran the gridpack once!
         #    print "Output directory already exists, skipping gridpack run: %s" % (setup)
@@ -705,7 +1071,7 @@ class Gridpack(object):
         #else:
         #    os.mkdir(output_dir)
 
-        tarball = self.getTarballString()
+        tarball = self.getPath(self.getTarballString())
         if not os.path.exists(tarball):
             print "No tarball file found! Skipping..."
             return
@@ -715,17 +1081,31 @@ class Gridpack(object):
         print "\tExtracting tarball..."
         run_process(['tar','xaf',tarball,'-C',output_dir])
 
-        os.chdir(output_dir)
-
         #print "\tExtracting tarball..."
         #run_process(['tar','xaf',tarball])
 
         print "\tRunning gridpack..."
-        run_process(['./runcmsgrid.sh',str(events),str(seed),str(cores)])
-
-        os.chdir(self.HOME_DIR)
+        run_process(['./runcmsgrid.sh',str(events),str(seed),str(cores)],env=self.getRunEnv(),cwd=output_dir)
         return
 
+    def getRunEnv(self):
+        """ Returns the environment for running runcmsgrid.sh, which is how the reweighting setup gets passed to it """
+        env = dict(os.environ)
+        if self.getOption('rwgt_mode') is not None:
+            env['RWGT_MODE'] = str(self.getOption('rwgt_mode'))
+        if self.getOption('rwgt_shards') is not None:
+            env['RWGT_NSHARDS'] = str(self.getOption('rwgt_shards'))
+        return env
+
+    def runSeeds(self,events,seeds,cores=1,pool=None,merge=True):
+        """
+            Run the gridpack once for each seed, with the tarball only being extracted once and the
+            seeds running concurrently, see GridpackRunPool. Returns the list of SeedResult
+        """
+        if pool is None:
+            pool = GridpackRunPool()
+        return pool.run(self,events,seeds,cores=cores,merge=merge)
+
 if __name__ == "__main__":
     gridpack = Gridpack(
         process='ttllDecay',
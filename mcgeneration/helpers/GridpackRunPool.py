@@ -0,0 +1,324 @@
+import os
+import multiprocessing
+import shutil
+import stat
+import subprocess
+import tempfile
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from ProcessRunner import ProcessRunner
+from helper_tools import make_dir, merge_lhe_files
+
+# A fixed number of cores shared between concurrently running jobs, a job blocks until enough cores are free
+class CoreBudget(object):
+    def __init__(self,cores):
+        self.total = max(1,int(cores))
+        self.free = self.total
+        self.__cond = threading.Condition()
+
+    def acquire(self,n):
+        """ Blocks until n cores are free and claims them, returns the number of cores claimed """
+        n = min(max(1,n),self.total)   # A job can never ask for more than the full budget
+        with self.__cond:
+            while self.free < n:
+                self.__cond.wait()
+            self.free -= n
+        return n
+
+    def release(self,n):
+        with self.__cond:
+            self.free += n
+            self.__cond.notify_all()
+
+# The outcome of running a gridpack with a single seed
+class SeedResult(object):
+    def __init__(self,setup,seed,lhe_file=None,result=None,duration=0.0,error=None):
+        self.setup    = setup
+        self.seed     = seed
+        self.lhe_file = lhe_file    # Path to the per-seed LHE file, None if the run failed
+        self.result   = result      # The ProcessResult of runcmsgrid.sh
+        self.duration = duration    # Wall time (in seconds), including making the work dir
+        self.error    = error
+
+    def isSuccess(self):
+        return self.error is None and self.lhe_file is not None
+
+    def __str__(self):
+        s = "{setup} seed {seed}: {status} ({t:.1f}s)".format(
+            setup=self.setup,
+            seed=self.seed,
+            status='ok' if self.isSuccess() else 'failed',
+            t=self.duration
+        )
+        if self.error is not None:
+            s += " -- {err}".format(err=self.error)
+        return s
+
+# Runs gridpack tarballs for many seeds on the local machine. Each tarball is only extracted once into a
+#   read-only cache next to its gridrun dir, then every seed gets its own work dir with a clone of the
+#   extracted gridpack and the seeds run concurrently, limited by a shared core budget.
+#   The clone depends on the link_mode:
+#       'reflink':  cp --reflink=always, a full copy-on-write clone (needs e.g. btrfs or xfs)
+#       'hardlink': The mgbasedir and any binaries/libraries in process/ are hard linked, everything else
+#                   (cards, scripts, grids, ...) is copied, since runcmsgrid.sh and madevent modify those
+#                   in place. The cached files are made read-only, so an unexpected in-place write fails
+#                   instead of silently changing the cache
+#       'copy':     A full copy
+#       'auto':     reflink if the filesystem supports it, otherwise hardlink
+class GridpackRunPool(object):
+    CACHE_DIR   = '.extracted'          # Relative to the gridrun dir of a process
+    STAMP_FILE  = '.tarball_stamp'      # Records which tarball the cache was extracted from
+    RUN_SCRIPT  = 'runcmsgrid.sh'
+    RUN_LHE     = 'cmsgrid_final.lhe'   # The LHE file produced by runcmsgrid.sh
+    LINK_DIRS   = ['mgbasedir']         # Top level dirs which are only read while running
+    LINK_SUFFIXES = ['.a','.so','.o']   # Files in other dirs which are only read while running
+    LINK_MODES  = ['auto','reflink','hardlink','copy']
+
+    def __init__(self,max_cores=None,link_mode='auto',keep_work=False,verbose=False):
+        """
+            max_cores: The core budget shared by all seeds, defaults to the number of cores of the machine
+            keep_work: Keep the work dir of each seed, instead of removing it after the run
+        """
+        if not link_mode in self.LINK_MODES:
+            raise ValueError("Unknown link mode: %s" % (link_mode))
+        if max_cores is None:
+            max_cores = multiprocessing.cpu_count()
+        self.budget = CoreBudget(max_cores)
+        self.link_mode = link_mode
+        self.keep_work = keep_work
+        self.verbose = verbose
+        self.__lock = threading.Lock()
+        self.__cache_locks = {}     # {cache dir: lock}, so each tarball is only extracted by one thread
+        self.__reflink = {}         # {cache dir: reflinks supported}
+
+    def getCacheLock(self,cache_dir):
+        with self.__lock:
+            if not self.__cache_locks.has_key(cache_dir):
+                self.__cache_locks[cache_dir] = threading.Lock()
+            return self.__cache_locks[cache_dir]
+
+    def getCacheDirectory(self,gridpack):
+        """ Returns the dir the tarball of a gridpack gets extracted to """
+        tarball = gridpack.getTarballString()
+        name = tarball[:-len(gridpack.TARBALL_TYPE)-1]
+        return gridpack.getPath(gridpack.GRIDRUN_DIR,gridpack.getOption('process'),self.CACHE_DIR,name)
+
+    def getTarballStamp(self,tarball):
+        st = os.stat(tarball)
+        return "{size:d} {mtime:.6f}".format(size=st.st_size,mtime=st.st_mtime)
+
+    def extract(self,gridpack):
+        """ Extract the tarball of a gridpack into the cache (if not already there), returns the cache dir """
+        tarball = gridpack.getPath(gridpack.getTarballString())
+        if not os.path.exists(tarball):
+            raise IOError("No tarball file found: %s" % (tarball))
+        cache_dir = self.getCacheDirectory(gridpack)
+        stamp = self.getTarballStamp(tarball)
+        stamp_file = os.path.join(cache_dir,self.STAMP_FILE)
+        with self.getCacheLock(cache_dir):
+            if os.path.exists(stamp_file):
+                with open(stamp_file,'r') as f:
+                    if f.read().strip() == stamp:
+                        return cache_dir
+                # The tarball was re-made since it was extracted
+                shutil.rmtree(cache_dir)
+            parent = os.path.dirname(cache_dir)
+            if not os.path.exists(parent):
+                os.makedirs(parent)
+            tmp_dir = tempfile.mkdtemp(prefix='.extract_',dir=parent)
+            try:
+                print "Extracting tarball: {fn}".format(fn=os.path.basename(tarball))
+                res = ProcessRunner.execute(['tar','xaf',tarball,'-C',tmp_dir],max_lines=20)
+                if not res.isSuccess():
+                    raise RuntimeError("Failed to extract {fn}: {err}".format(fn=tarball,err=" ".join(res.stderr)))
+                self.makeReadOnly(tmp_dir)
+                with open(os.path.join(tmp_dir,self.STAMP_FILE),'w') as f:
+                    f.write(stamp + '\n')
+                if os.path.exists(cache_dir):
+                    shutil.rmtree(cache_dir)
+                os.rename(tmp_dir,cache_dir)
+            except:
+                shutil.rmtree(tmp_dir,ignore_errors=True)
+                raise
+        return cache_dir
+
+    def makeReadOnly(self,root):
+        """ Removes the write permission of all regular files, the dirs stay writable so they can be removed """
+        for dpath,dnames,fnames in os.walk(root):
+            for fn in fnames:
+                fpath = os.path.join(dpath,fn)
+                if os.path.islink(fpath):
+                    continue
+                mode = os.stat(fpath).st_mode
+                os.chmod(fpath,mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+    def hasReflink(self,cache_dir,work_dir):
+        """ Checks (once per cache dir) if files can be reflinked from the cache into the work dirs """
+        with self.__lock:
+            if self.__reflink.has_key(cache_dir):
+                return self.__reflink[cache_dir]
+        src = os.path.join(cache_dir,self.STAMP_FILE)
+        dst = os.path.join(work_dir,'.reflink_test')
+        with open(os.devnull,'w') as devnull:
+            ok = subprocess.call(['cp','--reflink=always',src,dst],stdout=devnull,stderr=devnull) == 0
+        if os.path.exists(dst):
+            os.remove(dst)
+        with self.__lock:
+            self.__reflink[cache_dir] = ok
+        return ok
+
+    def isLinkable(self,rel_path):
+        """ Checks if a file (relative to the cache dir) is never modified in place while running """
+        if rel_path.split(os.sep)[0] in self.LINK_DIRS:
+            return True
+        return os.path.splitext(rel_path)[1] in self.LINK_SUFFIXES
+
+    def copyFile(self,src,dst):
+        shutil.copy2(src,dst)
+        os.chmod(dst,os.stat(dst).st_mode | stat.S_IWUSR)
+
+    def cloneTree(self,src,dst,hardlink=True):
+        """ Clone the extracted gridpack, hard linking the files which are only read if hardlink is True """
+        for dpath,dnames,fnames in os.walk(src):
+            rel_dir = os.path.relpath(dpath,src)
+            out_dir = os.path.normpath(os.path.join(dst,rel_dir))
+            make_dir(out_dir)
+            for name in dnames + fnames:
+                spath = os.path.join(dpath,name)
+                dpath_out = os.path.join(out_dir,name)
+                if os.path.islink(spath):
+                    os.symlink(os.readlink(spath),dpath_out)
+                    if name in dnames:
+                        # os.walk doesn't follow symlinked dirs, so nothing else to do
+                        continue
+                elif name in dnames:
+                    continue
+                elif hardlink and self.isLinkable(os.path.normpath(os.path.join(rel_dir,name))):
+                    os.link(spath,dpath_out)
+                else:
+                    self.copyFile(spath,dpath_out)
+
+    def makeWorkDirectory(self,gridpack,cache_dir,seed):
+        """ Make a fresh work dir for a seed with a clone of the extracted gridpack, returns its path """
+        work_dir = os.path.join(gridpack.getGridrunOutputDirectory(create=True),"seed{seed}".format(seed=seed))
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+        os.mkdir(work_dir)
+        mode = self.link_mode
+        if mode == 'auto':
+            mode = 'reflink' if self.hasReflink(cache_dir,work_dir) else 'hardlink'
+        for name in os.listdir(cache_dir):
+            if name == self.STAMP_FILE:
+                continue
+            src = os.path.join(cache_dir,name)
+            dst = os.path.join(work_dir,name)
+            if mode == 'reflink':
+                res = ProcessRunner.execute(['cp','-a','--reflink=always',src,dst],max_lines=20)
+                if not res.isSuccess():
+                    raise RuntimeError("Failed to reflink {src}: {err}".format(src=src,err=" ".join(res.stderr)))
+                subprocess.call(['chmod','-R','u+w',dst])
+            elif os.path.isdir(src) and not os.path.islink(src):
+                self.cloneTree(src,dst,hardlink=(mode == 'hardlink'))
+            else:
+                self.copyFile(src,dst)
+        return work_dir
+
+    def getSeedLHE(self,gridpack,seed):
+        """ The LHE file of a single seed, next to the gridrun LHE file of the gridpack """
+        base,ext = os.path.splitext(gridpack.GRIDRUN_LHE)
+        return os.path.join(gridpack.getGridrunOutputDirectory(),"{base}_seed{seed}{ext}".format(base=base,seed=seed,ext=ext))
+
+    def prepare(self,gridpack):
+        """ Remove the outputs of any previous run of the gridpack and extract its tarball, returns the cache dir """
+        output_dir = gridpack.getGridrunOutputDirectory()
+        if os.path.exists(output_dir):
+            # The extracted tarball cache lives outside of the output dir, so it is kept
+            for name in os.listdir(output_dir):
+                fpath = os.path.join(output_dir,name)
+                if os.path.isdir(fpath) and not os.path.islink(fpath):
+                    shutil.rmtree(fpath)
+                else:
+                    os.remove(fpath)
+        work_area = gridpack.getWorkArea()
+        if work_area is not None:
+            work_area.addGridrun(gridpack.getOption('process'),gridpack.getSetupString())
+        return self.extract(gridpack)
+
+    def runSeed(self,gridpack,events,seed,cores=1):
+        """ Run the gridpack with one seed in its own work dir (blocks until enough cores are free) """
+        cores = self.budget.acquire(cores)
+        try:
+            return self.executeSeed(gridpack,events,seed,cores)
+        finally:
+            self.budget.release(cores)
+
+    def executeSeed(self,gridpack,events,seed,cores):
+        """ Run the gridpack with one seed in its own work dir, the caller is responsible for the core budget """
+        t0 = time.time()
+        setup = gridpack.getSetupString()
+        work_dir = None
+        try:
+            cache_dir = self.extract(gridpack)
+            work_dir = self.makeWorkDirectory(gridpack,cache_dir,seed)
+            print "Running {setup} with seed {seed} on {n:d} core(s)".format(setup=setup,seed=seed,n=cores)
+            res = ProcessRunner.execute(
+                ['./'+self.RUN_SCRIPT,str(events),str(seed),str(cores)],
+                cwd=work_dir,
+                env=gridpack.getRunEnv(),
+                verbose=self.verbose,
+                max_lines=50
+            )
+            lhe_file = os.path.join(work_dir,self.RUN_LHE)
+            if not res.isSuccess() or not os.path.exists(lhe_file):
+                tail = res.stderr[-3:] if len(res.stderr) else res.getTail(3)
+                err = "{res}, last output: {tail}".format(res=res,tail=" | ".join(tail))
+                return SeedResult(setup,seed,result=res,duration=time.time()-t0,error=err)
+            seed_lhe = self.getSeedLHE(gridpack,seed)
+            os.rename(lhe_file,seed_lhe)
+            return SeedResult(setup,seed,lhe_file=seed_lhe,result=res,duration=time.time()-t0)
+        except Exception as e:
+            return SeedResult(setup,seed,duration=time.time()-t0,error=repr(e))
+        finally:
+            if work_dir is not None and not self.keep_work:
+                shutil.rmtree(work_dir,ignore_errors=True)
+
+    def merge(self,gridpack,results):
+        """ Merge the LHE files of the successful seeds into the gridrun LHE file, returns the number of events """
+        lhe_files = [r.lhe_file for r in results if r.isSuccess()]
+        if not len(lhe_files):
+            return 0
+        out = os.path.join(gridpack.getGridrunOutputDirectory(),gridpack.GRIDRUN_LHE)
+        n = merge_lhe_files(lhe_files,out)
+        print "Merged {n:d} events from {k:d} seeds into {fn}".format(n=n,k=len(lhe_files),fn=out)
+        return n
+
+    def run(self,gridpack,events,seeds,cores=1,merge=True):
+        """
+            Run the gridpack for each of the seeds concurrently, returns a list of SeedResult in the order
+            of the seeds. If merge is True, the events of all successful seeds are also merged into the
+            gridrun LHE file of the gridpack
+        """
+        t0 = time.time()
+        # Extract up front, so that the seeds don't all wait on the same lock while holding their cores
+        self.prepare(gridpack)
+        pool = ThreadPool(max(1,min(len(seeds),self.budget.total)))
+        try:
+            results = pool.map(lambda seed: self.runSeed(gridpack,events,seed,cores),seeds)
+        finally:
+            pool.close()
+            pool.join()
+        if merge:
+            self.merge(gridpack,results)
+        for r in results:
+            if not r.isSuccess():
+                print "[ERROR] {res}".format(res=r)
+        print "Ran {k:d}/{n:d} seeds of {setup} in {t:.1f}s".format(
+            k=len([r for r in results if r.isSuccess()]),
+            n=len(results),
+            setup=gridpack.getSetupString(),
+            t=time.time() - t0
+        )
+        return results
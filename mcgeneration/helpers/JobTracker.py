@@ -2,6 +2,8 @@ import os
 import datetime
 import math
 from helper_tools import run_process,regex_match
+from ProcessRunner import ProcessRunner
+from WorkAreaIndex import WorkAreaIndex
 
 # Utility class for keeping track of gridpack production jobs
 # NOTE: This assumes that all the relevant log files are in the same directory
@@ -29,8 +31,10 @@ class JobTracker(object):
         return (h,m,s)
         #return (h.rjust(2,"0"),m.rjust(2,"0"),s.rjust(2,"0"))
 
-    def __init__(self,fdir='.'):
+    def __init__(self,fdir='.',work_area=None):
         self.fdir = fdir        # Where to look for output files
+        # Snapshot of the files in fdir, refreshed on every update() (can be shared with the Gridpack objects)
+        self.work_area = work_area if work_area is not None else WorkAreaIndex(fdir)
         self.intg_cutoff = -1
         self.stuck_cutoff = -1
         self.tarball_cutoff = -1    # Large value requires the tarball to go longer periods without being modified
@@ -45,10 +49,14 @@ class JobTracker(object):
         self.scram_arch = 'slc7_amd64_gcc630'
         self.cmssw_release = 'CMSSW_9_3_16'
 
+        # Used to check the log files of many jobs at once
+        self.runner = ProcessRunner(max_workers=8,timeout=60)
+
         self.update()
 
     def update(self):
         self.last_update = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.work_area.refresh()
         self.all = self.getJobs(no_cache=True)               # A job is a string of the form: p_c_r
         self.finished = self.getFinishedJobs(no_cache=True)
         self.running = self.getRunningJobs(no_cache=True)
@@ -63,7 +71,8 @@ class JobTracker(object):
         self.resubmitted[job] += 1
 
     def setDirectory(self,fdir):
-        self.fdir = fdr
+        self.fdir = fdir
+        self.work_area = WorkAreaIndex(fdir)
 
     def setIntegrateCutoff(self,v):
         self.intg_cutoff = v
@@ -86,25 +95,46 @@ class JobTracker(object):
         self.tags_filter = []
         self.runs_filter = []
 
+    # Checks if a file exists, files in the tracked directory are looked up in the work area snapshot
+    def fileExists(self,fpath):
+        if os.path.dirname(os.path.abspath(fpath)) == self.work_area.home_dir:
+            return self.work_area.hasFile(os.path.basename(fpath))
+        return os.path.exists(fpath)
+
     # Return a list of scanpoint files in the target directory
     def getScanpointFiles(self,fdir='.'):
+        if os.path.abspath(fdir) == self.work_area.home_dir:
+            fnames = []
+            for k in self.work_area.getSetups([WorkAreaIndex.SCANFILE,WorkAreaIndex.SCANARRAY]):
+                for atype in [WorkAreaIndex.SCANFILE,WorkAreaIndex.SCANARRAY]:
+                    fn = self.work_area.getArtifact(k[0],k[1],k[2],atype)
+                    if fn is not None:
+                        fnames.append(fn)
+            return fnames
         fnames = []
         for fn in os.listdir(fdir):
             fpath = os.path.join(fdir,fn)
             if os.path.isdir(fpath):
                 continue
-            if fn.find("_scanpoints.txt") < 0:
+            if fn.find("_scanpoints.txt") < 0 and fn.find("_scanpoints.npy") < 0:
                 continue
             fnames.append(fn)
         return fnames
 
+    # Returns the path to the scanpoints file of a job, falls back to the binary version if there is no text file
+    def getScanpointFile(self,tag_str):
+        fpath = os.path.join(self.fdir,"{tag}_scanpoints.txt".format(tag=tag_str))
+        if not self.fileExists(fpath):
+            fpath = os.path.join(self.fdir,"{tag}_scanpoints.npy".format(tag=tag_str))
+        return fpath
+
     # Check if the job has produced a tarball
     def hasTarball(self,chk_file,fdir='.'):
         arr = chk_file.split('_')
         p,c,r = arr[:3]
         tag_str = "{proc}_{coeff}_{run}".format(proc=p,coeff=c,run=r)
         fpath = os.path.join(fdir,"{tag}_{scram_arch}_{release}_tarball.tar.xz".format(tag=tag_str,scram_arch=self.scram_arch,release=self.cmssw_release))
-        return os.path.exists(fpath)
+        return self.fileExists(fpath)
 
     # Check if the job's .log file contains an error line
     def logHasError(self,job,fdir='.'):
@@ -129,12 +159,33 @@ class JobTracker(object):
         if not self.isJob(job):
             return False
         fn = os.path.join(fdir,job + '.log')
-        if not os.path.exists(fn):
+        if not self.fileExists(fn):
             return False
-        rgx = '^Process output directory %s not found\.' % (job)
-        ret = run_process(['grep','-l','-e',rgx,fn],verbose=False)
+        ret = run_process(self.getFailedCodegenCmd(job,fn),verbose=False)
         return bool(ret)
 
+    def getFailedCodegenCmd(self,job,fn):
+        rgx = '^Process output directory %s not found\.' % (job)
+        return ['grep','-l','-e',rgx,fn]
+
+    # Same as failedCodegen(), but checks the .log files of all the jobs in parallel
+    def getFailedCodegenJobs(self,jobs,fdir='.'):
+        to_check = []
+        for job in jobs:
+            fn = os.path.join(fdir,job + '.log')
+            if self.isJob(job) and self.fileExists(fn):
+                to_check.append((job,fn))
+        results = self.runner.map([self.getFailedCodegenCmd(job,fn) for job,fn in to_check])
+        failed = set()
+        for (job,fn),res in zip(to_check,results):
+            if res.timed_out:
+                # Fall back to checking this log in the calling thread
+                if self.failedCodegen(job,fdir):
+                    failed.add(job)
+            elif len(res.stdout):
+                failed.add(job)
+        return failed
+
     # The job produced a tarball, that stopped being modified sufficiently long ago
     def finishedTarball(self,fn):
         #b = self.hasTarball(fn,self.fdir) and (self.tarball_cutoff == -1 or self.getTarballTime(fn) > self.tarball_cutoff)
@@ -150,13 +201,13 @@ class JobTracker(object):
         input_fpath = os.path.join(fdir,"input_{tag}.tar.gz".format(tag=tag_str))
         codegen1_fpath = os.path.join(fdir,"codegen_{tag}.sh".format(tag=tag_str))
         codegen2_fpath = os.path.join(fdir,"codegen_{tag}.jdl".format(tag=tag_str))
-        if not os.path.exists(log_fpath):
+        if not self.fileExists(log_fpath):
             return True
-        elif os.path.exists(input_fpath):
+        elif self.fileExists(input_fpath):
             return True
-        elif os.path.exists(codegen1_fpath):
+        elif self.fileExists(codegen1_fpath):
             return True
-        elif os.path.exists(codegen2_fpath):
+        elif self.fileExists(codegen2_fpath):
             return True
         else:
             return False
@@ -193,9 +244,10 @@ class JobTracker(object):
     def getFinishedJobs(self,no_cache=False):
         if no_cache or not self.use_cached_update:
             jobs = self.getJobs(no_cache=True)
+            failed = self.getFailedCodegenJobs(jobs,self.fdir)
             finished = set()
             for fn in jobs:
-                if self.isFinished(fn):
+                if self.finishedTarball(fn) or fn in failed:
                     finished.add(fn)
             return finished
         else:
@@ -284,40 +336,52 @@ class JobTracker(object):
         tag_str = "{proc}_{coeff}_{run}".format(proc=p,coeff=c,run=r)
         if fn in self.codegen:
             # The Job is still in the codegen phase --> use scanpoints file to determine time
-            fpath = os.path.join(self.fdir,"{tag}_scanpoints.txt".format(tag=tag_str))
+            fpath = self.getScanpointFile(tag_str)
             dt = self.getLastModifiedTime(fpath)
         else:
             # The job is out of the codegen phase
-            fpath1 = os.path.join(self.fdir,"{tag}_scanpoints.txt".format(tag=tag_str))
+            fpath1 = self.getScanpointFile(tag_str)
             fpath2 = os.path.join(self.fdir,"{tag}_codegen.log".format(tag=tag_str))
             dt = self.getModifiedTimeDifference(fpath2,fpath1)
         return dt
 
     # Returns the absolute time difference (in seconds) since last modification between two files
     def getModifiedTimeDifference(self,fpath1,fpath2):
-        if not os.path.exists(fpath1) or not os.path.exists(fpath2):
+        if not self.fileExists(fpath1) or not self.fileExists(fpath2):
+            return 0
+        try:
+            fstats1 = os.stat(fpath1)
+            fstats2 = os.stat(fpath2)
+        except OSError:
+            # Removed since the last refresh of the work area
             return 0
-        fstats1 = os.stat(fpath1)
-        fstats2 = os.stat(fpath2)
         return int(abs(fstats2.st_mtime - fstats1.st_mtime))
 
     # Returns the time (relative to now) since the file was last modified
     # NOTE: Should always return > 0
     def getLastModifiedTime(self,fpath):
-        if not os.path.exists(fpath):
+        if not self.fileExists(fpath):
+            return 0
+        try:
+            fstat = os.stat(fpath)
+        except OSError:
+            # Removed since the last refresh of the work area
             return 0
-        fstat = os.stat(fpath)
         tstamp = datetime.datetime.fromtimestamp(fstat.st_mtime)
         dt = datetime.datetime.now() - tstamp
         return (dt.days*3600*24 + dt.seconds)
 
     # Reads the last n lines from each of the jobs still in the integrate phase
     def checkProgress(self,lines=5):
+        jobs = []
         for fn in sorted(self.intg_full,key=self.getIntegrateTime):
             log_file = os.path.join(self.fdir,"%s.log" % (fn))
-            if not os.path.exists(log_file):
-                continue
-            t = self.getLastModifiedTime("%s_scanpoints.txt" % (fn))
+            if self.fileExists(log_file):
+                jobs.append((fn,log_file))
+        # Read all of the log files at once, then print them in order
+        tails = self.runner.map([['tail','-n%d' % (lines),log_file] for fn,log_file in jobs],max_lines=lines)
+        for (fn,log_file),tail in zip(jobs,tails):
+            t = self.getLastModifiedTime(self.getScanpointFile(fn))
             h,m,s = self.formatTime(t)
             tot_tstr = "[%s:%s:%s]" % (h.rjust(2,"0"),m.rjust(2,"0"),s.rjust(2,"0"))
             t = self.getIntegrateTime(fn)
@@ -329,7 +393,8 @@ class JobTracker(object):
             #print "\nChecking: %s - %s - %s" % (fn,int_tstr,mod_tstr)
             #print "\nChecking: %s - Total %s - Intg %s - LogMod %s" % (fn,tot_tstr,int_tstr,mod_tstr)
             print "\nChecking: %s - %s - %s - %s" % (fn,tot_tstr,int_tstr,mod_tstr)
-            run_process(['tail','-n%d' % (lines),log_file])
+            for l in tail.stdout:
+                print l
 
     def displayJobList(self,s,arr):
         print "%s Jobs: %d" % (s,len(arr))
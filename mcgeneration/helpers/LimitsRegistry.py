@@ -0,0 +1,106 @@
+import os
+import threading
+
+import numpy as np
+
+from helper_tools import parse_limit_file
+
+# Cache of the WC limits files, indexed by (process,WC). Each file is only parsed once and then re-read
+#   whenever its modification time changes, so repeated configure/submit calls don't touch the disk
+#   beyond a stat() of each file. Several limits files (e.g. one per model) can be used together, in which
+#   case the first file in the list that has an entry for a (process,WC) pair takes precedence.
+#   Note: The shared registry returned by getShared() is meant to be used by the whole process
+class LimitsRegistry(object):
+    PRECISION = 6   # Number of decimal places the limits get rounded to
+    __shared = None
+
+    @classmethod
+    def getShared(cls):
+        """ Returns the process-wide registry """
+        if cls.__shared is None:
+            cls.__shared = cls()
+        return cls.__shared
+
+    @classmethod
+    def splitKey(cls,key):
+        """ Splits a limits file key of the form '<process>_<WC>' into a (process,WC) tuple """
+        arr = key.rsplit('_',1)
+        if len(arr) != 2:
+            return None
+        return tuple(arr)
+
+    def __init__(self,fpaths=[]):
+        """
+            fpaths: The limits files to use by default, in order of precedence
+        """
+        self.__lock  = threading.RLock()
+        self.__files = []
+        self.__cache = {}   # {fpath: (mtime,{(process,WC): (low,high)})}
+        for fpath in fpaths:
+            self.addFile(fpath)
+
+    def addFile(self,fpath,first=False):
+        """ Add a limits file to the default list, if first is True it takes precedence over all others """
+        fpath = os.path.abspath(fpath)
+        with self.__lock:
+            if fpath in self.__files:
+                self.__files.remove(fpath)
+            if first:
+                self.__files.insert(0,fpath)
+            else:
+                self.__files.append(fpath)
+
+    def getFiles(self):
+        return list(self.__files)
+
+    def clear(self):
+        """ Drops all cached limits, so every file gets re-read on the next lookup """
+        with self.__lock:
+            self.__cache = {}
+
+    def getTable(self,fpath):
+        """ Returns the {(process,WC): (low,high)} table of a single limits file, re-reading it if it has changed """
+        fpath = os.path.abspath(fpath)
+        mtime = os.path.getmtime(fpath)
+        with self.__lock:
+            cached = self.__cache.get(fpath)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            table = {}
+            for key,lims in parse_limit_file(fpath).iteritems():
+                k = self.splitKey(key)
+                if k is None:
+                    continue
+                table[k] = (round(lims[0],self.PRECISION),round(lims[1],self.PRECISION))
+            self.__cache[fpath] = (mtime,table)
+            return table
+
+    def getTables(self,fpaths=None):
+        """ Returns the tables of each limits file in order of precedence, defaults to the registered files """
+        if fpaths is None:
+            fpaths = self.getFiles()
+        return [self.getTable(fpath) for fpath in fpaths]
+
+    def getLimits(self,process,wc,fpaths=None):
+        """ Returns the (low,high) limits of a WC for a process, or None if no limits file has an entry for it """
+        for table in self.getTables(fpaths):
+            if table.has_key((process,wc)):
+                return table[(process,wc)]
+        return None
+
+    def getLimitArrays(self,process,names,fpaths=None):
+        """
+            Look up the limits of a list of WCs for a process, each file is checked for changes only
+            once per call. Returns a tuple of (low,high) arrays, WCs without an entry in any of the
+            limits files are NaN
+        """
+        tables = self.getTables(fpaths)
+        low  = np.full(len(names),np.nan)
+        high = np.full(len(names),np.nan)
+        for idx,wc in enumerate(names):
+            for table in tables:
+                lims = table.get((process,wc))
+                if lims is not None:
+                    low[idx],high[idx] = lims
+                    break
+        return low,high
@@ -1,10 +1,77 @@
 import os
+import hashlib
+import threading
+
+from CardEditor import MGRunCard
 
 class MGProcess(object):
     TDIR = "template_cards"
     TEMPLATE_RUN_CARD = 'run_card.dat'
     TEMPLATE_CUSTOM_CARD = 'customizecards.dat'
 
+    # The run card options recorded in the template index: {metadata key: run card option}
+    TEMPLATE_OPTIONS = {
+        'flavor_scheme': 'maxjetflavor',
+        'pdlabel': 'pdlabel',
+        'lhaid': 'lhaid',
+        'ickkw': 'ickkw',
+        'xqcut': 'xqcut',
+    }
+
+    __index = {}    # {card dir: {template dir: metadata}}
+    __lock = threading.Lock()
+
+    @classmethod
+    def readTemplateInfo(cls,fpath):
+        """ Returns the metadata dict of a single template run card """
+        with open(fpath,'r') as f:
+            run_hash = hashlib.sha1(f.read()).hexdigest()
+        run_card = MGRunCard(card_name=os.path.basename(fpath),card_dir=os.path.dirname(fpath))
+        info = {'run_card_hash': run_hash}
+        for k,op in cls.TEMPLATE_OPTIONS.iteritems():
+            info[k] = run_card.getOption(op) if run_card.hasOption(op) else None
+        if info['flavor_scheme'] is None:
+            info['flavor_scheme'] = -1
+        else:
+            info['flavor_scheme'] = int(info['flavor_scheme'])
+        if not info['ickkw'] is None:
+            info['ickkw'] = int(info['ickkw'])
+        if not info['xqcut'] is None:
+            info['xqcut'] = float(info['xqcut'])
+        return info
+
+    @classmethod
+    def buildTemplateIndex(cls,card_dir):
+        """ Reads the run card of every template in card_dir/TDIR, returns {template dir: metadata} """
+        index = {}
+        tdir = os.path.join(card_dir,cls.TDIR)
+        for d in sorted(os.listdir(tdir)):
+            fpath = os.path.join(tdir,d,cls.TEMPLATE_RUN_CARD)
+            if not os.path.isfile(fpath):
+                continue
+            index[os.path.join(cls.TDIR,d)] = cls.readTemplateInfo(fpath)
+        return index
+
+    @classmethod
+    def getTemplateIndex(cls,card_dir,refresh=False):
+        """
+            Returns the metadata index of all templates in card_dir, which is only built the first time
+            it is needed (or if refresh is True)
+        """
+        key = os.path.abspath(card_dir)
+        with cls.__lock:
+            if refresh or not cls.__index.has_key(key):
+                cls.__index[key] = cls.buildTemplateIndex(card_dir)
+            return cls.__index[key]
+
+    @classmethod
+    def groupByTemplate(cls,procs,card_dir):
+        """ Groups a list of MGProcess objects by the hash of their template run card, returns {hash: [procs]} """
+        groups = {}
+        for p in procs:
+            groups.setdefault(p.getTemplateInfo(card_dir)['run_card_hash'],[]).append(p)
+        return groups
+
     def __init__(self,name,process,pcard,tdir):
         self.setName(name)
         self.setProcess(process)
@@ -35,25 +102,22 @@ class MGProcess(object):
     def setTemplateDir(self,tdir):
         self.template_dir = os.path.join(self.TDIR,tdir)
 
+    def getTemplateInfo(self,card_dir):
+        """ Returns the metadata of the template, see buildTemplateIndex() """
+        index = self.getTemplateIndex(card_dir)
+        tdir = self.getTemplateDir()
+        if not index.has_key(tdir):
+            # Could be a template which was added after the index was built
+            index = self.getTemplateIndex(card_dir,refresh=True)
+        if not index.has_key(tdir):
+            raise IOError("No template run card found: %s" % (os.path.join(card_dir,tdir,self.TEMPLATE_RUN_CARD)))
+        return index[tdir]
+
     def getFlavorScheme(self,card_dir):
-        fpath = os.path.join(card_dir,self.getTemplateDir(),self.TEMPLATE_RUN_CARD)
-        flvr_str = "maxjetflavor"
-        comment_char = "#"
-        flvr_scheme = -1
-        with open(fpath,'r') as f:
-            for l in f:
-                l = l.strip()
-                if len(l) == 0 or l[0] == comment_char:
-                    continue
-                elif not flvr_str in l:
-                    continue
-                lst = l.split('=')
-                if len(lst) != 2:
-                    continue
-                s1,s2 = lst
-                flvr_scheme = int(s1)   # Doesn't care about whitespace
-                break
-        return flvr_scheme
+        return self.getTemplateInfo(card_dir)['flavor_scheme']
+
+    def getRunCardHash(self,card_dir):
+        return self.getTemplateInfo(card_dir)['run_card_hash']
 
 
 
@@ -0,0 +1,131 @@
+import os
+import sys
+import tempfile
+import threading
+
+from ProcessRunner import ProcessRunner
+
+# Full MadGraph param card for one of the models in addons/models. The default card of each model is written
+#   once with the model's own write_param_card.ParamCardWriter and the parameters.py defaults, then every
+#   gridpack only substitutes the values of its starting point, instead of MadGraph running one 'set param_card'
+#   command per parameter from the customize card.
+#   Note: The default card is written in a separate python process, since all UFO models use the same module
+#         names (parameters, particles, ...), which can't be imported side by side
+class ParamCard(object):
+    RESTRICT_CARD = 'restrict_default.dat'
+    PYTHON = None   # Interpreter which runs the model's UFO writer (python2 for the MG models), if None uses sys.executable
+    WRITER_SCRIPT = (
+        "import sys\n"
+        "sys.path.insert(0,sys.argv[1])\n"
+        "import parameters\n"
+        "from write_param_card import ParamCardWriter\n"
+        "ext = [p for p in parameters.all_parameters if p.nature == 'external']\n"
+        "ParamCardWriter(sys.argv[2],ext,generic=True)\n"
+    )
+    __cache = {}    # {model dir: (mtime,default card text)}
+    __lock = threading.Lock()
+
+    @classmethod
+    def canWrite(cls,model_dir):
+        """
+            Checks if a full param card can be written for the model. Models with a default restriction
+            card are skipped, since MadGraph expects the param card of the restricted model
+        """
+        if not os.path.exists(os.path.join(model_dir,'parameters.py')):
+            return False
+        if not os.path.exists(os.path.join(model_dir,'write_param_card.py')):
+            return False
+        return not os.path.exists(os.path.join(model_dir,cls.RESTRICT_CARD))
+
+    @classmethod
+    def getDefaultCard(cls,model_dir,python=None):
+        """
+            Returns the text of the default param card of a model, only re-written if parameters.py changes
+                python: The interpreter which runs the model's UFO writer, if None uses PYTHON
+        """
+        if python is None:
+            python = cls.PYTHON if cls.PYTHON is not None else sys.executable
+        model_dir = os.path.abspath(model_dir)
+        mtime = os.path.getmtime(os.path.join(model_dir,'parameters.py'))
+        with cls.__lock:
+            entry = cls.__cache.get(model_dir)
+            if entry is not None and entry[0] == mtime:
+                return entry[1]
+        fd,tmp = tempfile.mkstemp(prefix='param_card_',suffix='.dat')
+        os.close(fd)
+        try:
+            try:
+                res = ProcessRunner.execute([python,'-c',cls.WRITER_SCRIPT,model_dir,tmp],timeout=300,max_lines=20)
+            except OSError as e:
+                raise RuntimeError("Unable to run '%s' to write the param card of model %s: %s" % (python,model_dir,e))
+            if not res.isSuccess():
+                err_str  = "Unable to write the default param card of model: %s" % (model_dir)
+                err_str += "\n\t" + "\n\t".join(res.stderr)
+                raise RuntimeError(err_str)
+            with open(tmp,'r') as f:
+                text = f.read()
+        finally:
+            os.remove(tmp)
+        with cls.__lock:
+            cls.__cache[model_dir] = (mtime,text)
+        return text
+
+    @classmethod
+    def splitParamLine(cls,l):
+        """
+            Splits a parameter line of a param card (e.g. '    6 1.720000e+02 # MT ') into a tuple of
+            (text before the value,value,parameter name), returns None for any other line
+        """
+        if not '#' in l:
+            return None
+        left,right = l.split('#',1)
+        name = right.split()
+        if len(name) != 1:
+            # Comments and the dependent parameters (e.g. '# W+ : cmath.sqrt(...)')
+            return None
+        arr = left.split()
+        if len(arr) < 2 or arr[0].upper() in ['BLOCK','DECAY']:
+            return None
+        prefix = left.rstrip()
+        idx = prefix.rfind(' ')
+        return (prefix[:idx+1],prefix[idx+1:],name[0])
+
+    def __init__(self,model_dir,python=None):
+        self.model_dir = model_dir
+        self.text = self.getDefaultCard(model_dir,python=python)
+        self.values = {}    # {parameter name (lower case): value}
+
+    def setValue(self,name,value):
+        """ Sets the value of a parameter, names are case insensitive (same as 'set param_card') """
+        self.values[name.lower()] = float(value)
+
+    def render(self):
+        """ Returns the text of the param card with all of the set values substituted """
+        lines = self.text.split('\n')
+        found = set()
+        for idx,l in enumerate(lines):
+            arr = self.splitParamLine(l)
+            if arr is None:
+                continue
+            prefix,old,name = arr
+            if not self.values.has_key(name.lower()):
+                continue
+            lines[idx] = "%s%.12e # %s " % (prefix,self.values[name.lower()],name)
+            found.add(name.lower())
+        missing = set(self.values.keys()) - found
+        if len(missing):
+            raise RuntimeError("Unknown parameters for model %s: %s" % (self.model_dir,str(sorted(missing))))
+        return '\n'.join(lines)
+
+    def save(self,dst):
+        """ Atomically write the param card """
+        fd,tmp = tempfile.mkstemp(prefix=".%s." % (os.path.basename(dst)),dir=os.path.dirname(os.path.abspath(dst)))
+        try:
+            with os.fdopen(fd,'w') as f:
+                f.write(self.render())
+            os.chmod(tmp,0644)
+            os.rename(tmp,dst)
+        except:
+            os.remove(tmp)
+            raise
+        return dst
@@ -0,0 +1,70 @@
+import numpy as np
+
+# Set-based index of W.C. phase space points, used to detect repeated points in O(1)
+#   Each point is identified by a canonical key: the tuple of (name,value) pairs of its non-SM DoFs,
+#   ordered by name, with the values quantized to the 1e-6 precision used for the reweight points.
+#   Since DoFs missing from a point are at their SM value, the key doesn't depend on which (or in what
+#   order) DoFs were used to build the point.
+class PointIndex(object):
+    PRECISION = 6
+    SM_KEY = ()
+
+    @classmethod
+    def quantize(cls,v):
+        # Same rounding as getKeys(), so that both always give the same key for a point
+        return int(np.rint(v*10**cls.PRECISION))
+
+    @classmethod
+    def getKey(cls,pt):
+        """ Returns the canonical key of a point dictionary """
+        key = []
+        for k in sorted(pt.keys()):
+            q = cls.quantize(pt[k])
+            if q != 0:
+                key.append((k,q))
+        return tuple(key)
+
+    @classmethod
+    def getKeys(cls,names,arr):
+        """ Returns the canonical keys for each row of a (points x DoFs) array, with columns labeled by names """
+        arr = np.asarray(arr,dtype=np.float64)
+        if len(names) == 0:
+            # Every point is the SM point (and reshape can't infer the number of rows)
+            return [cls.SM_KEY]*(arr.shape[0] if arr.ndim == 2 else 0)
+        arr = arr.reshape(-1,len(names))
+        order = sorted(range(len(names)),key=lambda i: names[i])
+        sorted_names = [names[i] for i in order]
+        q_arr = np.rint(arr[:,order]*10**cls.PRECISION).astype(np.int64).tolist()
+        keys = []
+        for row in q_arr:
+            keys.append(tuple((n,q) for n,q in zip(sorted_names,row) if q != 0))
+        return keys
+
+    def __init__(self):
+        self.__keys = {}    # Maps the point key to the owner which registered the point
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def __contains__(self,key):
+        return self.__keys.has_key(key)
+
+    def clear(self):
+        self.__keys = {}
+
+    def add(self,key,owner=None):
+        """ Register a point key, if it is already registered the original owner is kept """
+        if not self.__keys.has_key(key):
+            self.__keys[key] = owner
+
+    def getOwner(self,key):
+        return self.__keys.get(key,None)
+
+    def isDuplicate(self,key,owner=None):
+        """
+            Checks if the key was already registered. If an owner is given, points registered by that
+            same owner don't count as duplicates (e.g. when the same gridpack gets configured again)
+        """
+        if not self.__keys.has_key(key):
+            return False
+        return owner is None or self.__keys[key] != owner
@@ -0,0 +1,144 @@
+import collections
+import subprocess
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+# The outcome of a single subprocess call
+#   Note: stdout/stderr only hold the last max_lines lines of each stream (all lines if max_lines is None)
+class ProcessResult(object):
+    def __init__(self,args,returncode,duration,stdout,stderr,timed_out=False):
+        self.args       = args
+        self.returncode = returncode
+        self.duration   = duration      # Wall time (in seconds)
+        self.stdout     = stdout
+        self.stderr     = stderr
+        self.timed_out  = timed_out
+
+    def isSuccess(self):
+        return self.returncode == 0 and not self.timed_out
+
+    def getTail(self,n=10):
+        """ Returns the last n lines of the captured stdout """
+        return self.stdout[-n:] if n > 0 else []
+
+    def __str__(self):
+        s = "'{cmd}' returned {rc} after {t:.1f}s".format(cmd=" ".join(self.args),rc=self.returncode,t=self.duration)
+        if self.timed_out:
+            s += " (timed out)"
+        return s
+
+# Runs subprocesses with a per-call timeout, keeping a bounded tail of their output. Calls can either
+#   block (run) or be handed to a pool of worker threads (submit/map), which limits how many child
+#   processes are running at the same time.
+class ProcessRunner(object):
+    @classmethod
+    def execute(cls,args,timeout=None,verbose=False,indent=0,cwd=None,env=None,max_lines=None,capture_stderr=True):
+        """
+            Run a single subprocess and wait for it to finish, returns a ProcessResult
+                timeout: Kill the process after this many seconds, if None wait forever
+                verbose: Print the stdout lines as they are produced
+                max_lines: Size of the ring buffers used to capture the output, if None keep every line
+                capture_stderr: If False, stderr is not captured and goes to the parent's stderr
+        """
+        indent_str = "\t"*indent
+        stdout = collections.deque(maxlen=max_lines)
+        stderr = collections.deque(maxlen=max_lines)
+        t0 = time.time()
+        p = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE if capture_stderr else None,
+            cwd=cwd,
+            env=env
+        )
+
+        timed_out = threading.Event()
+        timer = None
+        if timeout is not None:
+            def kill():
+                timed_out.set()
+                try:
+                    p.kill()
+                except OSError:
+                    # The process already finished
+                    pass
+            timer = threading.Timer(timeout,kill)
+            timer.daemon = True
+            timer.start()
+
+        err_reader = None
+        if capture_stderr:
+            # Drain stderr in a separate thread, so neither pipe can fill up and block the child
+            def read_stderr():
+                for l in iter(p.stderr.readline,''):
+                    stderr.append(l.strip())
+            err_reader = threading.Thread(target=read_stderr)
+            err_reader.daemon = True
+            err_reader.start()
+
+        try:
+            for l in iter(p.stdout.readline,''):
+                stdout.append(l.strip())
+                if verbose: print indent_str+l.strip()
+            p.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if err_reader is not None:
+            err_reader.join()
+        return ProcessResult(
+            args=list(args),
+            returncode=p.returncode,
+            duration=time.time() - t0,
+            stdout=list(stdout),
+            stderr=list(stderr),
+            timed_out=timed_out.is_set()
+        )
+
+    def __init__(self,max_workers=4,timeout=None,max_lines=100):
+        """
+            max_workers: The max number of subprocesses submitted to the pool which run at the same time
+            timeout: Default per-call timeout (in seconds)
+            max_lines: Default number of output lines kept for each call
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_lines = max_lines
+        self.__pool = None
+        self.__lock = threading.Lock()
+
+    def getPool(self):
+        with self.__lock:
+            if self.__pool is None:
+                self.__pool = ThreadPool(self.max_workers)
+            return self.__pool
+
+    def getCallOptions(self,kwargs):
+        """ Fills in the runner defaults for any options not set for a call """
+        ops = dict(kwargs)
+        ops.setdefault('timeout',self.timeout)
+        ops.setdefault('max_lines',self.max_lines)
+        return ops
+
+    def run(self,args,**kwargs):
+        """ Run a subprocess in the calling thread, accepts the same options as execute() """
+        return self.execute(args,**self.getCallOptions(kwargs))
+
+    def submit(self,args,**kwargs):
+        """ Queue a subprocess on the worker pool, returns an AsyncResult whose get() gives the ProcessResult """
+        return self.getPool().apply_async(self.execute,(args,),self.getCallOptions(kwargs))
+
+    def map(self,arg_lists,**kwargs):
+        """ Run many subprocesses on the worker pool, returns their ProcessResults in the same order """
+        pending = [self.submit(args,**kwargs) for args in arg_lists]
+        return [r.get() for r in pending]
+
+    def close(self):
+        """ Wait for all submitted subprocesses and shut down the worker pool """
+        with self.__lock:
+            if self.__pool is not None:
+                self.__pool.close()
+                self.__pool.join()
+                self.__pool = None
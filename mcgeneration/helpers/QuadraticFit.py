@@ -0,0 +1,146 @@
+import numpy as np
+
+# Utilities for the n-D quadratic parametrization of a quantity (e.g. a cross-section) in terms of
+#   the DoFs, i.e. f(x) = c0 + sum_i c_i*x_i + sum_{i<=j} c_ij*x_i*x_j
+class QuadraticFit(object):
+    @classmethod
+    def getNumTerms(cls,N):
+        return 1 + 2*N + N*(N-1)/2
+
+    @classmethod
+    def getTermNames(cls,names):
+        """ Returns the labels for each column of the design matrix """
+        terms = ['sm']
+        terms += [n for n in names]
+        for i in range(len(names)):
+            for j in range(i,len(names)):
+                terms.append("%s*%s" % (names[i],names[j]))
+        return terms
+
+    @classmethod
+    def reorder(cls,coeffs,names,new_names):
+        """ Maps fit coefficients onto the term ordering of new_names, terms which involve unknown DoFs are NaN """
+        lookup = dict(zip(cls.getTermNames(names),coeffs))
+        new_coeffs = []
+        for t in cls.getTermNames(new_names):
+            if not lookup.has_key(t) and '*' in t:
+                # Cross terms are symmetric in the two DoFs
+                t = '*'.join(reversed(t.split('*')))
+            new_coeffs.append(lookup.get(t,np.nan))
+        return np.array(new_coeffs,dtype=np.float64)
+
+    @classmethod
+    def getDesignMatrix(cls,arr):
+        """ Returns the (points x terms) design matrix of the n-D quadratic for an array of points """
+        arr = np.asarray(arr,dtype=np.float64)
+        if arr.ndim == 1:
+            arr = arr.reshape(1,-1)
+        npts,N = arr.shape
+        iu,ju = np.triu_indices(N)
+        cols = [np.ones((npts,1)),arr,arr[:,iu]*arr[:,ju]]
+        return np.hstack(cols)
+
+    @classmethod
+    def normalize(cls,arr,low,high):
+        """
+            Maps points from the box defined by low and high onto [-1,1]^N, DoFs with zero width are
+            left unscaled. Since this is an affine map, it does not change which designs are optimal,
+            but it makes the design matrix much better behaved numerically
+        """
+        low = np.asarray(low,dtype=np.float64)
+        high = np.asarray(high,dtype=np.float64)
+        center = 0.5*(high + low)
+        width = 0.5*(high - low)
+        width[width == 0] = 1.0
+        return (np.asarray(arr,dtype=np.float64) - center) / width
+
+    @classmethod
+    def getConditionNumber(cls,arr):
+        """ Returns the condition number of the design matrix for a set of points """
+        X = cls.getDesignMatrix(arr)
+        if X.shape[0] < X.shape[1]:
+            return np.inf
+        return np.linalg.cond(X)
+
+    @classmethod
+    def fit(cls,arr,y):
+        """ Least squares fit of the quadratic to the values y at each point, returns the fit coefficients """
+        X = cls.getDesignMatrix(arr)
+        coeffs = np.linalg.lstsq(X,np.asarray(y,dtype=np.float64),rcond=None)[0]
+        return coeffs
+
+    @classmethod
+    def predict(cls,arr,coeffs):
+        """ Evaluates the fitted quadratic at each point """
+        return np.dot(cls.getDesignMatrix(arr),coeffs)
+
+    @classmethod
+    def selectDOptimal(cls,candidates,npts,fixed=None,max_passes=3,tol=1e-6):
+        """
+            Select npts rows from the candidate points which (approximately) maximize det(X^T X) of the
+            quadratic design matrix. The design is first built greedily, adding the candidate with the
+            largest prediction variance each step, then improved by Fedorov exchange passes. Returns
+            the indices of the selected candidates.
+                candidates: (candidates x DoFs) array of points to select from
+                npts: The number of points to select
+                fixed: (points x DoFs) array of points which are always part of the design (e.g. the
+                    MG starting point), but aren't selected from the candidates
+        """
+        Xc = cls.getDesignMatrix(candidates)
+        n_cand,n_terms = Xc.shape
+        npts = min(npts,n_cand)
+        if fixed is None or len(fixed) == 0:
+            Xf = np.zeros((0,n_terms))
+        else:
+            Xf = cls.getDesignMatrix(fixed)
+
+        # Small ridge term, so the information matrix is invertible while the design is still incomplete
+        M = np.dot(Xf.T,Xf) + 1e-6*np.eye(n_terms)
+        Minv = np.linalg.inv(M)
+        d = np.sum(np.dot(Xc,Minv)*Xc,axis=1)
+        selected = []
+        available = np.ones(n_cand,dtype=bool)
+        for k in range(npts):
+            j = int(np.argmax(np.where(available,d,-np.inf)))
+            u = np.dot(Minv,Xc[j])
+            denom = 1.0 + np.dot(Xc[j],u)
+            Minv -= np.outer(u,u) / denom
+            d -= np.dot(Xc,u)**2 / denom
+            selected.append(j)
+            available[j] = False
+
+        X = np.vstack([Xf,Xc[selected]])
+        if X.shape[0] < n_terms:
+            # Not enough points to fully determine the quadratic, nothing to exchange
+            return selected
+        Minv = np.linalg.pinv(np.dot(X.T,X))
+        for p in range(max_passes):
+            n_swaps = 0
+            d = np.sum(np.dot(Xc,Minv)*Xc,axis=1)
+            for pos in range(len(selected)):
+                i = selected[pos]
+                if 1.0 - d[i] < 1e-9:
+                    # Removing this point would make the design singular
+                    continue
+                ui = np.dot(Minv,Xc[i])
+                d_ij = np.dot(Xc,ui)
+                # Fedorov delta: det(new)/det(old) = 1 + delta
+                delta = d - d[i]*d + d_ij**2 - d[i]
+                delta[~available] = -np.inf
+                j = int(np.argmax(delta))
+                if delta[j] <= tol:
+                    continue
+                # Remove point i, then add point j (rank-1 updates of the inverse and the variances)
+                Minv += np.outer(ui,ui) / (1.0 - d[i])
+                d += d_ij**2 / (1.0 - d[i])
+                uj = np.dot(Minv,Xc[j])
+                denom = 1.0 + np.dot(Xc[j],uj)
+                Minv -= np.outer(uj,uj) / denom
+                d -= np.dot(Xc,uj)**2 / denom
+                selected[pos] = j
+                available[i] = True
+                available[j] = False
+                n_swaps += 1
+            if n_swaps == 0:
+                break
+        return selected
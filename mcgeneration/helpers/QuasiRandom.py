@@ -0,0 +1,165 @@
+import numpy as np
+
+# Generators for (scrambled) low-discrepancy point sets in the n-D unit hypercube [0,1)^N
+class QuasiRandom(object):
+    SOBOL_BITS = 30     # Number of bits used for the Sobol integer representation
+
+    # Primitive polynomials and initial direction numbers for Sobol dimensions 2-40 (Joe & Kuo, 2008)
+    #   Each entry is (s,a,[m_1,...,m_s]), where s is the degree of the polynomial and a encodes its
+    #   interior coefficients. The first dimension is handled separately (all m_i = 1)
+    SOBOL_DIRECTIONS = [
+        (1, 0,[1]),
+        (2, 1,[1,3]),
+        (3, 1,[1,3,1]),
+        (3, 2,[1,1,1]),
+        (4, 1,[1,1,3,3]),
+        (4, 4,[1,3,5,13]),
+        (5, 2,[1,1,5,5,17]),
+        (5, 4,[1,1,5,5,5]),
+        (5, 7,[1,1,7,11,19]),
+        (5,11,[1,1,5,1,1]),
+        (5,13,[1,1,1,3,11]),
+        (5,14,[1,3,5,5,31]),
+        (6, 1,[1,3,3,9,7,49]),
+        (6,13,[1,1,1,15,21,21]),
+        (6,16,[1,3,1,13,27,49]),
+        (6,19,[1,1,1,15,7,5]),
+        (6,22,[1,3,1,15,13,25]),
+        (6,25,[1,1,5,5,19,61]),
+        (7, 1,[1,3,7,11,23,15,103]),
+        (7, 4,[1,3,7,13,13,15,69]),
+        (7, 7,[1,1,3,13,7,35,63]),
+        (7, 8,[1,3,5,9,1,25,53]),
+        (7,14,[1,3,1,13,9,35,107]),
+        (7,19,[1,3,1,5,27,61,31]),
+        (7,21,[1,1,5,11,19,41,61]),
+        (7,28,[1,3,5,3,3,13,69]),
+        (7,31,[1,1,7,13,1,19,1]),
+        (7,32,[1,3,7,5,13,19,59]),
+        (7,37,[1,1,3,9,25,29,41]),
+        (7,41,[1,3,5,13,23,1,55]),
+        (7,42,[1,3,7,3,13,59,17]),
+        (7,50,[1,3,1,3,5,53,69]),
+        (7,55,[1,1,5,5,23,33,13]),
+        (7,56,[1,1,7,7,1,61,123]),
+        (7,59,[1,1,7,9,13,61,49]),
+        (7,62,[1,3,3,5,3,55,33]),
+        (8,14,[1,3,1,15,31,13,49,245]),
+        (8,21,[1,3,5,15,31,59,63,97]),
+        (8,22,[1,3,1,11,11,11,77,249]),
+    ]
+
+    @classmethod
+    def getMaxSobolDimension(cls):
+        return len(cls.SOBOL_DIRECTIONS) + 1
+
+    @classmethod
+    def getRandomState(cls,seed):
+        """ Returns a numpy random number generator, which is reproducible if a seed is given """
+        if isinstance(seed,np.random.RandomState):
+            return seed
+        return np.random.RandomState(seed)
+
+    @classmethod
+    def getSobolDirections(cls,dim):
+        """ Returns a (dim x SOBOL_BITS) array of the (unscrambled) Sobol direction numbers """
+        if dim > cls.getMaxSobolDimension():
+            s = "Sobol sequences are only available for up to {n} dimensions, requested {dim}".format(
+                n=cls.getMaxSobolDimension(),
+                dim=dim
+            )
+            raise ValueError(s)
+        B = cls.SOBOL_BITS
+        v = np.zeros((dim,B),dtype=np.int64)
+        for j in range(B):
+            v[0,j] = 1 << (B - 1 - j)
+        for d in range(1,dim):
+            s,a,m = cls.SOBOL_DIRECTIONS[d-1]
+            for j in range(B):
+                if j < s:
+                    v[d,j] = m[j] << (B - 1 - j)
+                    continue
+                x = v[d,j-s] ^ (v[d,j-s] >> s)
+                for k in range(1,s):
+                    if (a >> (s - 1 - k)) & 1:
+                        x ^= v[d,j-k]
+                v[d,j] = x
+        return v
+
+    @classmethod
+    def sobol(cls,npts,dim,seed=None,scramble=True):
+        """
+            Generate the first npts points of an N-D Sobol sequence. If scramble is True, a random
+            linear matrix scramble plus digital shift is applied, which keeps the low-discrepancy
+            properties of the sequence while allowing for independent (seeded) realizations
+        """
+        B = cls.SOBOL_BITS
+        v = cls.getSobolDirections(dim)
+        shift = np.zeros(dim,dtype=np.int64)
+        if scramble:
+            rng = cls.getRandomState(seed)
+            bit_vals = np.left_shift(np.int64(1),np.arange(B-1,-1,-1,dtype=np.int64))
+            for d in range(dim):
+                # Random lower triangular binary matrix with a unit diagonal
+                ltm = np.tril(rng.randint(0,2,size=(B,B)),-1) + np.eye(B,dtype=np.int64)
+                bits = (v[d][:,np.newaxis] >> np.arange(B-1,-1,-1,dtype=np.int64)) & 1
+                bits = np.dot(bits,ltm.T) % 2
+                v[d] = np.dot(bits,bit_vals)
+            shift = rng.randint(0,1 << B,size=dim).astype(np.int64)
+        idx = np.arange(npts,dtype=np.int64)
+        gray = idx ^ (idx >> 1)
+        x = np.zeros((npts,dim),dtype=np.int64)
+        for j in range(B):
+            mask = ((gray >> j) & 1).astype(bool)
+            x[mask] ^= v[:,j]
+        x ^= shift
+        return x.astype(np.float64) / float(1 << B)
+
+    @classmethod
+    def getPrimes(cls,n):
+        """ Returns the first n prime numbers """
+        primes = []
+        k = 2
+        while len(primes) < n:
+            if all(k % p for p in primes if p*p <= k):
+                primes.append(k)
+            k += 1
+        return primes
+
+    @classmethod
+    def halton(cls,npts,dim,seed=None,scramble=True):
+        """
+            Generate the first npts points of an N-D Halton sequence, skipping the origin. If scramble
+            is True, the digits in each base are randomly permuted (keeping 0 fixed) which breaks up
+            the correlations between the higher dimensions of the plain Halton sequence
+        """
+        rng = cls.getRandomState(seed)
+        x = np.zeros((npts,dim))
+        for d,base in enumerate(cls.getPrimes(dim)):
+            idx = np.arange(1,npts+1,dtype=np.int64)
+            f = 1.0 / base
+            while np.any(idx > 0):
+                digits = idx % base
+                if scramble:
+                    perm = np.concatenate([[0],1 + rng.permutation(base - 1)])
+                    digits = perm[digits]
+                x[:,d] += f*digits
+                idx //= base
+                f /= base
+        return x
+
+    @classmethod
+    def latinHypercube(cls,npts,dim,seed=None):
+        """ Generate npts points using Latin hypercube sampling, each axis has exactly one point per stratum """
+        rng = cls.getRandomState(seed)
+        x = np.zeros((npts,dim))
+        for d in range(dim):
+            x[:,d] = (rng.permutation(npts) + rng.uniform(size=npts)) / float(npts)
+        return x
+
+    @classmethod
+    def scale(cls,x,low,high):
+        """ Maps points from the unit hypercube onto the box defined by the low and high arrays """
+        low = np.asarray(low,dtype=np.float64)
+        high = np.asarray(high,dtype=np.float64)
+        return low + x*(high - low)
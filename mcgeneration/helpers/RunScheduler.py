@@ -0,0 +1,237 @@
+import os
+import Queue
+import threading
+import time
+
+from Gridpack import Gridpack
+from GridpackRunPool import GridpackRunPool, SeedResult
+from WorkAreaIndex import WorkAreaIndex
+
+# A request to produce events with one gridpack, run once for each of the seeds
+class RunRequest(object):
+    def __init__(self,gridpack,events,seeds,ncpu=1,memory=None,merge=True):
+        """
+            gridpack: A Gridpack or a setup string (e.g. 'ttH_ctGctW_run0')
+            ncpu:     Cores used by each seed (passed on to runcmsgrid.sh)
+            memory:   Memory (in GB) used by each seed, if None uses RunScheduler.DEFAULT_MEMORY
+        """
+        if not isinstance(gridpack,Gridpack):
+            gridpack = self.makeGridpack(gridpack)
+        self.gridpack = gridpack
+        self.events   = events
+        self.seeds    = []
+        for seed in seeds:
+            # Each seed has its own work dir and LHE file, so a repeated seed would collide with itself
+            if seed in self.seeds:
+                print "[WARNING] {setup} has seed {seed} more than once, it will only be run once".format(setup=self.getSetup(),seed=seed)
+                continue
+            self.seeds.append(seed)
+        self.ncpu     = ncpu
+        self.memory   = memory
+        self.merge    = merge
+        self.attempts = {}          # {seed: number of times the seed was run}
+        self.results  = {}          # {seed: SeedResult of the last attempt}
+        self.final    = set()       # Seeds which either succeeded or ran out of retries
+        self.merged_events = None
+        self.merge_error = None     # Set if merging the LHE files of the seeds failed
+        self.__lock = threading.Lock()
+        self.__prepared = False
+
+    @classmethod
+    def makeGridpack(cls,setup,home_dir=None):
+        """ Makes a Gridpack for an already produced tarball from its setup string """
+        arr = WorkAreaIndex.parseName(setup)
+        if arr is None or arr[3] != WorkAreaIndex.SETUP_DIR:
+            raise ValueError("Not a valid setup string: %s" % (setup))
+        p,t,r,atype = arr
+        return Gridpack(home_dir=home_dir,process=p,tag=t,run=r)
+
+    def getSetup(self):
+        return self.gridpack.getSetupString()
+
+    def prepare(self,pool):
+        """ Cleans the output dir and extracts the tarball, only done by the first seed that gets to run """
+        with self.__lock:
+            if not self.__prepared:
+                pool.prepare(self.gridpack)
+                self.__prepared = True
+
+    def isDone(self):
+        return len(self.final) == len(self.seeds)
+
+    def getResults(self):
+        """ Returns the SeedResult of the last attempt of each seed, in the order of the seeds """
+        return [self.results[seed] for seed in self.seeds if self.results.has_key(seed)]
+
+    def isSuccess(self):
+        return self.isDone() and not len(self.getFailedSeeds()) and self.merge_error is None
+
+    def getFailedSeeds(self):
+        return [seed for seed in self.seeds if self.results.has_key(seed) and not self.results[seed].isSuccess()]
+
+# Runs the gridpacks of many RunRequests on the local machine. Every seed is an independent job, which
+#   gets packed onto the free cores and memory of the machine (first-fit, largest jobs first), so seeds
+#   of small gridpacks backfill around the big ones. Progress is printed as each seed finishes and a
+#   failed seed is retried (with the same seed) without rerunning any of the other seeds.
+#   Each seed is run with the same semantics as Gridpack.run(), via the GridpackRunPool work dirs
+class RunScheduler(object):
+    DEFAULT_MEMORY = 2.0    # Memory (in GB) of a seed, if the request doesn't say
+    POLL_TIME = 1.0         # How often (in seconds) the scheduler wakes up while waiting on running seeds
+
+    @classmethod
+    def getMachineMemory(cls):
+        """ Returns the total memory of the machine (in GB) """
+        try:
+            with open('/proc/meminfo','r') as f:
+                for l in f:
+                    if l.startswith('MemTotal:'):
+                        return float(l.split()[1]) / 1024.0**2
+        except IOError:
+            pass
+        return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES') / 1024.0**3
+
+    def __init__(self,max_cores=None,max_memory=None,retries=1,pool=None,progress=None):
+        """
+            max_cores:  Cores which can be used at the same time, defaults to all cores of the machine
+            max_memory: Memory (in GB) which can be used at the same time, defaults to the machine memory
+            retries:    How many times a failed seed is re-run before giving up on it
+            pool:       The GridpackRunPool which extracts the tarballs and makes the work dirs
+            progress:   Optional callable(request,SeedResult), called in the scheduler thread after each attempt
+        """
+        if pool is None:
+            pool = GridpackRunPool(max_cores=max_cores)
+        if max_cores is None:
+            max_cores = pool.budget.total
+        if max_memory is None:
+            max_memory = self.getMachineMemory()
+        self.pool       = pool
+        self.max_cores  = max(1,int(max_cores))
+        self.max_memory = float(max_memory)
+        self.retries    = retries
+        self.progress   = progress
+        self.requests   = []
+        self.used_cores  = 0
+        self.used_memory = 0.0
+
+    def add(self,gridpack,events,seeds,ncpu=1,memory=None,merge=True):
+        """ Adds a request to the schedule, returns the RunRequest """
+        return self.addRequest(RunRequest(gridpack,events,seeds,ncpu=ncpu,memory=memory,merge=merge))
+
+    def addRequest(self,request):
+        if request.memory is None:
+            request.memory = self.DEFAULT_MEMORY
+        if request.ncpu > self.max_cores:
+            print "[WARNING] {setup} asks for {n:d} cores, capping it at {m:d}".format(setup=request.getSetup(),n=request.ncpu,m=self.max_cores)
+            request.ncpu = self.max_cores
+        if request.memory > self.max_memory:
+            print "[WARNING] {setup} asks for {n:.1f} GB, capping it at {m:.1f} GB".format(setup=request.getSetup(),n=request.memory,m=self.max_memory)
+            request.memory = self.max_memory
+        self.requests.append(request)
+        return request
+
+    def fits(self,request):
+        """ Checks if one more seed of the request fits into the free cores and memory """
+        if self.used_cores + request.ncpu > self.max_cores:
+            return False
+        return self.used_memory + request.memory <= self.max_memory + 1e-9
+
+    def runJob(self,request,seed,done):
+        """ Runs one seed of a request, called in its own thread """
+        try:
+            request.prepare(self.pool)
+            res = self.pool.executeSeed(request.gridpack,request.events,seed,request.ncpu)
+        except Exception as e:
+            res = SeedResult(request.getSetup(),seed,error=repr(e))
+        done.put((request,seed,res))
+
+    def getStatusString(self,running):
+        return "running {r:d}, cores {c:d}/{C:d}, memory {m:.1f}/{M:.1f} GB".format(
+            r=running,
+            c=self.used_cores,
+            C=self.max_cores,
+            m=self.used_memory,
+            M=self.max_memory
+        )
+
+    def run(self):
+        """ Runs all of the requests, blocks until every seed either succeeded or ran out of retries """
+        t0 = time.time()
+        # Largest jobs first, so they aren't starved by the small ones which can fill any gap
+        pending = [(req,seed) for req in self.requests for seed in req.seeds]
+        pending.sort(key=lambda x: (-x[0].ncpu,-x[0].memory))
+        total = len(pending)
+        finished = 0
+        running = 0
+        core_time = 0.0
+        done = Queue.Queue()
+        print "Scheduling {n:d} seeds of {k:d} gridpacks on {c:d} cores and {m:.1f} GB".format(
+            n=total,
+            k=len(self.requests),
+            c=self.max_cores,
+            m=self.max_memory
+        )
+        while len(pending) or running:
+            for job in list(pending):
+                req,seed = job
+                if not self.fits(req):
+                    continue
+                pending.remove(job)
+                self.used_cores  += req.ncpu
+                self.used_memory += req.memory
+                running += 1
+                req.attempts[seed] = req.attempts.get(seed,0) + 1
+                t = threading.Thread(target=self.runJob,args=(req,seed,done))
+                t.daemon = True
+                t.start()
+            try:
+                req,seed,res = done.get(True,self.POLL_TIME)
+            except Queue.Empty:
+                continue
+            self.used_cores  -= req.ncpu
+            self.used_memory -= req.memory
+            running -= 1
+            core_time += req.ncpu*res.duration
+            req.results[seed] = res
+            if res.isSuccess() or req.attempts[seed] > self.retries:
+                req.final.add(seed)
+                finished += 1
+                print "[{i:d}/{n:d}] {res} | {status}".format(i=finished,n=total,res=res,status=self.getStatusString(running))
+            else:
+                print "[RETRY {a:d}/{r:d}] {res} | {status}".format(
+                    a=req.attempts[seed],
+                    r=self.retries,
+                    res=res,
+                    status=self.getStatusString(running)
+                )
+                # Keep the largest-first order for the retried seed
+                idx = 0
+                while idx < len(pending) and (-pending[idx][0].ncpu,-pending[idx][0].memory) <= (-req.ncpu,-req.memory):
+                    idx += 1
+                pending.insert(idx,(req,seed))
+            if self.progress is not None:
+                self.progress(req,res)
+            if req.isDone() and req.merge:
+                try:
+                    req.merged_events = self.pool.merge(req.gridpack,req.getResults())
+                except Exception as e:
+                    # Only this request failed, keep going with the rest of the queue
+                    req.merge_error = repr(e)
+                    print "[ERROR] Failed to merge the LHE files of {setup}: {err}".format(setup=req.getSetup(),err=req.merge_error)
+        wall = time.time() - t0
+        self.printSummary(wall,core_time)
+        return self.requests
+
+    def printSummary(self,wall,core_time):
+        print "Summary:"
+        for req in self.requests:
+            failed = req.getFailedSeeds()
+            s = "\t{setup}: {k:d}/{n:d} seeds".format(setup=req.getSetup(),k=len(req.seeds)-len(failed),n=len(req.seeds))
+            if req.merged_events is not None:
+                s += ", {n:d} events merged".format(n=req.merged_events)
+            if len(failed):
+                s += ", failed seeds: {seeds}".format(seeds=failed)
+            if req.merge_error is not None:
+                s += ", merge failed: {err}".format(err=req.merge_error)
+            print s
+        usage = core_time / (self.max_cores*wall) if wall > 0 else 0.0
+        print "Finished in {t:.1f}s, core usage: {u:.1%}".format(t=wall,u=usage)
@@ -0,0 +1,142 @@
+import numpy as np
+
+from PointIndex import PointIndex
+
+# Container for a set of W.C. phase space points, stored as a (points x DoFs) array together with
+#   the ordered list of DoF names which label the columns of the array
+class ScanPoints(object):
+    PRECISION = 6   # Number of decimal places the points get rounded to
+
+    @classmethod
+    def fromDicts(cls,names,pts):
+        """
+            Construct a point set from a list of dictionaries, any DoF missing from a point is set
+            to its SM value
+                names: The ordered list of DoF names to use for the columns
+                pts: List of points of the form [{c1: 1.0, c2: 1.0, ...}]
+        """
+        obj = cls(names)
+        if len(pts) == 0:
+            return obj
+        arr = np.zeros((len(pts),len(obj.names)))
+        for idx,pt in enumerate(pts):
+            arr[idx] = obj.toArray(pt)
+        obj.pts = arr
+        return obj
+
+    def __init__(self,names,pts=None):
+        """
+            names: The ordered list of DoF names, one for each column of the point array
+            pts: An array-like object of shape (points x DoFs), if None the point set is empty
+        """
+        self.names = list(names)
+        self.index = dict((n,idx) for idx,n in enumerate(self.names))
+        if pts is None:
+            pts = []
+        if len(self.names) == 0:
+            # Without any DoFs there can't be any points (and reshape can't infer the number of rows)
+            self.pts = np.empty((0,0),dtype=np.float64)
+        else:
+            self.pts = np.array(pts,dtype=np.float64).reshape(-1,len(self.names))
+
+    def __len__(self):
+        return self.pts.shape[0]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.getPoint(idx)
+
+    def __getitem__(self,idx):
+        return self.getPoint(idx)
+
+    def getNames(self):
+        return self.names
+
+    def getArray(self):
+        return self.pts
+
+    def getColumn(self,name):
+        return self.pts[:,self.index[name]]
+
+    def getPoint(self,idx):
+        """ Returns a dict-style view of a single point """
+        return dict(zip(self.names,self.pts[idx].tolist()))
+
+    def toDicts(self):
+        return [pt for pt in self]
+
+    def toArray(self,pt):
+        """ Converts a point dictionary into a row using the ordering of this point set """
+        row = np.zeros(len(self.names))
+        for k,v in pt.iteritems():
+            if self.index.has_key(k):
+                row[self.index[k]] = v
+        return row
+
+    def round(self,decimals=None):
+        """ Rounds all points in place (default: to the same precision as the reweight card) """
+        if decimals is None:
+            decimals = self.PRECISION
+        self.pts = np.round(self.pts,decimals)
+        return self
+
+    def match(self,pt):
+        """ Returns a boolean mask of which points are identical to the specified point """
+        if isinstance(pt,dict):
+            pt = self.toArray(pt)
+        return np.all(self.pts == np.asarray(pt,dtype=np.float64),axis=1)
+
+    def hasPoint(self,pt):
+        return bool(np.any(self.match(pt)))
+
+    def removePoint(self,pt):
+        """ Removes all occurrences of the specified point and returns the number of removed points """
+        mask = self.match(pt)
+        self.pts = self.pts[~mask]
+        return int(np.sum(mask))
+
+    def getKeys(self):
+        """ Returns the canonical PointIndex key for each point """
+        return PointIndex.getKeys(self.names,self.pts)
+
+    def dedupe(self,index=None,owner=None,exclude=[],keep=[]):
+        """
+            Removes repeated points, keeping the first occurrence, and returns the number of removed points
+                index: A PointIndex shared between multiple point sets (e.g. all runs of a campaign), any
+                    point already registered there by a different owner is also removed. The remaining
+                    points get registered to the index under the specified owner
+                exclude: List of point keys which should always be removed (e.g. the MG starting point)
+                keep: List of point keys which are never removed because of the shared index (e.g. the SM point)
+        """
+        seen = set(exclude)
+        rows = []
+        keys = self.getKeys()
+        for idx,k in enumerate(keys):
+            if k in seen:
+                continue
+            if index is not None and not k in keep and index.isDuplicate(k,owner):
+                continue
+            seen.add(k)
+            rows.append(idx)
+        if index is not None:
+            for idx in rows:
+                index.add(keys[idx],owner)
+        n_removed = len(self) - len(rows)
+        self.pts = self.pts[rows]
+        return n_removed
+
+    def append(self,pt):
+        """ Adds a single point (either a dict or an array-like row) to the end of the point set """
+        if isinstance(pt,dict):
+            pt = self.toArray(pt)
+        self.pts = np.vstack([self.pts,np.asarray(pt,dtype=np.float64).reshape(1,-1)])
+
+    def extend(self,other):
+        """ Adds all points from another point set, matching up the columns by DoF name """
+        if isinstance(other,ScanPoints):
+            if other.names != self.names:
+                other = ScanPoints.fromDicts(self.names,other.toDicts())
+            arr = other.getArray()
+        else:
+            arr = np.asarray(other,dtype=np.float64).reshape(-1,len(self.names))
+        self.pts = np.vstack([self.pts,arr])
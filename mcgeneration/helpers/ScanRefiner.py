@@ -0,0 +1,194 @@
+import gzip
+import re
+
+import numpy as np
+
+from ScanPoints import ScanPoints
+from PointIndex import PointIndex
+from QuasiRandom import QuasiRandom
+from QuadraticFit import QuadraticFit
+from helper_tools import save_scan_points
+
+# Adaptive refinement of the rwgt points of a gridpack. The per-point cross-sections of a pilot gridrun
+#   are fit with the n-D quadratic, then new rwgt points are proposed where the parametrization is least
+#   constrained: where the predicted variance of the fit is large, or close to points with large
+#   leave-one-out (LOO) residuals. The proposed points can be saved to a scanfile for 'from_file' scans.
+class ScanRefiner(object):
+    RWGT_PREFIX = 'EFTrwgt'
+    WGT_RGX = re.compile(r"<wgt id=['\"](%s\d+_[^'\"]*)['\"]\s*>\s*(\S+)\s*</wgt>" % (RWGT_PREFIX))
+
+    @classmethod
+    def parseWeightId(cls,wid):
+        """ Returns the point dictionary encoded in a rwgt name, e.g. 'EFTrwgt3_ctW_1.2_ctZ_-0.5' """
+        arr = wid.split('_')[1:]
+        pt = {}
+        for k,v in zip(arr[0::2],arr[1::2]):
+            pt[k] = float(v)
+        return pt
+
+    @classmethod
+    def readLHEWeights(cls,fpath):
+        """
+            Sums the event weights of each rwgt point (and the nominal weight) in a (gzipped) LHE file.
+            Returns a tuple of ({rwgt name: sum of weights},sum of nominal weights,number of events)
+        """
+        sums = {}
+        nominal = 0.0
+        n_events = 0
+        in_header = False
+        f = gzip.open(fpath,'rb') if fpath.endswith('.gz') else open(fpath,'r')
+        try:
+            for l in f:
+                if '<event' in l:
+                    n_events += 1
+                    in_header = True
+                    continue
+                if in_header:
+                    # The first line of each event block is the event header, which has the weight as the 3rd field
+                    if l.strip():
+                        nominal += float(l.split()[2])
+                        in_header = False
+                    continue
+                m = cls.WGT_RGX.search(l)
+                if m:
+                    wid = m.group(1)
+                    sums[wid] = sums.get(wid,0.0) + float(m.group(2))
+        finally:
+            f.close()
+        return sums,nominal,n_events
+
+    def __init__(self,dofs):
+        """
+            dofs: Dictionary of DegreeOfFreedom objects with their limits set, the limits define the box
+                new points are proposed in
+        """
+        self.dofs = dofs
+        self.names = dofs.keys()
+        self.low  = np.array([dofs[c].getLow()  for c in self.names],dtype=np.float64)
+        self.high = np.array([dofs[c].getHigh() for c in self.names],dtype=np.float64)
+        self.pts  = ScanPoints(self.names)
+        self.xsec = np.zeros(0)
+        self.coeffs = None
+
+    def addPoints(self,pts,xsec):
+        """ Add points (a ScanPoints object or list of dicts) with their measured cross-sections to the fit """
+        if not isinstance(pts,ScanPoints):
+            pts = ScanPoints.fromDicts(self.names,pts)
+        self.pts.extend(pts)
+        self.xsec = np.concatenate([self.xsec,np.asarray(xsec,dtype=np.float64)])
+        self.coeffs = None
+
+    def load(self,lhe_file,start_pt=None):
+        """
+            Read the per-point cross-sections from the LHE file of a pilot gridrun. If the MG starting
+            point is given, the nominal event weights are used as an additional point for the fit
+        """
+        sums,nominal,n_events = self.readLHEWeights(lhe_file)
+        if n_events == 0:
+            raise RuntimeError("No events found in LHE file: %s" % (lhe_file))
+        pts = []
+        xsec = []
+        for wid,s in sums.iteritems():
+            pts.append(self.parseWeightId(wid))
+            xsec.append(s / n_events)
+        if start_pt is not None:
+            pts.append(start_pt)
+            xsec.append(nominal / n_events)
+        self.addPoints(pts,xsec)
+        return len(pts)
+
+    def normalize(self,arr):
+        return QuadraticFit.normalize(arr,self.low,self.high)
+
+    def fit(self):
+        """ Fit the quadratic to all loaded points and compute the LOO residuals and residual variance """
+        x = self.normalize(self.pts.getArray())
+        X = QuadraticFit.getDesignMatrix(x)
+        n,p = X.shape
+        self.coeffs = QuadraticFit.fit(x,self.xsec)
+        XtX = np.dot(X.T,X)
+        resid = self.xsec - np.dot(X,self.coeffs)
+        h = np.sum(np.dot(X,np.linalg.pinv(XtX))*X,axis=1)
+        # Small ridge term, so directions which aren't constrained by any point get a large variance
+        self.Minv = np.linalg.inv(XtX + 1e-6*np.eye(p))
+        # Points with a leverage of 1 are interpolated exactly, so have no usable LOO residual
+        denom = 1.0 - h
+        self.loo = np.where(denom > 1e-9,resid/np.where(denom > 1e-9,denom,1.0),0.0)
+        if n > p:
+            self.s2 = np.sum(resid**2) / (n - p)
+        else:
+            # Underconstrained fit, so use the spread of the measured values as a conservative estimate
+            self.s2 = np.var(self.xsec)
+        return self.coeffs
+
+    def predict(self,arr):
+        return QuadraticFit.predict(self.normalize(arr),self.coeffs)
+
+    def getLOOResiduals(self):
+        return self.loo
+
+    def getPredictionVariance(self,arr):
+        """ Returns the variance of the fit prediction at each of the points """
+        X = QuadraticFit.getDesignMatrix(self.normalize(arr))
+        return self.s2*np.sum(np.dot(X,self.Minv)*X,axis=1)
+
+    def propose(self,npts,n_pool=None,seed=None,bandwidth=0.25,verbose=True):
+        """
+            Greedily select npts new points from a Sobol pool over the DoF box. Each step picks the
+            candidate with the largest score = (predicted variance) + (kernel weighted average of the
+            squared LOO residuals of nearby fit points), then updates the fit information with the
+            selected point and damps the residual term around it, so the points spread out.
+                bandwidth: Width of the residual kernel, relative to the diagonal of the normalized box
+        """
+        if self.coeffs is None:
+            self.fit()
+        N = len(self.names)
+        if n_pool is None:
+            n_pool = max(10*npts,1000)
+        pool = np.round(QuasiRandom.scale(QuasiRandom.sobol(n_pool,N,seed=seed),self.low,self.high),ScanPoints.PRECISION)
+        x_pool = self.normalize(pool)
+        x_data = self.normalize(self.pts.getArray())
+        width2 = 2.0*(bandwidth**2)*4.0*N   # The normalized box has a squared diagonal of 4*N
+
+        # Kernel weighted LOO residuals, shifted by the nearest distance to avoid underflow far from the data
+        dist2 = np.sum(x_pool**2,axis=1)[:,np.newaxis] + np.sum(x_data**2,axis=1)[np.newaxis,:] - 2.0*np.dot(x_pool,x_data.T)
+        K = np.exp(-(dist2 - np.min(dist2,axis=1)[:,np.newaxis]) / width2)
+        resid_term = np.dot(K,self.loo**2) / np.sum(K,axis=1)
+
+        Xc = QuadraticFit.getDesignMatrix(x_pool)
+        Minv = self.Minv.copy()
+        d = np.sum(np.dot(Xc,Minv)*Xc,axis=1)
+        available = np.ones(n_pool,dtype=bool)
+        # Never propose points which are already part of the fit
+        existing = set(self.pts.getKeys())
+        for idx,k in enumerate(PointIndex.getKeys(self.names,pool)):
+            if k in existing: available[idx] = False
+        selected = []
+        for k in range(min(npts,np.sum(available))):
+            score = self.s2*d + resid_term
+            j = int(np.argmax(np.where(available,score,-np.inf)))
+            u = np.dot(Minv,Xc[j])
+            denom = 1.0 + np.dot(Xc[j],u)
+            Minv -= np.outer(u,u) / denom
+            d = np.maximum(d - np.dot(Xc,u)**2 / denom,0.0)
+            resid_term *= 1.0 - np.exp(-np.sum((x_pool - x_pool[j])**2,axis=1) / width2)
+            selected.append(j)
+            available[j] = False
+
+        pts = ScanPoints(self.names,pool[selected])
+        pts.dedupe()
+        if not PointIndex.SM_KEY in set(pts.getKeys()):
+            # Keep the SM point in every gridpack, same as the generated scan types
+            pts.append(np.zeros(N))
+        if verbose:
+            print "Refined scan: {n:d} fit points, max |LOO residual| = {r:.3g}, proposed {m:d} points".format(
+                n=len(self.pts),
+                r=np.max(np.abs(self.loo)) if len(self.loo) else 0.0,
+                m=len(pts)
+            )
+        return pts
+
+    def saveScanfile(self,fpath,pts,start_pt):
+        """ Save proposed points to a scanfile, which uses start_pt as the MG starting point """
+        save_scan_points(fpath,self.dofs,pts,start_pt=start_pt)
+        return fpath
@@ -1,18 +1,89 @@
-import random
+import itertools
 
-from helper_tools import linspace, check_point
+import numpy as np
+
+from helper_tools import linspace
+from ScanPoints import ScanPoints
+from PointIndex import PointIndex
+from QuasiRandom import QuasiRandom
+from QuadraticFit import QuadraticFit
 
 class ScanType(object):
     FRANDOM   = 'full_random'
     SRANDOM   = 'axis_random'
     FLINSPACE = 'full_linspace'
     SLINSPACE = 'axis_linspace'
+    FSOBOL    = 'full_sobol'
+    FHALTON   = 'full_halton'
+    FLATIN    = 'full_latin_hypercube'
+    FDOPTIMAL = 'full_d_optimal'
+    PLINSPACE = 'plane_linspace'
     FROMFILE  = 'from_file'
     NONE      = 'none'
 
     @classmethod
     def getTypes(cls):
-        return [cls.FRANDOM,cls.SRANDOM,cls.FLINSPACE,cls.SLINSPACE,cls.FROMFILE,cls.NONE]
+        return [cls.FRANDOM,cls.SRANDOM,cls.FLINSPACE,cls.SLINSPACE,cls.FSOBOL,cls.FHALTON,cls.FLATIN,cls.FDOPTIMAL,cls.PLINSPACE,cls.FROMFILE,cls.NONE]
+
+    @classmethod
+    def getLowDiscrepancyTypes(cls):
+        return [cls.FSOBOL,cls.FHALTON,cls.FLATIN]
+
+    @classmethod
+    def getFullScanTypes(cls):
+        """ The scan types which sample the full n-D space with a fixed number of points """
+        return [cls.FRANDOM] + cls.getLowDiscrepancyTypes() + [cls.FDOPTIMAL]
+
+    @classmethod
+    def getNDimTypes(cls):
+        """ The scan types which include points with cross terms """
+        return cls.getFullScanTypes() + [cls.PLINSPACE]
+
+    @classmethod
+    def getNumQuadraticTerms(cls,N):
+        """ Number of coefficients needed to describe an n-D quadratic in N DoFs """
+        return QuadraticFit.getNumTerms(N)
+
+    @classmethod
+    def getMinNumPoints(cls,stype,N,num_pts):
+        """ Raises the requested number of points so there are enough to reconstruct the parametrization """
+        if num_pts <= 0:
+            return num_pts
+        if stype == cls.FRANDOM:
+            num_pts = max(num_pts,1.2*cls.getNumQuadraticTerms(N))
+        elif stype in cls.getLowDiscrepancyTypes():
+            # The even coverage means no safety margin is needed on top of the number of fit terms
+            num_pts = max(num_pts,cls.getNumQuadraticTerms(N))
+        elif stype == cls.FDOPTIMAL:
+            # The MG starting point (and SM point) are also part of the fit
+            num_pts = max(num_pts,cls.getNumQuadraticTerms(N) - 1)
+        elif stype in [cls.SLINSPACE,cls.PLINSPACE]:
+            # Need at least 3 points along each axis (and in each plane) for the quadratic terms
+            num_pts = max(num_pts,3)
+        return int(num_pts)
+
+    @classmethod
+    def countPoints(cls,stype,N,num_pts,n_pairs=None):
+        """
+            Estimate the number of reweight points getPoints() will produce for N DoFs, without
+            generating them. Includes the SM point, but not the (removed) MG starting point, so the
+            actual number can be slightly lower if some of the generated points coincide
+                n_pairs: Number of DoF pairs scanned by the 'plane_linspace' type, if None all pairs
+        """
+        num_pts = cls.getMinNumPoints(stype,N,num_pts)
+        if num_pts <= 0 or N == 0:
+            return 0
+        if stype == cls.FLINSPACE:
+            return num_pts**N
+        elif stype in cls.getFullScanTypes():
+            return num_pts + 1
+        elif stype in [cls.SLINSPACE,cls.SRANDOM]:
+            return N*num_pts + 1
+        elif stype == cls.PLINSPACE:
+            if n_pairs is None:
+                n_pairs = N*(N-1)/2
+            return (N + 2*n_pairs)*num_pts + 1
+        return 0
 
     @classmethod
     def isValid(cls,stype):
@@ -21,7 +92,7 @@ class ScanType(object):
         return stype in cls.getTypes() #TODO: Won't be needed once Gridpack class is implemented
 
     @classmethod
-    def getPoints(cls,dofs,num_pts,stype):
+    def getPoints(cls,dofs,num_pts,stype,seed=None,pairs=None):
         pts = []
         if stype == cls.FLINSPACE:
             # Full scan of phase space using a linear grid spacing
@@ -34,43 +105,89 @@ class ScanType(object):
             pts = cls.axisScanLinear(dofs,num_pts)
         elif stype == cls.SRANDOM:
             # Axis scan (no xterms) with random sampling along the axis
-            cls.axisScanRandom(dofs,num_pts)
+            pts = cls.axisScanRandom(dofs,num_pts)
+        elif stype in cls.getLowDiscrepancyTypes():
+            # Full scan of phase space using a (scrambled) low-discrepancy sequence
+            pts = cls.fullScanQuasiRandom(dofs,num_pts,stype,seed)
+        elif stype == cls.PLINSPACE:
+            # Axis scan plus scans of the 2-D planes for all (or only the specified) pairs of DoFs
+            pts = cls.planeScanLinear(dofs,num_pts,pairs)
+        elif stype == cls.FDOPTIMAL:
+            # Full scan of phase space using the points best suited for fitting the n-D quadratic
+            pts = cls.fullScanDOptimal(dofs,num_pts,seed)
         elif stype == cls.FROMFILE or stype == cls.NONE:
             pts = []
         return pts
 
+    @classmethod
+    def getLimitArrays(cls,dofs,coeffs):
+        """ Returns the start, low and high values of the DoFs as arrays, ordered according to coeffs """
+        start = np.array([dofs[c].getStart() for c in coeffs],dtype=np.float64)
+        low   = np.array([dofs[c].getLow()   for c in coeffs],dtype=np.float64)
+        high  = np.array([dofs[c].getHigh()  for c in coeffs],dtype=np.float64)
+        return start,low,high
+
+    @classmethod
+    def buildPoints(cls,dofs,coeffs,arr):
+        """
+            Converts a (points x DoFs) array of generated points into the final set of reweight
+            points. The points get rounded, repeated points and any occurrence of the MadGraph
+            starting point are removed and the SM point is appended (if it isn't already part of the scan)
+        """
+        pts = ScanPoints(coeffs,arr).round()
+        start_key = PointIndex.getKey(dict((c,dofs[c].getStart()) for c in coeffs))
+        has_sm_pt = start_key == PointIndex.SM_KEY or PointIndex.SM_KEY in set(pts.getKeys())
+        pts.dedupe(exclude=[start_key])
+        if not has_sm_pt:
+            pts.append(np.zeros(len(coeffs)))
+        return pts
+
     @classmethod
     def fullScanLinear(cls,dofs,npts):
         """ Generate a list of n-D points for all DoFs using a grid scan. Will generate npts^N total
             reweight points. This list of points is suitable for fitting an n-D quadratic.
         """
-        pts_arr = []
-        if npts == 0:
-            return pts_arr
-        sm_pt = {}
-        start_pt = {}
+        # Stack all of the chunks at once, instead of growing the point array chunk by chunk
+        chunks = [chunk.getArray() for chunk in cls.iterFullScanLinear(dofs,npts)]
+        if not len(chunks):
+            return ScanPoints(dofs.keys())
+        return ScanPoints(dofs.keys(),np.vstack(chunks))
+
+    @classmethod
+    def iterFullScanLinear(cls,dofs,npts,chunk_size=100000):
+        """ Lazily generate the same points as fullScanLinear(), but yields them in chunks of at most
+            chunk_size points (or npts, whichever is larger). Only a single chunk is ever held in
+            memory, so the size of the grid is not limited by the available memory.
+        """
         coeffs = dofs.keys()
-        arr = []
-        for c in coeffs:
-            sm_pt[c] = 0.0
-            start_pt[c] = dofs[c].getStart()
-            arr += [linspace(dofs[c].getLow(),dofs[c].getHigh(),npts)]
-        has_sm_pt = check_point(sm_pt,start_pt)
-        mesh_pts = [a for a in itertools.product(*arr)]
-        for rwgt_pt in mesh_pts:
-            pt = {}
-            for idx,c in enumerate(coeffs):
-                pt[c] = round(rwgt_pt[idx],6)
-            if check_point(pt,sm_pt):
-                # Skip SM point
-                has_sm_pt = True
-            if check_point(pt,start_pt):
-                # Skip starting point
-                continue
-            pts_arr.append(pt)
+        if npts == 0 or len(coeffs) == 0:
+            return
+        arr = [np.array(linspace(dofs[c].getLow(),dofs[c].getHigh(),npts)) for c in coeffs]
+        start = np.array([dofs[c].getStart() for c in coeffs],dtype=np.float64)
+        sm = np.zeros(len(coeffs))
+        has_sm_pt = bool(np.all(start == sm))
+
+        # The trailing DoFs are generated as a single vectorized block, while the leading DoFs get
+        #   iterated over. Both use the same ordering as itertools.product would.
+        n_inner,block_size = 1,npts
+        while n_inner < len(coeffs) and block_size*npts <= chunk_size:
+            n_inner += 1
+            block_size *= npts
+        n_outer = len(coeffs) - n_inner
+        mesh = np.meshgrid(*arr[n_outer:],indexing='ij')
+        inner_pts = np.stack([m.ravel() for m in mesh],axis=1)
+
+        for outer_pt in itertools.product(*arr[:n_outer]):
+            chunk = np.empty((block_size,len(coeffs)))
+            chunk[:,:n_outer] = outer_pt
+            chunk[:,n_outer:] = inner_pts
+            pts = ScanPoints(coeffs,chunk).round()
+            if not has_sm_pt:
+                has_sm_pt = pts.hasPoint(sm)
+            pts.removePoint(start)
+            yield pts
         if not has_sm_pt:
-            pts_arr.append(sm_pt)
-        return pts_arr
+            yield ScanPoints(coeffs,[sm])
 
     @classmethod
     def fullScanRandom(cls,dofs,npts):
@@ -78,28 +195,70 @@ class ScanType(object):
             Will generate exactly npts reweight points. This list of points is suitable for fitting
             an n-D quadratic
         """
-        pts_arr = []
+        coeffs = dofs.keys()
         if npts == 0:
-            return pts_arr
-        sm_pt = {}
-        start_pt = {}
+            return ScanPoints(coeffs)
+        start,low,high = cls.getLimitArrays(dofs,coeffs)
+        rand_pts = np.random.uniform(low,high,size=(npts,len(coeffs)))
+        return cls.buildPoints(dofs,coeffs,rand_pts)
+
+    @classmethod
+    def fullScanQuasiRandom(cls,dofs,npts,stype,seed=None):
+        """ Generate a list of n-D points for all DoFs using a scrambled Sobol or Halton sequence or
+            Latin hypercube sampling. Will generate exactly npts reweight points, which cover the n-D
+            space more evenly than uniform random sampling, so fewer points are needed for a
+            well-conditioned n-D quadratic fit. The same seed will always produce the same points.
+        """
         coeffs = dofs.keys()
-        for c in coeffs:
-            sm_pt[c] = 0.0
-            start_pt[c] = dofs[c].getStart()
-        has_sm_pt = check_point(sm_pt,start_pt)
-        for idx in range(npts):
-            pt = {}
-            for c in coeffs:
-                pt[c] = round(random.uniform(dofs[c].getLow(),dofs[c].getHigh()),6)
-            if check_point(pt,sm_pt):
-                has_sm_pt = True
-            if check_point(pt,start_pt):
-                continue
-            pts_arr.append(pt)
-        if not has_sm_pt:
-            pts_arr.append(sm_pt)
-        return pts_arr
+        if npts == 0:
+            return ScanPoints(coeffs)
+        start,low,high = cls.getLimitArrays(dofs,coeffs)
+        if stype == cls.FSOBOL:
+            unit_pts = QuasiRandom.sobol(npts,len(coeffs),seed=seed)
+        elif stype == cls.FHALTON:
+            unit_pts = QuasiRandom.halton(npts,len(coeffs),seed=seed)
+        elif stype == cls.FLATIN:
+            unit_pts = QuasiRandom.latinHypercube(npts,len(coeffs),seed=seed)
+        else:
+            raise ValueError("%s is not a low-discrepancy scan type!" % (stype))
+        return cls.buildPoints(dofs,coeffs,QuasiRandom.scale(unit_pts,low,high))
+
+    @classmethod
+    def fullScanDOptimal(cls,dofs,npts,seed=None,pool_factor=10,verbose=True):
+        """ Generate a list of n-D points for all DoFs by selecting npts points from a pool of candidates
+            which maximize det(X^T X) of the n-D quadratic design matrix X. The MG starting point and SM
+            point are always part of the fit, so are included in the design from the start. The pool is
+            made from a Sobol sequence, plus random points on the 3-level grid of each DoF's low, center
+            and high values (where D-optimal quadratic designs tend to be supported).
+        """
+        coeffs = dofs.keys()
+        if npts == 0:
+            return ScanPoints(coeffs)
+        rng = QuasiRandom.getRandomState(seed)
+        start,low,high = cls.getLimitArrays(dofs,coeffs)
+        N = len(coeffs)
+        n_pool = max(pool_factor*npts,1000)
+        unit_pool = np.vstack([
+            QuasiRandom.sobol(n_pool/2,N,seed=rng),
+            0.5*rng.randint(0,3,size=(n_pool - n_pool/2,N)),
+        ])
+        pool = np.round(QuasiRandom.scale(unit_pool,low,high),ScanPoints.PRECISION)
+
+        fixed = [start]
+        if not np.all(start == 0):
+            fixed.append(np.zeros(N))
+        norm_pool  = QuadraticFit.normalize(pool,low,high)
+        norm_fixed = QuadraticFit.normalize(fixed,low,high)
+        selected = QuadraticFit.selectDOptimal(norm_pool,npts,fixed=norm_fixed)
+        pts = cls.buildPoints(dofs,coeffs,pool[selected])
+        if verbose:
+            design = QuadraticFit.normalize(np.vstack([[start],pts.getArray()]),low,high)
+            print "D-optimal design: {n:d} points, {t:d} fit terms, cond(X) = {c:.3g}".format(
+                n=len(pts),
+                t=QuadraticFit.getNumTerms(N),
+                c=QuadraticFit.getConditionNumber(design)
+            )
+        return pts
 
     @classmethod
     def axisScanLinear(cls,dofs,npts):
@@ -107,33 +266,62 @@ class ScanType(object):
             This list of point is only suitable for fitting 1-D quadratics as it will not include
             any points involving cross terms.
         """
-        pts_arr = []
+        coeffs = dofs.keys()
         if npts == 0:
-            return pts_arr
-        sm_pt = {}
-        start_pt = {}
+            return ScanPoints(coeffs)
+        axis_pts = np.zeros((len(coeffs)*npts,len(coeffs)))
+        for idx,c in enumerate(coeffs):
+            axis_pts[idx*npts:(idx+1)*npts,idx] = linspace(dofs[c].getLow(),dofs[c].getHigh(),npts)
+        return cls.buildPoints(dofs,coeffs,axis_pts)
+
+    @classmethod
+    def getPairs(cls,coeffs,pairs=None):
+        """ Returns the list of DoF index pairs to scan, pairs which involve unknown DoFs are dropped """
+        if pairs is None:
+            return [(i,j) for i in range(len(coeffs)) for j in range(i+1,len(coeffs))]
+        idx_pairs = []
+        for c1,c2 in pairs:
+            if not c1 in coeffs or not c2 in coeffs or c1 == c2:
+                continue
+            i,j = sorted([coeffs.index(c1),coeffs.index(c2)])
+            if not (i,j) in idx_pairs:
+                idx_pairs.append((i,j))
+        return idx_pairs
+
+    @classmethod
+    def planeScanLinear(cls,dofs,npts,pairs=None):
+        """ Generate the 1-D points of axisScanLinear(), plus the points on both the diagonal and the
+            anti-diagonal of the npts x npts grid in the 2-D plane of each pair of DoFs. Will generate at
+            most (N + 2*N_pairs)*npts reweight points. Together the points are suitable for fitting an
+            n-D quadratic which only has cross terms for the scanned planes.
+                pairs: List of DoF name pairs [(c1,c2),...] to scan, if None all pairs are scanned
+        """
         coeffs = dofs.keys()
-        for c in coeffs:
-            sm_pt[c] = 0.0
-            start_pt[c] = dofs[c].getStart()
-        has_sm_pt = check_point(sm_pt,start_pt)
-        for c1 in coeffs:
-            arr = linspace(dofs[c1].getLow(),dofs[c1].getHigh(),npts)
-            for v in arr:
-                pt = {}
-                for c2 in coeffs:
-                    if c1 == c2:
-                        pt[c2] = round(v,6)
-                    else:
-                        pt[c2] = 0.0
-                if check_point(pt,sm_pt):
-                    has_sm_pt = True
-                if check_point(pt,start_pt):
-                    continue
-                pts_arr.append(pt)
-        if not has_sm_pt:
-            pts_arr.append(sm_pt)
-        return pts_arr
+        if npts == 0:
+            return ScanPoints(coeffs)
+        arr = [np.array(linspace(dofs[c].getLow(),dofs[c].getHigh(),npts)) for c in coeffs]
+        axis_pts = np.zeros((len(coeffs)*npts,len(coeffs)))
+        for idx in range(len(coeffs)):
+            axis_pts[idx*npts:(idx+1)*npts,idx] = arr[idx]
+
+        # Use both the diagonal and the anti-diagonal of the plane's grid, so that the cross term isn't
+        #   degenerate with the 1-D terms (the centre of the grid is on both, so it is only used once).
+        #   Points with either DoF at its SM value are dropped, since they carry no information on the
+        #   cross term
+        diag = np.arange(npts)
+        anti = diag[::-1]
+        idx_i = np.concatenate([diag,diag[anti != diag]])
+        idx_j = np.concatenate([diag,anti[anti != diag]])
+        plane_pts = []
+        for i,j in cls.getPairs(coeffs,pairs):
+            vals_i = arr[i][idx_i]
+            vals_j = arr[j][idx_j]
+            keep = (vals_i != 0) & (vals_j != 0)
+            plane = np.zeros((np.sum(keep),len(coeffs)))
+            plane[:,i] = vals_i[keep]
+            plane[:,j] = vals_j[keep]
+            plane_pts.append(plane)
+        return cls.buildPoints(dofs,coeffs,np.vstack([axis_pts] + plane_pts))
 
     @classmethod
     def axisScanRandom(cls,dofs,npts):
@@ -141,30 +329,11 @@ class ScanType(object):
             This list of point is only suitable for fitting 1-D quadratics as it will not include
             any points involving cross terms.
         """
-        pts_arr = []
-        if npts == 0:
-            return pts_arr
-        sm_pt = {}
-        start_pt = {}
         coeffs = dofs.keys()
-        for c in coeffs:
-            sm_pt[c] = 0.0
-            start_pt[c] = dofs[c].getStart()
-        has_sm_pt = check_point(sm_pt,start_pt)
-        for c1 in coeffs:
-            for idx in range(npts):
-                pt = {}
-                v = random.uniform(dofs[c1].getLow(),dofs[c1].getHigh())
-                for c2 in coeffs:
-                    if c1 == c2:
-                        pt[c2] = round(v,6)
-                    else:
-                        pt[c2] = 0.0
-                if check_point(pt,sm_pt):
-                    has_sm_pt = True
-                if check_point(pt,start_pt):
-                    continue
-                pts_arr.append(pt)
-        if not has_sm_pt:
-            pts_arr.append(sm_pt)
-        return pts_arr
+        if npts == 0:
+            return ScanPoints(coeffs)
+        start,low,high = cls.getLimitArrays(dofs,coeffs)
+        axis_pts = np.zeros((len(coeffs)*npts,len(coeffs)))
+        for idx,c in enumerate(coeffs):
+            axis_pts[idx*npts:(idx+1)*npts,idx] = np.random.uniform(low[idx],high[idx],size=npts)
+        return cls.buildPoints(dofs,coeffs,axis_pts)
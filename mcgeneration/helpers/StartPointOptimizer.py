@@ -0,0 +1,105 @@
+import numpy as np
+
+from QuasiRandom import QuasiRandom
+from QuadraticFit import QuadraticFit
+
+# Chooses the MadGraph starting point of a gridpack, so that the events generated at the starting point
+#   can be reweighted to all of the rwgt points with as little loss of statistical power as possible.
+#   The events are modeled as a mixture of the terms of the n-D quadratic cross-section estimate, where
+#   the fraction of events at point c which come from term k is p_k(c) = a_k(c)/sum_j a_j(c), with
+#   a_k(c) = |b_k*m_k(c)|. Reweighting events generated at s to the point t then gives an effective
+#   sample size (ESS) fraction of:
+#       ESS/N = 1 / sum_k p_k(t)^2/p_k(s)
+#   The optimizer picks the starting point which maximizes the smallest ESS/N over all rwgt points.
+class StartPointOptimizer(object):
+    MIN_FRAC = 1e-12    # Floor for the term fractions at the start point, to avoid dividing by zero
+
+    @classmethod
+    def getPriorCoefficients(cls,low,high):
+        """
+            Per-process prior for the quadratic cross-section estimate, used when there is no fit from a
+            previous run. The SM term is 1 and each pure quadratic term is 1/range^2, so that every DoF
+            changes the cross-section by a similar amount over its range. All other terms are 0
+        """
+        low = np.asarray(low,dtype=np.float64)
+        high = np.asarray(high,dtype=np.float64)
+        N = len(low)
+        width = 0.5*(high - low)
+        width[width == 0] = 1.0
+        b = np.zeros(QuadraticFit.getNumTerms(N))
+        b[0] = 1.0
+        iu,ju = np.triu_indices(N)
+        quad = b[1+N:]
+        quad[iu == ju] = 1.0 / width**2
+        return b
+
+    def __init__(self,low,high,coeffs=None):
+        """
+            low,high: Arrays with the limits of each DoF, which define the box to search in
+            coeffs: Quadratic fit coefficients of the cross-section (e.g. from QuadraticFit.fit()) in
+                the term ordering of QuadraticFit.getTermNames(). Terms which are NaN (or all terms, if
+                None) are taken from the prior
+        """
+        self.low = np.asarray(low,dtype=np.float64)
+        self.high = np.asarray(high,dtype=np.float64)
+        self.coeffs = self.getPriorCoefficients(self.low,self.high)
+        if coeffs is not None:
+            coeffs = np.asarray(coeffs,dtype=np.float64)
+            known = ~np.isnan(coeffs)
+            self.coeffs[known] = coeffs[known]
+
+    def getFractions(self,arr):
+        """ Returns the (points x terms) array of the term fractions p_k(c) for each point """
+        a = np.abs(QuadraticFit.getDesignMatrix(arr)*self.coeffs)
+        return a / np.sum(a,axis=1)[:,np.newaxis]
+
+    def getESS(self,starts,targets):
+        """ Returns the (starts x targets) array of ESS fractions for reweighting from each start point to each target """
+        p_s = np.maximum(self.getFractions(starts),self.MIN_FRAC)
+        p_t = self.getFractions(targets)
+        return 1.0 / np.dot(1.0/p_s,(p_t**2).T)
+
+    def getWorstESS(self,starts,targets):
+        """ Returns the smallest ESS fraction over all targets for each of the start points """
+        return np.min(self.getESS(starts,targets),axis=1)
+
+    def optimize(self,targets,fixed=None,n_cand=1024,n_local=64,max_iter=50,max_targets=2000,seed=None):
+        """
+            Search the box for the start point which maximizes the worst-case ESS fraction over the
+            targets (the rwgt points). A Sobol set of candidates is evaluated first, then the best
+            candidate is refined with random local steps, which shrink whenever no improvement is found.
+            Returns a tuple of the (rounded) start point and its worst-case ESS fraction.
+                fixed: Array of start values for each DoF, DoFs which are NaN get optimized
+                max_targets: Larger sets of rwgt points get randomly subsampled to this many points
+        """
+        rng = QuasiRandom.getRandomState(seed)
+        targets = np.asarray(targets,dtype=np.float64)
+        N = len(self.low)
+        if len(targets) > max_targets:
+            targets = targets[rng.choice(len(targets),max_targets,replace=False)]
+        if fixed is None:
+            fixed = np.full(N,np.nan)
+        fixed = np.asarray(fixed,dtype=np.float64)
+        is_fixed = ~np.isnan(fixed)
+
+        def constrain(arr):
+            arr = np.clip(arr,self.low,self.high)
+            arr[:,is_fixed] = fixed[is_fixed]
+            return np.round(arr,6)
+
+        cand = constrain(QuasiRandom.scale(QuasiRandom.sobol(n_cand,N,seed=rng),self.low,self.high))
+        scores = self.getWorstESS(cand,targets)
+        best = cand[np.argmax(scores)]
+        best_score = np.max(scores)
+        step = 0.25*(self.high - self.low)
+        for it in range(max_iter):
+            if np.all(step[~is_fixed] < 1e-4*(self.high - self.low)[~is_fixed]):
+                break
+            trial = constrain(best + rng.normal(size=(n_local,N))*step)
+            scores = self.getWorstESS(trial,targets)
+            j = int(np.argmax(scores))
+            if scores[j] > best_score:
+                best,best_score = trial[j],scores[j]
+            else:
+                step *= 0.5
+        return best,best_score
@@ -0,0 +1,157 @@
+import os
+import re
+import threading
+import time
+
+# Snapshot of the files produced by the gridpack jobs in a work area (the HOME_DIR and its gridruns dir),
+#   so that repeated existence checks are answered from memory instead of stat() calls on a (possibly
+#   shared) filesystem. The snapshot is only updated by refresh() (e.g. once per submit cycle) and by the
+#   add/remove methods, which the code that creates or deletes the files is expected to call.
+#   Note: Setup names have the form '<process>_<tag>_run<N>', neither the process nor the tag can contain '_'
+class WorkAreaIndex(object):
+    # Artifact types
+    SETUP_DIR   = 'setup_dir'     # <setup>/
+    TARBALL     = 'tarball'       # <setup>_<arch>_<release>_tarball.tar.xz
+    SCANFILE    = 'scanfile'      # <setup>_scanpoints.txt
+    SCANARRAY   = 'scanarray'     # <setup>_scanpoints.npy
+    LOG         = 'log'           # <setup>.log
+    CODEGEN_LOG = 'codegen_log'   # <setup>_codegen.log
+    DEBUG       = 'debug'         # <setup>.debug
+    INPUT       = 'input'         # input_<setup>.tar.gz
+    CODEGEN_SH  = 'codegen_sh'    # codegen_<setup>.sh
+    CODEGEN_JDL = 'codegen_jdl'   # codegen_<setup>.jdl
+    GRIDRUN     = 'gridrun'       # gridruns/<process>/<setup>/
+
+    NAME_RGX = re.compile(r"^(?:(input|codegen)_)?([^_/]+)_([^_/]+)_run(\d+)(.*)$")
+    SUFFIXES = {
+        (None,''): SETUP_DIR,
+        (None,'.log'): LOG,
+        (None,'.debug'): DEBUG,
+        (None,'_codegen.log'): CODEGEN_LOG,
+        (None,'_scanpoints.txt'): SCANFILE,
+        (None,'_scanpoints.npy'): SCANARRAY,
+        ('input','.tar.gz'): INPUT,
+        ('codegen','.sh'): CODEGEN_SH,
+        ('codegen','.jdl'): CODEGEN_JDL,
+    }
+    TARBALL_RGX = re.compile(r"^_.+_tarball\.tar\.xz$")
+
+    @classmethod
+    def parseName(cls,fname):
+        """ Parses a file name into a (process,tag,run,artifact type) tuple, returns None for unrelated files """
+        m = cls.NAME_RGX.match(fname)
+        if m is None:
+            return None
+        prefix,p,t,r,suffix = m.groups()
+        atype = cls.SUFFIXES.get((prefix,suffix))
+        if atype is None and prefix is None and cls.TARBALL_RGX.match(suffix):
+            atype = cls.TARBALL
+        if atype is None:
+            return None
+        return (p,t,int(r),atype)
+
+    @classmethod
+    def getSetupName(cls,process,tag,run):
+        return "{proc}_{tag}_run{N:d}".format(proc=process,tag=tag,N=run)
+
+    def __init__(self,home_dir,gridrun_dir='gridruns'):
+        self.home_dir = os.path.abspath(home_dir)
+        self.gridrun_dir = gridrun_dir  # Relative to the home_dir
+        self.last_refresh = None        # Time of the last full listing of the work area
+        self.__lock = threading.RLock()
+        self.__names = set()            # All names in the home_dir
+        self.__artifacts = {}           # {(process,tag,run): {artifact type: file name}}
+        self.__gridruns = set()         # {(process,setup name)}
+        self.refresh()
+
+    def refresh(self):
+        """ Re-list the work area, this is the only place which touches the filesystem """
+        names = set(os.listdir(self.home_dir))
+        gridruns = set()
+        gridrun_dir = os.path.join(self.home_dir,self.gridrun_dir)
+        if os.path.isdir(gridrun_dir):
+            for p in os.listdir(gridrun_dir):
+                p_dir = os.path.join(gridrun_dir,p)
+                if not os.path.isdir(p_dir):
+                    continue
+                for setup in os.listdir(p_dir):
+                    gridruns.add((p,setup))
+        with self.__lock:
+            self.__names = set()
+            self.__artifacts = {}
+            self.__gridruns = gridruns
+            for fname in names:
+                self.add(fname)
+            self.last_refresh = time.time()
+
+    def getAge(self):
+        """ Seconds since the last refresh """
+        return time.time() - self.last_refresh
+
+    def add(self,fname):
+        """ Record a file (or dir) that was created in the home_dir """
+        fname = os.path.basename(fname)
+        with self.__lock:
+            self.__names.add(fname)
+            arr = self.parseName(fname)
+            if arr is None:
+                return
+            p,t,r,atype = arr
+            self.__artifacts.setdefault((p,t,r),{})[atype] = fname
+
+    def remove(self,fname):
+        """ Forget about a file (or dir) that was removed from the home_dir """
+        fname = os.path.basename(fname)
+        with self.__lock:
+            self.__names.discard(fname)
+            arr = self.parseName(fname)
+            if arr is None:
+                return
+            p,t,r,atype = arr
+            entry = self.__artifacts.get((p,t,r),{})
+            if entry.get(atype) == fname:
+                del entry[atype]
+            if not len(entry):
+                self.__artifacts.pop((p,t,r),None)
+
+    def addGridrun(self,process,setup):
+        with self.__lock:
+            self.__gridruns.add((process,setup))
+
+    def removeGridrun(self,process,setup):
+        with self.__lock:
+            self.__gridruns.discard((process,setup))
+
+    def hasFile(self,fname):
+        """ Checks if a file (or dir) with this name is in the home_dir """
+        return fname in self.__names
+
+    def hasGridrun(self,process,setup):
+        return (process,setup) in self.__gridruns
+
+    def hasArtifact(self,process,tag,run,atype):
+        return atype in self.__artifacts.get((process,tag,run),{})
+
+    def getArtifact(self,process,tag,run,atype):
+        """ Returns the file name of an artifact of a setup, or None if it doesn't exist """
+        return self.__artifacts.get((process,tag,run),{}).get(atype)
+
+    def hasTarball(self,process,tag,run):
+        return self.hasArtifact(process,tag,run,self.TARBALL)
+
+    def exists(self,process,tag,run):
+        """ Same check as Gridpack.exists(): any of the setup dir, tarball, scanpoints file or gridrun dir """
+        with self.__lock:
+            atypes = self.__artifacts.get((process,tag,run),{})
+            if self.SETUP_DIR in atypes or self.TARBALL in atypes:
+                return True
+            if self.SCANFILE in atypes or self.SCANARRAY in atypes:
+                return True
+            return self.hasGridrun(process,self.getSetupName(process,tag,run))
+
+    def getSetups(self,atypes=None):
+        """ Returns the (process,tag,run) keys of all setups which have any of the listed artifact types """
+        with self.__lock:
+            if atypes is None:
+                return self.__artifacts.keys()
+            return [k for k,v in self.__artifacts.iteritems() if any(a in v for a in atypes)]
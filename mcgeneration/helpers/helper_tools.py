@@ -1,23 +1,31 @@
+import os
+import errno
 import itertools
 import random
 import subprocess
 import shutil
 import re
 
+import numpy as np
+
+from ProcessRunner import ProcessRunner
+
 # Pipes subprocess messages to STDOUT
-def run_process(inputs,verbose=True,indent=0):
+#   Note: Returns the stdout lines, see ProcessRunner for timeouts, stderr capture and running in parallel
+def run_process(inputs,verbose=True,indent=0,env=None,cwd=None):
     # Note: This will hold the main thread and wait for the subprocess to complete
-    indent_str = "\t"*indent
-    p = subprocess.Popen(inputs,stdout=subprocess.PIPE)
-    stdout = []
-    while True:
-        l = p.stdout.readline()
-        if l == '' and p.poll() is not None:
-            break
-        if l:
-            stdout.append(l.strip())
-            if verbose: print indent_str+l.strip()
-    return stdout
+    #   env: Environment of the subprocess, if None it inherits the current environment
+    #   cwd: Working directory of the subprocess, if None it inherits the current one
+    result = ProcessRunner.execute(inputs,verbose=verbose,indent=indent,env=env,cwd=cwd,capture_stderr=False)
+    return result.stdout
+
+# Creates a directory if it doesn't exist yet, safe to call from several threads/processes at once
+def make_dir(dpath):
+    try:
+        os.mkdir(dpath)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(dpath):
+            raise
 
 def find_process(p_name,p_lst):
     for p in p_lst:
@@ -44,12 +52,14 @@ def linspace(start,stop,num,endpoint=True,acc=7):
         y[-1] = stop
     return y
 
-# Checks if two W.C. phase space points are identical
+# Checks if two W.C. phase space points are identical (coeffs missing from a point are at their SM value)
+#   Note: For checking many points, compare their PointIndex keys instead
 def check_point(pt1,pt2):
     for k,v in pt1.iteritems():
-        if not pt2.has_key(k):
-            pt2[k] = 0.0    # pt2 is missing the coeff, add it and set it to SM value
-        if v != pt2[k]:
+        if v != pt2.get(k,0.0):
+            return False
+    for k,v in pt2.iteritems():
+        if not pt1.has_key(k) and v != 0.0:
             return False
     return True
 
@@ -65,36 +75,81 @@ def set_initial_point(file_name,dofs,flavor_scheme=5):
         f.write('\n')
     return file_name
 
-# Create the MadGraph reweight card with scans over the specified W.C. phase space points
-def make_reweight_card(file_name,dofs,pts):
-    # pts = [{c1: 1.0, c2: 1.0, ...}]
+# The value the dummy first launch of the reweight card sets the WCs of the first DoF to
+RWGT_DUMMY_VALUE = 0.0123
+
+# Returns the header of the MadGraph reweight card, including the dummy first launch
+def reweight_card_header(dofs):
     header  = ""
     header += "#******************************************************************\n"
     header += "#                       Reweight Module                           *\n"
     header += "#******************************************************************\n"
     header += "\nchange rwgt_dir rwgt\n"
+    # This is a workaround for the MG bug causing first point to not be renamed
+    header += "\nlaunch --rwgt_name=dummy_point"
+    c = dofs.keys()[0]
+    for k,v in dofs[c].eval(RWGT_DUMMY_VALUE).iteritems():
+        header += "\nset %s %.6f" % (k,v)
+    header += "\n"
+    return header
+
+# Returns the name of the reweight point, which encodes the W.C. phase space point
+def reweight_card_name(idx,pt):
+    rwgt_str = "EFTrwgt%d" % (idx)
+    for k,v in pt.iteritems():
+        rwgt_str += '_' + k + '_' + str(round(v,6))
+    return rwgt_str
+
+# Returns the reweight card 'launch' block for a single W.C. phase space point
+def reweight_card_launch(idx,dofs,pt):
+    block = "\nlaunch --rwgt_name=%s" % (reweight_card_name(idx,pt))
+    for k1,v1 in pt.iteritems():
+        for k2,v2 in dofs[k1].eval(v1).iteritems():
+            block += "\nset %s %.6f" % (k2,v2)
+    block += "\n"
+    return block
+
+# Returns the values of the WCs at a W.C. phase space point, formatted the same way as in the reweight card
+def reweight_card_params(dofs,pt):
+    params = {}
+    for k1,v1 in pt.iteritems():
+        for k2,v2 in dofs[k1].eval(v1).iteritems():
+            params[k2] = "%.6f" % (v2)
+    return params
+
+# Returns the WC values at the MG starting point
+def reweight_card_start_params(dofs):
+    return reweight_card_params(dofs,dict((c,dof.getStart()) for c,dof in dofs.iteritems()))
 
+# Returns a 'launch' block which only sets the WCs that differ from the MG starting point, since MadGraph
+#   starts every launch from the original param card
+def reweight_card_delta_launch(idx,dofs,pt,start):
+    target = dict(start)
+    target.update(reweight_card_params(dofs,pt))
+    block = "\nlaunch --rwgt_name=%s" % (reweight_card_name(idx,pt))
+    for k in sorted(target.keys()):
+        if target[k] == start[k]:
+            continue
+        block += "\nset %s %s" % (k,target[k])
+    block += "\n"
+    return block
+
+# Create the MadGraph reweight card with scans over the specified W.C. phase space points
+#   Note: If delta is True, each launch only sets the WCs which changed (see reweight_card_delta_launch)
+def make_reweight_card(file_name,dofs,pts,delta=False):
+    # pts = [{c1: 1.0, c2: 1.0, ...}]
     if len(pts) == 0:
         return file_name
 
     with open(file_name,'w') as f:
-        f.write(header)
-        # This is a workaround for the MG bug causing first point to not be renamed
-        f.write("\nlaunch --rwgt_name=dummy_point")
-        c = dofs.keys()[0]
-        for k,v in dofs[c].eval(0.0123).iteritems():
-            f.write("\nset %s %.6f" % (k,v))
-        f.write("\n")
-
+        f.write(reweight_card_header(dofs))
+        start = reweight_card_start_params(dofs)
         for idx,pt in enumerate(pts):
-            rwgt_str = "EFTrwgt%d" % (idx)
-            for k,v in pt.iteritems():
-                rwgt_str += '_' + k + '_' + str(round(v,6))
-            f.write("\nlaunch --rwgt_name=%s" % (rwgt_str))
-            for k1,v1 in pt.iteritems():
-                for k2,v2 in dofs[k1].eval(v1).iteritems():
-                    f.write("\nset %s %.6f" % (k2,v2))
-            f.write("\n")
+            if delta:
+                block = reweight_card_delta_launch(idx,dofs,pt,start)
+            else:
+                block = reweight_card_launch(idx,dofs,pt)
+            f.write(block)
 
 # Reads a limit file and returns a dictionary mapping the WCs to their respective high,low limits to use
 def parse_limit_file(fpath):
@@ -108,7 +163,13 @@ def parse_limit_file(fpath):
     return wc_limits
 
 # Note: The returned list will contain the MG starting point as the first element!
+#   Note: Also accepts the binary .npy version of a scanpoints file
 def parse_scan_file(fpath):
+    if fpath.endswith(SCAN_ARRAY_TYPE):
+        arr = load_scan_array(fpath,mmap=False)
+        names = arr.dtype.names
+        cols = [arr[k].tolist() for k in names]
+        return [dict(zip(names,vals)) for vals in zip(*cols)]
     pts = []
     with open(fpath,'r') as f:
         coeffs = []
@@ -146,28 +207,212 @@ def calculate_start_point(low,high,rfact=1.25):
         counter += 1
     return start_pt
 
+# Returns the header of the scan points table, which includes the MadGraph starting point
+#   Note: If no start_pt is given, the starting point is taken from the DoFs
+def scan_points_header(dofs,col_spacing=15,col_sep=" ",start_pt=None):
+    header = "".ljust(col_spacing)
+    for k,dof in dofs.iteritems():
+        header += dof.getName().ljust(col_spacing) + col_sep
+    start_row = "\nMGStart".ljust(col_spacing) + col_sep
+    for k,dof in dofs.iteritems():
+        if start_pt is None:
+            start = dof.getStart()
+        else:
+            start = start_pt.get(dof.getName(),0.0)
+        start_row += str(start).ljust(col_spacing) + col_sep
+    return header + start_row
+
+# Returns a single row of the scan points table
+def scan_points_row(idx,dofs,pt,col_spacing=15,col_sep=" "):
+    row_name = "rwgt%d" % (idx)
+    row = "\n" + row_name.ljust(col_spacing) + col_sep
+    for k,dof in dofs.iteritems():
+        if not pt.has_key(dof.getName()):
+            row += "0.0".ljust(col_spacing) + col_sep
+        else:
+            row += str(pt[dof.getName()]).ljust(col_spacing) + col_sep
+    return row
+
 # Saves the scan points to a text file formatted into a nice table
-def save_scan_points(fpath,dofs,rwgt_pts):
-    col_spacing = 15
-    col_sep = " "
+def save_scan_points(fpath,dofs,rwgt_pts,start_pt=None):
     with open(fpath,'w') as f:
-        header = "".ljust(col_spacing)
-        for k,dof in dofs.iteritems():
-            header += dof.getName().ljust(col_spacing) + col_sep
-        start_row = "\nMGStart".ljust(col_spacing) + col_sep
-        for k,dof in dofs.iteritems():
-            start_row += str(dof.getStart()).ljust(col_spacing) + col_sep
-        f.write(header)
-        f.write(start_row)
+        f.write(scan_points_header(dofs,start_pt=start_pt))
         for idx,pt in enumerate(rwgt_pts):
-            row_name = "rwgt%d" % (idx)
-            row = "\n" + row_name.ljust(col_spacing) + col_sep
-            for k,dof in dofs.iteritems():
-                if not pt.has_key(dof.getName()):
-                    row += "0.0".ljust(col_spacing) + col_sep
-                else:
-                    row += str(pt[dof.getName()]).ljust(col_spacing) + col_sep
-            f.write(row)
+            f.write(scan_points_row(idx,dofs,pt))
+
+# File extension of the binary version of a scanpoints file
+SCAN_ARRAY_TYPE = 'npy'
+
+# Returns the structured dtype of a binary scanpoints array, which has one float64 field per DoF
+def scan_array_dtype(names):
+    return np.dtype([(str(n),np.float64) for n in names])
+
+# Saves the scan points to a binary .npy file with the same content as the text table, the first row is the
+#   MG starting point. The file can be loaded (e.g. memory-mapped) with load_scan_array()
+#   Note: If no start_pt is given, the starting point is taken from the DoFs
+def save_scan_array(fpath,dofs,rwgt_pts,start_pt=None):
+    names = [dof.getName() for k,dof in dofs.iteritems()]
+    arr = np.zeros(len(rwgt_pts)+1,dtype=scan_array_dtype(names))
+    has_columns = hasattr(rwgt_pts,'getColumn')     # ScanPoints objects can fill a whole column at once
+    for k,dof in dofs.iteritems():
+        name = dof.getName()
+        arr[name][0] = dof.getStart() if start_pt is None else start_pt.get(name,0.0)
+        if len(rwgt_pts) == 0:
+            continue
+        if has_columns:
+            if name in rwgt_pts.getNames():
+                arr[name][1:] = rwgt_pts.getColumn(name)
+        else:
+            arr[name][1:] = [pt.get(name,0.0) for pt in rwgt_pts]
+    with open(fpath,'wb') as f:
+        np.save(f,arr)
+    return fpath
+
+# Loads a binary scanpoints array, by default memory-mapped read-only so that only the rows which get
+#   accessed are read from disk
+def load_scan_array(fpath,mmap=True):
+    return np.load(fpath,mmap_mode='r' if mmap else None)
+
+# Converts a scanpoints text file into the binary format, one row at a time so that large files (e.g.
+#   from stream_scan_points) never have to fit in memory
+def scan_file_to_array(txt_fpath,npy_fpath):
+    with open(txt_fpath,'r') as f:
+        names = f.readline().split()
+        n_rows = sum(1 for l in f if l.strip())
+    arr = np.lib.format.open_memmap(npy_fpath,mode='w+',dtype=scan_array_dtype(names),shape=(n_rows,))
+    with open(txt_fpath,'r') as f:
+        f.readline()
+        idx = 0
+        for l in f:
+            vals = l.split()[1:]
+            if len(vals) == 0:
+                continue
+            arr[idx] = tuple(float(v) for v in vals)
+            idx += 1
+    arr.flush()
+    del arr
+    return npy_fpath
+
+# Converts a binary scanpoints array back into the text table written by save_scan_points()
+def scan_array_to_file(npy_fpath,txt_fpath,col_spacing=15,col_sep=" "):
+    arr = load_scan_array(npy_fpath)
+    names = arr.dtype.names
+    with open(txt_fpath,'w') as f:
+        f.write("".ljust(col_spacing) + "".join(n.ljust(col_spacing) + col_sep for n in names))
+        for idx,row in enumerate(arr):
+            if idx == 0:
+                line = "\nMGStart".ljust(col_spacing) + col_sep
+            else:
+                line = "\n" + ("rwgt%d" % (idx-1)).ljust(col_spacing) + col_sep
+            line += "".join(str(float(row[n])).ljust(col_spacing) + col_sep for n in names)
+            f.write(line)
+    return txt_fpath
+
+# Writes both the scan points file and the reweight card in a single pass over an iterable of point
+#   chunks (e.g. from ScanType.iterFullScanLinear), so the full list of points is never held in memory
+#   Note: Returns the total number of reweight points written to the files
+def stream_scan_points(scan_fpath,rwgt_fpath,dofs,chunks,delta=False):
+    idx = 0
+    rwgt_file = None
+    try:
+        with open(scan_fpath,'w') as scan_file:
+            scan_file.write(scan_points_header(dofs))
+            for chunk in chunks:
+                for pt in chunk:
+                    if rwgt_file is None:
+                        # Only create the reweight card once we know there is at least one point
+                        rwgt_file = open(rwgt_fpath,'w')
+                        rwgt_file.write(reweight_card_header(dofs))
+                        start = reweight_card_start_params(dofs)
+                    scan_file.write(scan_points_row(idx,dofs,pt))
+                    if delta:
+                        block = reweight_card_delta_launch(idx,dofs,pt,start)
+                    else:
+                        block = reweight_card_launch(idx,dofs,pt)
+                    rwgt_file.write(block)
+                    idx += 1
+    finally:
+        if rwgt_file is not None:
+            rwgt_file.close()
+    return idx
+
+LHE_INIT_RGX = re.compile(r"<init[\s>]")   # Only the <init> tag, not e.g. the <initrwgt> of the header
+
+# Reads an LHE file, returns a tuple of (lines inside of the <init> block,number of events)
+def read_lhe_init(fpath):
+    init = []
+    n_events = 0
+    in_init = False
+    with open(fpath,'r') as f:
+        for l in f:
+            s = l.strip()
+            if LHE_INIT_RGX.match(s):
+                in_init = True
+            elif s.startswith('</init>'):
+                in_init = False
+            elif in_init:
+                init.append(l)
+            elif s.startswith('<event'):
+                n_events += 1
+    return init,n_events
+
+# Combines the <init> blocks of several LHE files of the same process (e.g. different seeds of a gridpack).
+#   The cross section of each subprocess (XSECUP) is the mean over the files weighted by their number of
+#   events, its error (XERRUP) is combined the same way in quadrature and XMAXUP is the max over the files.
+#   Everything else is taken from the first file
+def combine_lhe_init(inits,weights):
+    lines = list(inits[0])
+    if not len(lines) or sum(weights) <= 0:
+        weights = [1.0]*len(inits)
+    tot = float(sum(weights))
+    nprup = int(lines[0].split()[9])
+    for i in range(1,nprup+1):
+        rows = [[float(x) for x in init[i].split()[:3]] for init in inits]
+        xsec = sum(w*r[0] for w,r in zip(weights,rows)) / tot
+        xerr = np.sqrt(sum((w*r[1])**2 for w,r in zip(weights,rows))) / tot
+        xmax = max(r[2] for r in rows)
+        lprup = lines[i].split()[3]
+        lines[i] = " %.11e %.11e %.11e %s\n" % (xsec,xerr,xmax,lprup)
+    return lines
+
+# Concatenates the events of several LHE files (e.g. the same gridpack run with different seeds) into one
+#   file, streaming line by line. The header is taken from the first file and the cross sections in the
+#   <init> block are combined over all files (see combine_lhe_init)
+#   Note: Returns the number of events written
+def merge_lhe_files(fpaths,out_fpath):
+    inits = []
+    counts = []
+    for fpath in fpaths:
+        init,n = read_lhe_init(fpath)
+        inits.append(init)
+        counts.append(n)
+    init = combine_lhe_init(inits,counts)
+    n_events = 0
+    with open(out_fpath,'w') as out:
+        for idx,fpath in enumerate(fpaths):
+            in_header = True    # Everything up to the end of the <init> block
+            in_init = False
+            with open(fpath,'r') as f:
+                for l in f:
+                    s = l.strip()
+                    if in_header:
+                        # Only the first file keeps its header, with the original <init> lines replaced
+                        if in_init:
+                            in_header = not s.startswith('</init>')
+                        if idx == 0 and (not in_init or not in_header):
+                            out.write(l)
+                        if LHE_INIT_RGX.match(s):
+                            in_init = True
+                            if idx == 0:
+                                out.writelines(init)
+                        continue
+                    if s.startswith('</LesHouchesEvents>'):
+                        break
+                    if s.startswith('<event'):
+                        n_events += 1
+                    out.write(l)
+        out.write('</LesHouchesEvents>\n')
+    return n_events
 
 # Match strings using one or more regular expressions
 def regex_match(lst,regex_lst):
@@ -184,5 +429,75 @@ def regex_match(lst,regex_lst):
                 break
     return matches
 
+# Parses a reweight card the way the MG reweight module processes it: each launch starts from the MG
+#   starting point and applies its set commands. Returns the final WC values of each launch, keyed by the
+#   rwgt name
+def apply_reweight_card(file_name,start):
+    launches = {}
+    params = None
+    name = None
+    with open(file_name,'r') as f:
+        for l in f:
+            arr = l.split()
+            if len(arr) == 0 or arr[0].startswith('#'):
+                continue
+            if arr[0] == 'launch':
+                if name is not None:
+                    launches[name] = params
+                name = arr[1].split('=')[1]
+                params = dict(start)
+            elif arr[0] == 'set' and params is not None:
+                params[arr[1]] = arr[2]
+    if name is not None:
+        launches[name] = params
+    return launches
+
+# Compares the size of full and delta-encoded reweight cards, and the time it takes to write and process them
+#   Note: The time is for writing the card and parsing it with apply_reweight_card, which only emulates how
+#         the MG reweight module reads the card. It is not the setup time of the reweight module itself
+def benchmark_reweight_card(npts=200,fdir='.'):
+    import time
+    from ScanType import ScanType
+    from DegreeOfFreedom import DegreeOfFreedom
+    names = [
+        'ctp','cpQM','ctW','ctZ','ctG','cbW','cpQ3','cptb','cpt',
+        'cQq13','cQq83','cQq11','ctq1','cQq81','ctq8','ctt1','cQQ1','cQt1','cQt8'
+    ]
+    dofs = {}
+    for n in names:
+        dofs[n] = DegreeOfFreedom(name=n,relations=[[n],1.0])
+    for n,wcs in [('cQl3i',['cQl31','cQl32','cQl33']),('cQlMi',['cQlM1','cQlM2','cQlM3']),('ctei',['cte1','cte2','cte3'])]:
+        dofs[n] = DegreeOfFreedom(name=n,relations=[wcs,1.0])
+    fpath = os.path.join(fdir,'benchmark_reweight_card.dat')
+    print "Reweight card benchmark: {n:d} DoFs".format(n=len(dofs))
+    print "\tNote: Times are for writing the card and parsing it with apply_reweight_card (an emulation), not a MadGraph run"
+    print "\t%s%s%s%s%s%s" % ("Scan".ljust(30),"Card".ljust(12),"Lines".rjust(8),"Bytes".rjust(10),"Sets".rjust(8),"Time [ms]".rjust(12))
+    for stype,start,num_pts in [(ScanType.SLINSPACE,0.0,npts/len(dofs)),(ScanType.PLINSPACE,0.0,3),(ScanType.FSOBOL,0.0,npts),(ScanType.FSOBOL,4.0,npts)]:
+        for dof in dofs.values():
+            dof.setLimits(start,-10.0,10.0)
+        pts = ScanType.getPoints(dofs,num_pts,stype,seed=1)
+        label = "%s (start=%s)" % (stype,start)
+        ref = None
+        for card,delta in [('full',False),('delta',True)]:
+            t0 = time.time()
+            make_reweight_card(fpath,dofs,pts,delta=delta)
+            init = reweight_card_start_params(dofs)
+            launches = apply_reweight_card(fpath,init)
+            dt = 1000.0*(time.time() - t0)
+            if delta:
+                # Make sure the delta card gives the same points
+                for k,v in launches.iteritems():
+                    if k == 'dummy_point': continue
+                    if ref[k.split('_',1)[1]] != v:
+                        raise RuntimeError("Delta-encoded reweight card differs for %s" % (k))
+            else:
+                ref = dict((k.split('_',1)[1],v) for k,v in launches.iteritems() if k != 'dummy_point')
+            with open(fpath,'r') as f:
+                lines = f.readlines()
+            n_sets = sum(1 for l in lines if l.startswith('set '))
+            n_bytes = sum(len(l) for l in lines)
+            print "\t%s%s%s%s%s%s" % (label.ljust(30),card.ljust(12),str(len(lines)).rjust(8),str(n_bytes).rjust(10),str(n_sets).rjust(8),("%.1f" % (dt)).rjust(12))
+    os.remove(fpath)
+
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    benchmark_reweight_card()
\ No newline at end of file
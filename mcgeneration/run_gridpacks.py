@@ -0,0 +1,28 @@
+import os
+
+from helpers.RunScheduler import RunScheduler
+from helpers.GridpackRunPool import GridpackRunPool
+
+#NOTE: Runs already produced gridpack tarballs (found in the current dir) on the local machine. The per-seed
+#      LHE files and the merged cmsgrid_final.lhe end up in gridruns/<process>/<setup>/
+
+def main():
+    max_cores  = None       # If None, uses all cores of the machine
+    max_memory = None       # In GB, if None uses all of the memory of the machine
+    retries    = 1          # How many times a failed seed gets re-run
+    keep_work  = False      # Keep the per-seed work dirs (useful for debugging failed seeds)
+
+    # Each entry is: (setup,events,seeds,cores per seed,memory per seed in GB)
+    requests = [
+        #('ttH_ctGctW_run0',  10000, range(1,5), 1, 2.0),
+        #('ttll_ctGctW_run0', 10000, range(1,9), 2, 3.0),
+    ]
+
+    pool = GridpackRunPool(max_cores=max_cores,keep_work=keep_work)
+    scheduler = RunScheduler(max_cores=max_cores,max_memory=max_memory,retries=retries,pool=pool)
+    for setup,events,seeds,ncpu,mem in requests:
+        scheduler.add(setup,events,seeds,ncpu=ncpu,memory=mem)
+    scheduler.run()
+
+if __name__ == "__main__":
+    main()
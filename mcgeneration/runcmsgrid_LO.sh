@@ -59,13 +59,282 @@ fi
 #generate events
 ./run.sh $nevt $rnum
 
+# Splits an LHE file into shards with contiguous blocks of events, each shard gets the full header and footer
+#   Usage: split_lhe <lhe file> <number of shards> <output dir>, creates <output dir>/shard_<i>.lhe
+split_lhe () {
+    nevents=`grep -c '<event' $1`
+    awk -v n=$nevents -v k=$2 -v out=$3 '
+        BEGIN { state = 0; ev = 0; header = ""; buf = ""; start_rgx = "^[ \t]*<event([ \t>]|$)" }
+        state != 1 && $0 ~ start_rgx {
+            if (state == 0) {
+                for (i = 0; i < k; i++) printf "%s", header > (out "/shard_" i ".lhe")
+            } else {
+                printf "%s", buf > cur
+                buf = ""
+            }
+            cur = out "/shard_" int(ev*k/n) ".lhe"
+            ev++
+            state = 1
+        }
+        state == 0 { header = header $0 "\n"; next }
+        state == 1 { print > cur; if ($0 ~ /<\/event>/) state = 2; next }
+        state == 2 { buf = buf $0 "\n" }
+        END { for (i = 0; i < k; i++) { f = out "/shard_" i ".lhe"; printf "%s", buf > f; close(f) } }
+    ' $1
+}
+
+# Merges LHE shards back into a single file, the header and footer are taken from the first/last shard
+#   Usage: merge_lhe <output file> <shard 0> <shard 1> ...
+merge_lhe () {
+    outfile=$1
+    shift
+    awk '
+        BEGIN { nfile = 0; start_rgx = "^[ \t]*<event([ \t>]|$)" }
+        FNR == 1 { state = 0; buf = ""; nfile++ }
+        state == 0 {
+            if ($0 ~ start_rgx) { state = 1 }
+            else { if (nfile == 1) print; next }
+        }
+        state == 2 {
+            if ($0 ~ start_rgx) { printf "%s", buf; buf = ""; state = 1 }
+            else { buf = buf $0 "\n"; next }
+        }
+        state == 1 { print; if ($0 ~ /<\/event>/) state = 2 }
+        END { printf "%s", buf }
+    ' "$@" > $outfile
+}
+
+# Creates a working copy of a madevent directory for a reweighting shard. Everything MadGraph might write
+#   to (Cards, html and results files, ...) is a real copy, while the large (read-only) compiled
+#   SubProcesses and lib directories are hard-linked. The precompiled reweight module (rwgt/rw_me*, see
+#   the 'change rwgt_dir rwgt' line of the reweight card) is handled the same way. The Events directory
+#   is left empty
+#   Usage: make_shard_dir <madevent dir> <shard dir>
+make_shard_dir () {
+    mkdir -p $2
+    for base in `ls -A $1`; do
+        case $base in
+            Events) mkdir $2/Events ;;
+            SubProcesses|lib) cp -al $1/$base $2/$base ;;
+            rwgt|rw_me*) make_shard_dir $1/$base $2/$base ;;
+            *) cp -a $1/$base $2/$base ;;
+        esac
+    done
+}
+
+# Creates the working directory of a reweighting shard, which only uses a single core
+#   Usage: prepare_shard <madevent dir> <run name> <shard dir>
+prepare_shard () {
+    make_shard_dir $1 $3
+    echo "nb_core = 1" >> $3/Cards/me5_configuration.txt
+    mkdir -p $3/Events/$2
+}
+
+# Runs the reweight module in all of the shard working directories in parallel
+#   Usage: run_shards <run name> <number of shards> <dir with the shard_<i> dirs>, returns non-zero on failure
+run_shards () {
+    pids=""
+    for i in `seq 0 $(($2-1))`; do
+        (cd $3/shard_${i} && echo "0" | ./bin/madevent --debug reweight $1 > $3/shard_${i}.log 2>&1) &
+        pids="$pids $!"
+    done
+    failed=0
+    for pid in $pids; do
+        wait $pid || failed=1
+    done
+    if [ "$failed" -ne "0" ]; then
+        echo "reweighting of at least one shard failed, see $3/shard_*.log"
+        return 1
+    fi
+    return 0
+}
+
+# Reweights an event file by running the precompiled reweight module on nshards event shards in parallel
+#   Usage: reweight_sharded <madevent dir> <run name> <number of shards>
+#   Note: The reweighted events replace the run's unweighted_events.lhe.gz, returns non-zero on failure
+reweight_sharded () {
+    medir=$1
+    run=$2
+    nshards=$3
+    evtfile=$medir/Events/$run/unweighted_events.lhe.gz
+    rwgtdir=$LHEWORKDIR/rwgt_shards
+    rm -rf $rwgtdir
+    mkdir -p $rwgtdir
+    gzip -dc $evtfile > $rwgtdir/events.lhe
+    split_lhe $rwgtdir/events.lhe $nshards $rwgtdir
+    rm $rwgtdir/events.lhe
+
+    for i in `seq 0 $(($nshards-1))`; do
+        prepare_shard $medir $run $rwgtdir/shard_${i}
+        gzip -c $rwgtdir/shard_${i}.lhe > $rwgtdir/shard_${i}/Events/$run/unweighted_events.lhe.gz
+        rm $rwgtdir/shard_${i}.lhe
+    done
+    run_shards $run $nshards $rwgtdir || return 1
+
+    shards=""
+    for i in `seq 0 $(($nshards-1))`; do
+        gzip -d $rwgtdir/shard_${i}/Events/$run/unweighted_events.lhe.gz
+        shard=$rwgtdir/shard_${i}/Events/$run/unweighted_events.lhe
+        # All shards have to define exactly the same weights
+        sed -n '/<initrwgt>/,/<\/initrwgt>/p' $shard > $rwgtdir/initrwgt_${i}.txt
+        if ! cmp -s $rwgtdir/initrwgt_0.txt $rwgtdir/initrwgt_${i}.txt; then
+            echo "reweighted shard $i has different weights than shard 0"
+            return 1
+        fi
+        shards="$shards $shard"
+    done
+    merge_lhe $rwgtdir/events.lhe $shards
+    gzip -c $rwgtdir/events.lhe > $evtfile
+    rm -rf $rwgtdir
+    return 0
+}
+
+# Splits a reweight card into sub-cards with contiguous blocks of the launches. Every sub-card keeps the
+#   header, including the dummy_point launch that works around the MG bug with renaming the first point
+#   Note: Relies on MG starting every launch from the original param card, which also makes the sub-cards
+#         of delta encoded reweight cards valid on their own
+#   Usage: split_reweight_card <reweight card> <number of shards> <output dir>, creates <output dir>/reweight_card_<i>.dat
+split_reweight_card () {
+    nlaunch=`grep '^launch' $1 | grep -vc 'rwgt_name=dummy_point'`
+    awk -v n=$nlaunch -v k=$2 -v out=$3 '
+        BEGIN { nl = 0; header = ""; cur = "" }
+        /^launch/ && $0 !~ /rwgt_name=dummy_point/ {
+            if (cur == "") {
+                for (i = 0; i < k; i++) printf "%s", header > (out "/reweight_card_" i ".dat")
+            }
+            cur = out "/reweight_card_" int(nl*k/n) ".dat"
+            nl++
+        }
+        cur == "" { header = header $0 "\n"; next }
+        { print > cur }
+    ' $1
+}
+
+# Extracts the weights added by reweighting a shard of the points, skipping the weight of the dummy launch
+#   Usage: extract_weights <lhe file> <init file> <weights file>
+#   Note: The <initrwgt> weight definitions go to the init file, the <wgt> lines of each event go to a
+#         single line of the weights file (joined by a \001 character)
+#   Note: The dummy weight is dropped by position (always the first weight), not by its name, since MG
+#         doesn't rename the first launch, i.e. it can show up as e.g. 'rwgt_1' instead of 'dummy_point'
+extract_weights () {
+    awk -v init=$2 -v wgts=$3 '
+        /<initrwgt>/ { in_init = 1 }
+        in_init && /<weight / { in_wgt = 1; buf = ""; is_dummy = (++n_def == 1) }
+        in_wgt {
+            buf = buf $0 "\n"
+            if ($0 ~ /<\/weight>/) { in_wgt = 0; if (!is_dummy) printf "%s", buf > init }
+        }
+        /<\/initrwgt>/ { in_init = 0 }
+        /<rwgt>/ { in_rwgt = 1; line = ""; n_wgt = 0; next }
+        /<\/rwgt>/ { in_rwgt = 0; print line > wgts; next }
+        in_rwgt && /<wgt/ && ++n_wgt == 1 { next }
+        in_rwgt { line = line $0 "\001" }
+        END { printf "" > init; printf "" > wgts }
+    ' $1
+}
+
+# Splices the weights extracted from the other point shards into the reweighted events of the first shard
+#   Usage: splice_weights <output file> <lhe file> <number of extra shards> <dir with the init_<i>/wgts_<i> files>
+splice_weights () {
+    awk -v k=$3 -v dir=$4 '
+        BEGIN {
+            extra_init = ""
+            for (i = 1; i <= k; i++) {
+                while ((getline l < (dir "/init_" i ".txt")) > 0) extra_init = extra_init l "\n"
+            }
+        }
+        /<initrwgt>/ { in_init = 1 }
+        in_init && !done && (/<\/weightgroup>/ || /<\/initrwgt>/) { printf "%s", extra_init; done = 1 }
+        /<\/initrwgt>/ { in_init = 0 }
+        /<\/rwgt>/ {
+            for (i = 1; i <= k; i++) {
+                getline l < (dir "/wgts_" i ".txt")
+                gsub("\001","\n",l)
+                printf "%s", l
+            }
+        }
+        { print }
+    ' $2 > $1
+}
+
+# Reweights an event file by running the precompiled reweight module with nshards subsets of the reweight
+#   points in parallel, each over all of the events. The weights are then spliced back into one file
+#   Usage: reweight_points_sharded <madevent dir> <run name> <number of shards>
+#   Note: The reweighted events replace the run's unweighted_events.lhe.gz, returns non-zero on failure
+reweight_points_sharded () {
+    medir=$1
+    run=$2
+    nshards=$3
+    evtfile=$medir/Events/$run/unweighted_events.lhe.gz
+    rwgtdir=$LHEWORKDIR/rwgt_shards
+    rm -rf $rwgtdir
+    mkdir -p $rwgtdir
+    split_reweight_card $medir/Cards/reweight_card.dat $nshards $rwgtdir
+
+    for i in `seq 0 $(($nshards-1))`; do
+        prepare_shard $medir $run $rwgtdir/shard_${i}
+        cp $rwgtdir/reweight_card_${i}.dat $rwgtdir/shard_${i}/Cards/reweight_card.dat
+        cp $evtfile $rwgtdir/shard_${i}/Events/$run/unweighted_events.lhe.gz
+    done
+    run_shards $run $nshards $rwgtdir || return 1
+
+    gzip -dc $rwgtdir/shard_0/Events/$run/unweighted_events.lhe.gz > $rwgtdir/shard_0.lhe
+    nevents=`grep -c '</rwgt>' $rwgtdir/shard_0.lhe`
+    for i in `seq 1 $(($nshards-1))`; do
+        gzip -dc $rwgtdir/shard_${i}/Events/$run/unweighted_events.lhe.gz > $rwgtdir/shard_${i}.lhe
+        extract_weights $rwgtdir/shard_${i}.lhe $rwgtdir/init_${i}.txt $rwgtdir/wgts_${i}.txt
+        rm $rwgtdir/shard_${i}.lhe
+        # All shards reweight the same events, so need to have the same number of weight blocks
+        if [ "`cat $rwgtdir/wgts_${i}.txt | wc -l`" -ne "$nevents" ]; then
+            echo "reweighted shard $i has a different number of events than shard 0"
+            return 1
+        fi
+    done
+    splice_weights $rwgtdir/events.lhe $rwgtdir/shard_0.lhe $(($nshards-1)) $rwgtdir
+    gzip -c $rwgtdir/events.lhe > $evtfile
+    rm -rf $rwgtdir
+    return 0
+}
+
 #reweight if necessary
 if [ -e ./madevent/Cards/reweight_card.dat ]; then
     echo "reweighting events"
     mv events.lhe.gz ./madevent/Events/GridRun_${rnum}/unweighted_events.lhe.gz
-    cd madevent
-    echo "0" |./bin/madevent --debug reweight GridRun_${rnum}
-    cd ..
+    # How to split up the reweighting: 'events' reweights shards of the events in parallel, 'points'
+    #   reweights all events for subsets of the points in parallel and 'serial' uses a single process
+    #   (the default, sharding has to be turned on with the rwgt_mode option of the Gridpack)
+    rwgt_mode=${RWGT_MODE:-serial}
+    # Number of shards to reweight in parallel (defaults to the number of cpus)
+    nshards=${RWGT_NSHARDS:-$ncpu}
+    if [ "$rwgt_mode" = "points" ]; then
+        nitems=`grep '^launch' ./madevent/Cards/reweight_card.dat | grep -vc 'rwgt_name=dummy_point'`
+    else
+        nitems=`gzip -dc ./madevent/Events/GridRun_${rnum}/unweighted_events.lhe.gz | grep -c '<event'`
+    fi
+    if [ "$nshards" -gt "$nitems" ]; then
+        nshards=$nitems
+    fi
+    sharded=0
+    if [ "$rwgt_mode" = "points" ] && [ "$nshards" -gt "1" ]; then
+        echo "reweighting $nitems points in $nshards shards"
+        if reweight_points_sharded $LHEWORKDIR/process/madevent GridRun_${rnum} $nshards; then
+            sharded=1
+        else
+            echo "falling back to reweighting all points serially"
+        fi
+    elif [ "$rwgt_mode" = "events" ] && [ "$nshards" -gt "1" ]; then
+        echo "reweighting $nitems events in $nshards shards"
+        if reweight_sharded $LHEWORKDIR/process/madevent GridRun_${rnum} $nshards; then
+            sharded=1
+        else
+            echo "falling back to reweighting all events serially"
+        fi
+    fi
+    if [ "$sharded" -eq "0" ]; then
+        cd madevent
+        echo "0" |./bin/madevent --debug reweight GridRun_${rnum}
+        cd ..
+    fi
     mv $LHEWORKDIR/process/madevent/Events/GridRun_${rnum}/unweighted_events.lhe.gz $LHEWORKDIR/process/events.lhe.gz
 fi
 
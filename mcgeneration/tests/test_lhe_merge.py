@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from helpers.helper_tools import merge_lhe_files, read_lhe_init
+
+# A small LHE file with the <initrwgt> header block of a reweighted EFT gridpack
+def make_lhe_file(fpath,xsec,xerr,xmax,n_events):
+    with open(fpath,'w') as f:
+        f.write('<LesHouchesEvents version="3.0">\n')
+        f.write('<header>\n')
+        f.write('<initrwgt>\n')
+        f.write("<weightgroup name='mg_reweighting' weight_name_strategy='includeIdInWeightName'>\n")
+        f.write("<weight id='rwgt_1'> set param_card dim6 1 0.0123 </weight>\n")
+        f.write("<weight id='EFTrwgt0_ctW_1.0'> set param_card dim6 2 1.0 </weight>\n")
+        f.write('</weightgroup>\n')
+        f.write('</initrwgt>\n')
+        f.write('</header>\n')
+        f.write('<init>\n')
+        f.write('2212 2212 6.500000e+03 6.500000e+03 0 0 247000 247000 -4 1\n')
+        f.write(' %e %e %e 1\n' % (xsec,xerr,xmax))
+        f.write('<generator name="MadGraph5_aMC@NLO" version="2.6.0">please cite 1405.0301 </generator>\n')
+        f.write('</init>\n')
+        for i in range(n_events):
+            f.write('<event>\n%d\n</event>\n' % (i))
+        f.write('</LesHouchesEvents>\n')
+
+class TestMergeLHE(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fpaths = [os.path.join(self.tmp_dir,'seed%d.lhe' % (i)) for i in range(2)]
+        make_lhe_file(self.fpaths[0],1.0,0.1,2.0,10)
+        make_lhe_file(self.fpaths[1],2.0,0.1,3.0,30)
+        self.out = os.path.join(self.tmp_dir,'merged.lhe')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_init_skips_initrwgt(self):
+        init,n = read_lhe_init(self.fpaths[0])
+        self.assertEqual(n,10)
+        self.assertEqual(init[0].split()[0],'2212')
+        self.assertEqual(len(init),3)
+
+    def test_merge_with_initrwgt(self):
+        n = merge_lhe_files(self.fpaths,self.out)
+        self.assertEqual(n,40)
+        with open(self.out,'r') as f:
+            text = f.read()
+        self.assertEqual(text.count('<event>'),40)
+        self.assertEqual(text.count('<initrwgt>'),1)
+        self.assertEqual(text.count('<init>'),1)
+        self.assertEqual(text.count('</LesHouchesEvents>'),1)
+        init,n_read = read_lhe_init(self.out)
+        self.assertEqual(n_read,40)
+        xsec,xerr,xmax = [float(x) for x in init[1].split()[:3]]
+        self.assertAlmostEqual(xsec,(10*1.0 + 30*2.0)/40.0)
+        self.assertAlmostEqual(xerr,(((10*0.1)**2 + (30*0.1)**2)**0.5)/40.0)
+        self.assertAlmostEqual(xmax,3.0)
+        # The header is kept as is, with the weight block before the <init> block
+        self.assertTrue(text.index('</initrwgt>') < text.index('<init>'))
+
+if __name__ == "__main__":
+    unittest.main()
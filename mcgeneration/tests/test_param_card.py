@@ -0,0 +1,51 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from helpers.ParamCard import ParamCard
+
+# A minimal UFO model, with just enough of parameters.py and write_param_card.py for the param card writer
+PARAMETERS_PY = (
+    "class Parameter(object):\n"
+    "    def __init__(self,name,value,lhablock,lhacode):\n"
+    "        self.name,self.value,self.lhablock,self.lhacode = name,value,lhablock,lhacode\n"
+    "        self.nature = 'external'\n"
+    "all_parameters = [Parameter('ctW',0.0,'DIM6',[1]),Parameter('MT',172.0,'MASS',[6])]\n"
+)
+WRITER_PY = (
+    "class ParamCardWriter(object):\n"
+    "    def __init__(self,fpath,params,generic=False):\n"
+    "        with open(fpath,'w') as f:\n"
+    "            for p in params:\n"
+    "                f.write('Block %s\\n    %d %e # %s \\n' % (p.lhablock.lower(),p.lhacode[0],p.value,p.name))\n"
+)
+
+class TestParamCard(unittest.TestCase):
+    def setUp(self):
+        self.model_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.model_dir,'parameters.py'),'w') as f:
+            f.write(PARAMETERS_PY)
+        with open(os.path.join(self.model_dir,'write_param_card.py'),'w') as f:
+            f.write(WRITER_PY)
+
+    def tearDown(self):
+        shutil.rmtree(self.model_dir)
+
+    def test_render(self):
+        card = ParamCard(self.model_dir,python=sys.executable)
+        card.setValue('CTW',1.5)
+        text = card.render()
+        self.assertIn("    1 1.500000000000e+00 # ctW ",text)
+        self.assertIn("    6 1.720000e+02 # MT ",text)
+        card.setValue('cpt',1.0)
+        self.assertRaises(RuntimeError,card.render)
+
+    def test_bad_interpreter(self):
+        missing = os.path.join(self.model_dir,'no_such_python')
+        self.assertRaises(RuntimeError,ParamCard.getDefaultCard,self.model_dir,missing)
+        self.assertRaises(RuntimeError,ParamCard.getDefaultCard,self.model_dir,'false')
+
+if __name__ == '__main__':
+    unittest.main()
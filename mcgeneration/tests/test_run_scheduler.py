@@ -0,0 +1,79 @@
+import shutil
+import tempfile
+import threading
+import unittest
+
+from helpers.GridpackRunPool import CoreBudget, SeedResult
+from helpers.RunScheduler import RunScheduler, RunRequest
+
+# Stands in for GridpackRunPool, so the scheduling can be tested without any gridpack tarballs
+class FakePool(object):
+    def __init__(self,fail_seeds=[],merge_error=None):
+        self.budget = CoreBudget(4)
+        self.fail_seeds = list(fail_seeds)  # Each entry fails a single attempt of that seed
+        self.merge_error = merge_error      # {setup: exception raised by merge()}
+        self.runs = []
+        self.__lock = threading.Lock()
+
+    def prepare(self,gridpack):
+        pass
+
+    def executeSeed(self,gridpack,events,seed,cores):
+        setup = gridpack.getSetupString()
+        with self.__lock:
+            self.runs.append((setup,seed))
+            if (setup,seed) in self.fail_seeds:
+                self.fail_seeds.remove((setup,seed))
+                return SeedResult(setup,seed,error='failed')
+        return SeedResult(setup,seed,lhe_file='seed%s.lhe' % (seed))
+
+    def merge(self,gridpack,results):
+        if self.merge_error is not None and self.merge_error.has_key(gridpack.getSetupString()):
+            raise self.merge_error[gridpack.getSetupString()]
+        return len(results)
+
+class TestRunScheduler(unittest.TestCase):
+    def setUp(self):
+        self.home_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.home_dir)
+
+    def makeScheduler(self,pool,retries=1):
+        sched = RunScheduler(max_cores=4,max_memory=8,retries=retries,pool=pool)
+        sched.POLL_TIME = 0.01
+        return sched
+
+    def test_retries_only_failed_seed(self):
+        pool = FakePool(fail_seeds=[('ttH_A_run0',2)])
+        sched = self.makeScheduler(pool)
+        req = sched.add(self.makeGridpack('ttH_A_run0'),10,[1,2,3])
+        sched.run()
+        self.assertTrue(req.isSuccess())
+        self.assertEqual(req.attempts,{1: 1, 2: 2, 3: 1})
+        self.assertEqual(sorted(pool.runs),[('ttH_A_run0',1),('ttH_A_run0',2),('ttH_A_run0',2),('ttH_A_run0',3)])
+
+    def test_merge_error_only_fails_its_request(self):
+        pool = FakePool(merge_error={'ttH_A_run0': IndexError('bad init')})
+        sched = self.makeScheduler(pool)
+        bad = sched.add(self.makeGridpack('ttH_A_run0'),10,[1,2])
+        good = sched.add(self.makeGridpack('ttll_B_run0'),10,[1,2,3])
+        sched.run()
+        self.assertFalse(bad.isSuccess())
+        self.assertTrue('bad init' in bad.merge_error)
+        self.assertTrue(good.isSuccess())
+        self.assertEqual(good.merged_events,3)
+
+    def test_duplicate_seeds(self):
+        pool = FakePool()
+        sched = self.makeScheduler(pool)
+        req = sched.add(self.makeGridpack('ttH_A_run0'),10,[5,1,5,1,2])
+        self.assertEqual(req.seeds,[5,1,2])
+        sched.run()
+        self.assertEqual(sorted(pool.runs),[('ttH_A_run0',1),('ttH_A_run0',2),('ttH_A_run0',5)])
+
+    def makeGridpack(self,setup):
+        return RunRequest.makeGridpack(setup,home_dir=self.home_dir)
+
+if __name__ == "__main__":
+    unittest.main()
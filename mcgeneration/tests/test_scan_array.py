@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from helpers.DegreeOfFreedom import DegreeOfFreedom
+from helpers.helper_tools import save_scan_points, scan_file_to_array, scan_array_to_file, load_scan_array
+
+class TestScanArray(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dofs = {}
+        for name,start in [('ctW',1.5),('ctG',-0.25)]:
+            self.dofs[name] = DegreeOfFreedom(name=name,relations=[[name],1.0])
+            self.dofs[name].setLimits(start,-2.0,2.0)
+        self.pts = [{'ctW': 0.5,'ctG': -1.25},{'ctW': 0.123456},{'ctG': 2.0},{}]
+        self.txt = os.path.join(self.tmp_dir,'scanpoints.txt')
+        save_scan_points(self.txt,self.dofs,self.pts)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_file_to_array(self):
+        arr = load_scan_array(scan_file_to_array(self.txt,os.path.join(self.tmp_dir,'scanpoints.npy')))
+        self.assertEqual(len(arr),len(self.pts)+1)
+        self.assertEqual(arr[0]['ctW'],1.5)         # The MG starting point is the first row
+        self.assertEqual(arr[0]['ctG'],-0.25)
+        for row,pt in zip(arr[1:],self.pts):
+            for name in self.dofs.keys():
+                self.assertEqual(row[name],pt.get(name,0.0))
+
+    def test_round_trip(self):
+        npy = scan_file_to_array(self.txt,os.path.join(self.tmp_dir,'scanpoints.npy'))
+        txt = scan_array_to_file(npy,os.path.join(self.tmp_dir,'scanpoints_copy.txt'))
+        with open(self.txt,'r') as f1:
+            with open(txt,'r') as f2:
+                self.assertEqual(f1.read(),f2.read())
+        npy2 = scan_file_to_array(txt,os.path.join(self.tmp_dir,'scanpoints_copy.npy'))
+        np.testing.assert_array_equal(load_scan_array(npy),load_scan_array(npy2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+
+from helpers.PointIndex import PointIndex
+from helpers.ScanPoints import ScanPoints
+
+class TestPointIndex(unittest.TestCase):
+    def test_key_consistency(self):
+        # Includes values exactly halfway between two quantized values, where round() and np.rint() differ
+        names = ['cb','ca','cc']
+        arr = np.array([
+            [0.0000005,-0.0000025,1.0],
+            [0.0000015,0.0,-0.0000005],
+            [2.5e-7,1.0,0.0],
+            [0.0,0.0,0.0],
+        ])
+        keys = PointIndex.getKeys(names,arr)
+        for row,key in zip(arr,keys):
+            self.assertEqual(PointIndex.getKey(dict(zip(names,row))),key)
+
+    def test_key_ignores_order_and_sm(self):
+        k1 = PointIndex.getKey({'ca': 1.0,'cb': 0.0,'cc': -2.0})
+        k2 = PointIndex.getKey({'cc': -2.0,'ca': 1.0})
+        self.assertEqual(k1,k2)
+        self.assertEqual(PointIndex.getKey({'ca': 0.0,'cb': 1e-8}),PointIndex.SM_KEY)
+
+    def test_duplicate_owner(self):
+        index = PointIndex()
+        key = PointIndex.getKey({'ca': 1.0})
+        index.add(key,owner='run0')
+        index.add(key,owner='run1')
+        self.assertEqual(index.getOwner(key),'run0')
+        self.assertFalse(index.isDuplicate(key,owner='run0'))
+        self.assertTrue(index.isDuplicate(key,owner='run1'))
+
+class TestScanPoints(unittest.TestCase):
+    def test_round(self):
+        pts = ScanPoints(['ca','cb'],[[0.12345649,1.0000004],[-0.1234565,2.0]]).round()
+        np.testing.assert_array_equal(pts.getArray(),[[0.123456,1.0],[-0.123456,2.0]])
+
+    def test_dedupe(self):
+        pts = ScanPoints(['ca','cb'],[[1.0,0.0],[1.0,2.0],[1.0,0.0],[1.0000001,2.0],[0.0,0.0]])
+        self.assertEqual(pts.dedupe(),2)
+        np.testing.assert_array_equal(pts.getArray(),[[1.0,0.0],[1.0,2.0],[0.0,0.0]])
+
+    def test_dedupe_excludes_start(self):
+        start = PointIndex.getKey({'ca': 1.0,'cb': 2.0})
+        pts = ScanPoints(['ca','cb'],[[1.0,2.0],[0.0,1.0],[1.0,2.0]])
+        self.assertEqual(pts.dedupe(exclude=[start]),2)
+        np.testing.assert_array_equal(pts.getArray(),[[0.0,1.0]])
+
+    def test_dedupe_shared_index(self):
+        index = PointIndex()
+        pts0 = ScanPoints(['ca','cb'],[[1.0,0.0],[0.0,0.0]])
+        pts1 = ScanPoints(['cb','ca'],[[0.0,1.0],[1.0,1.0],[0.0,0.0]])
+        pts0.dedupe(index=index,owner='run0')
+        n = pts1.dedupe(index=index,owner='run1',keep=[PointIndex.SM_KEY])
+        self.assertEqual(n,1)
+        np.testing.assert_array_equal(pts1.getArray(),[[1.0,1.0],[0.0,0.0]])
+        # Configuring the same run again doesn't remove its own points
+        self.assertEqual(pts0.dedupe(index=index,owner='run0'),0)
+
+    def test_empty_names(self):
+        pts = ScanPoints([])
+        self.assertEqual(len(pts),0)
+        self.assertEqual(pts.dedupe(),0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+
+import numpy as np
+
+from helpers.DegreeOfFreedom import DegreeOfFreedom
+from helpers.QuadraticFit import QuadraticFit
+from helpers.QuasiRandom import QuasiRandom
+from helpers.ScanType import ScanType
+
+# Makes a dict of DoFs which all have the same limits
+def make_dofs(names,start=0.0,low=-2.0,high=2.0):
+    dofs = {}
+    for name in names:
+        dofs[name] = DegreeOfFreedom(name=name,relations=[[name],1.0])
+        dofs[name].setLimits(start,low,high)
+    return dofs
+
+class TestIterFullScanLinear(unittest.TestCase):
+    def getChunks(self,dofs,npts,chunk_size):
+        return [chunk.getArray() for chunk in ScanType.iterFullScanLinear(dofs,npts,chunk_size=chunk_size)]
+
+    def test_matches_product(self):
+        dofs = make_dofs(['c1','c2','c3'],start=2.0)
+        expected = ScanType.fullScanLinear(dofs,5).getArray()
+        self.assertEqual(len(expected),5**3 - 1)    # The start point is on the grid and gets removed
+        for chunk_size in [1,5,24,25,1000]:
+            chunks = self.getChunks(dofs,5,chunk_size)
+            np.testing.assert_array_equal(np.vstack(chunks),expected)
+
+    def test_chunk_size(self):
+        dofs = make_dofs(['c1','c2','c3'],start=2.0)
+        # Chunks hold a whole number of the trailing DoF blocks, but never less than npts points
+        self.assertEqual(len(self.getChunks(dofs,5,1)),25)
+        self.assertEqual(len(self.getChunks(dofs,5,25)),5)
+        for chunk in self.getChunks(dofs,5,30):
+            self.assertLessEqual(len(chunk),25)
+
+    def test_sm_point_appended(self):
+        # Even number of points, so neither the SM nor the start point are on the grid
+        dofs = make_dofs(['c1','c2'],start=1.0)
+        chunks = self.getChunks(dofs,4,4)
+        np.testing.assert_array_equal(chunks[-1],[[0.0,0.0]])
+        self.assertEqual(sum(len(c) for c in chunks),4**2 + 1)
+
+    def test_no_dofs(self):
+        self.assertEqual(self.getChunks({},5,10),[])
+        self.assertEqual(len(ScanType.fullScanLinear({},5)),0)
+        self.assertEqual(self.getChunks(make_dofs(['c1']),0,10),[])
+
+class TestQuasiRandomScans(unittest.TestCase):
+    def setUp(self):
+        self.dofs = make_dofs(['c1','c2','c3','c4'],start=0.5)
+        self.dofs['c2'].setLimits(0.5,-1.0,5.0)
+        self.dofs['c4'].setLimits(0.5,0.0,0.25)
+
+    def checkBounds(self,pts):
+        self.assertEqual(sorted(pts.getNames()),['c1','c2','c3','c4'])
+        self.assertEqual(pts.getArray().shape[1],4)
+        for name,dof in self.dofs.iteritems():
+            col = pts.getColumn(name)
+            self.assertTrue(np.all(col >= dof.getLow()))
+            self.assertTrue(np.all(col <= dof.getHigh()))
+
+    def test_unit_cube(self):
+        for x in [
+            QuasiRandom.sobol(64,5,seed=1),
+            QuasiRandom.halton(64,5,seed=1),
+            QuasiRandom.latinHypercube(64,5,seed=1),
+        ]:
+            self.assertEqual(x.shape,(64,5))
+            self.assertTrue(np.all((x >= 0) & (x < 1)))
+
+    def test_latin_hypercube_strata(self):
+        x = QuasiRandom.latinHypercube(20,3,seed=2)
+        for d in range(3):
+            self.assertEqual(sorted(np.floor(20*x[:,d]).astype(int).tolist()),range(20))
+
+    def test_bounds(self):
+        for stype in ScanType.getLowDiscrepancyTypes():
+            pts = ScanType.getPoints(self.dofs,30,stype,seed=3)
+            self.checkBounds(pts)
+            # Exactly the requested number of points, plus the SM point
+            self.assertEqual(len(pts),31)
+            np.testing.assert_array_equal(pts.getArray()[-1],np.zeros(4))
+
+    def test_seed(self):
+        for stype in ScanType.getLowDiscrepancyTypes():
+            pts1 = ScanType.getPoints(self.dofs,16,stype,seed=4).getArray()
+            pts2 = ScanType.getPoints(self.dofs,16,stype,seed=4).getArray()
+            pts3 = ScanType.getPoints(self.dofs,16,stype,seed=5).getArray()
+            np.testing.assert_array_equal(pts1,pts2)
+            self.assertFalse(np.array_equal(pts1,pts3))
+
+    def test_sobol_max_dimension(self):
+        self.assertRaises(ValueError,QuasiRandom.sobol,4,QuasiRandom.getMaxSobolDimension()+1)
+
+class TestDOptimalScan(unittest.TestCase):
+    def setUp(self):
+        self.dofs = make_dofs(['c1','c2','c3'],start=1.0)
+        self.dofs['c3'].setLimits(1.0,-0.5,4.0)
+
+    def getPoints(self,npts,seed=6):
+        return ScanType.fullScanDOptimal(self.dofs,npts,seed=seed,verbose=False)
+
+    def test_bounds(self):
+        npts = ScanType.getNumQuadraticTerms(3)
+        pts = self.getPoints(npts)
+        self.assertEqual(pts.getArray().shape[1],3)
+        self.assertLessEqual(len(pts),npts + 1)
+        for name,dof in self.dofs.iteritems():
+            col = pts.getColumn(name)
+            self.assertTrue(np.all(col >= dof.getLow()))
+            self.assertTrue(np.all(col <= dof.getHigh()))
+
+    def test_full_rank(self):
+        # Together with the start point, the design constrains every term of the quadratic
+        npts = ScanType.getMinNumPoints(ScanType.FDOPTIMAL,3,1)
+        pts = self.getPoints(npts)
+        start,low,high = ScanType.getLimitArrays(self.dofs,pts.getNames())
+        design = QuadraticFit.normalize(np.vstack([[start],pts.getArray()]),low,high)
+        X = QuadraticFit.getDesignMatrix(design)
+        self.assertEqual(np.linalg.matrix_rank(X),ScanType.getNumQuadraticTerms(3))
+
+    def test_seed(self):
+        np.testing.assert_array_equal(self.getPoints(12).getArray(),self.getPoints(12).getArray())
+
+class TestPlaneScanLinear(unittest.TestCase):
+    def getPlanePoints(self,npts):
+        pts = ScanType.planeScanLinear(make_dofs(['c1','c2']),npts)
+        arr = pts.getArray()
+        return set(map(tuple,arr[(arr[:,0] != 0) & (arr[:,1] != 0)]))
+
+    def test_odd_npts(self):
+        # The centre of the grid is on both diagonals, but is the SM point so gets dropped from the plane
+        self.assertEqual(self.getPlanePoints(3),set([(-2.0,-2.0),(2.0,2.0),(-2.0,2.0),(2.0,-2.0)]))
+
+    def test_even_npts(self):
+        plane = self.getPlanePoints(4)
+        self.assertEqual(len(plane),8)
+        for x,y in plane:
+            self.assertAlmostEqual(abs(x),abs(y))
+        self.assertEqual(sum(1 for x,y in plane if x == y),4)
+        self.assertEqual(sum(1 for x,y in plane if x == -y),4)
+
+    def test_count_points(self):
+        for npts in [3,4,5]:
+            pts = ScanType.planeScanLinear(make_dofs(['c1','c2','c3']),npts)
+            self.assertLessEqual(len(pts),ScanType.countPoints(ScanType.PLINSPACE,3,npts))
+
+if __name__ == '__main__':
+    unittest.main()
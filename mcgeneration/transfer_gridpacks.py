@@ -1,8 +1,10 @@
 import os
 import subprocess
 from helpers.helper_tools import regex_match,run_process
+from helpers.ProcessRunner import ProcessRunner
 
 #NOTE: This is meant to transfer two files in the format: p_c_r_scanpoints.txt and p_c_r_*_tarball.tar.xz
+#      (plus the binary p_c_r_scanpoints.npy, if present)
 
 # voms-proxy-init -voms cms -valid 192:00
 
@@ -34,20 +36,25 @@ def main():
     c_wl = []
     r_wl = []
 
-    transfer_files = getFilesToTransfer('.',p_wl=p_wl,c_wl=c_wl,r_wl=r_wl)
+    transfer_files = getFilesToTransfer('.',p_wl=p_wl,c_wl=c_wl,r_wl=r_wl)[:MAX_TRANSFERS+1]
+
+    # Get the size and checksum of all the local files at once
+    runner = ProcessRunner(max_workers=8)
+    local_info = getFileInfos(transfer_files,runner)
+    runner.close()
+
     for idx,fn in enumerate(transfer_files):
         if idx > MAX_TRANSFERS:
             break
         bad_copy = False
         remote_fn = protocol+tar_host+tar_dir+fn
-        if "_scanpoints.txt" in fn:
+        if "_scanpoints.txt" in fn or "_scanpoints.npy" in fn:
             remote_fn = protocol+tar_host+tar_dir+scan_dir+fn
 
         print "#"*100
         print "[%d/%d] Transfering File: %s" % (idx+1,len(transfer_files),fn)
         
-        local_sz      = getFileSize(fn)
-        local_chksum  = getCheckSum(fn)
+        local_sz,local_chksum = local_info[fn]
 
         if not dry_run:
             remote_sz     = getFileSize(remote_fn)
@@ -99,7 +106,7 @@ def main():
 
 # Get a list of all (local) files to transfer
 def getFilesToTransfer(fdir='.',p_wl=[],c_wl=[],r_wl=[]):
-    search_strs = ['.*_tarball\.tar\.xz','.*_scanpoints\.txt']
+    search_strs = ['.*_tarball\.tar\.xz','.*_scanpoints\.txt','.*_scanpoints\.npy']
     files = []
     arr = getLocalFiles(fdir)
     for idx,f in enumerate(arr):
@@ -120,9 +127,10 @@ def getFilesToTransfer(fdir='.',p_wl=[],c_wl=[],r_wl=[]):
 
         cross_checks = [
             "%s_%s_%s_slc7_amd64_gcc630_CMSSW_9_3_16_tarball.tar.xz" % (p,c,r),
-            "%s_%s_%s_scanpoints.txt" % (p,c,r)
+            "%s_%s_%s_scanpoints.txt" % (p,c,r),
+            "%s_%s_%s_scanpoints.npy" % (p,c,r)
         ]
-        if not os.path.exists(cross_checks[0]) or not os.path.exists(cross_checks[1]):
+        if not os.path.exists(cross_checks[0]) or not (os.path.exists(cross_checks[1]) or os.path.exists(cross_checks[2])):
             # The file is missing a complement
             continue
         files.append(f)
@@ -149,6 +157,9 @@ def getRemoteFiles(fdir):
 # Returns the target file size using gfal-stat
 def getFileSize(f):
     arr = run_process(['gfal-stat',f],verbose=False)
+    return parseFileSize(arr)
+
+def parseFileSize(arr):
     if len(arr) < 2:
         return -1
 
@@ -160,10 +171,22 @@ def getFileSize(f):
 # Returns the MD5 checksum of target file using gfal-sum
 def getCheckSum(f):
     arr = run_process(['gfal-sum',f,'MD5'],verbose=False)
+    return parseCheckSum(arr)
+
+def parseCheckSum(arr):
     if len(arr) != 1:
         return -1
     return arr[0].split()[1]
 
+# Returns a dictionary of {file: (size,checksum)}, with the gfal calls for all files run in parallel
+def getFileInfos(files,runner):
+    sizes = [runner.submit(['gfal-stat',f],max_lines=None) for f in files]
+    sums  = [runner.submit(['gfal-sum',f,'MD5'],max_lines=None) for f in files]
+    infos = {}
+    for f,sz,chksum in zip(files,sizes,sums):
+        infos[f] = (parseFileSize(sz.get().stdout),parseCheckSum(chksum.get().stdout))
+    return infos
+
 #def run_process(inputs,verbose=True,indent=0):
 #    indent_str = "\t"*indent
 #    if verbose: